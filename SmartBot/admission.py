@@ -0,0 +1,175 @@
+# admission.py
+import os
+import json
+import time
+import asyncio
+import logging
+import contextlib
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+# Updates are processed concurrently, but each priority class (lane) has
+# its own concurrency limit and a bounded wait queue, so a burst of
+# reports can't delay cheap writes. An update whose lane queue is full is
+# answered with BUSY_TEXT at once instead of waiting.
+#   write - expense/budget writes, conversation steps, quick add
+#   read  - expense lists and search
+#   heavy - reports and /start-style WebApp payload building
+# Limits: ADMISSION_<LANE>_CONCURRENCY / ADMISSION_<LANE>_QUEUE.
+# Updates of one user still run one at a time, in arrival order (a lock
+# per user, taken before the lane slot): ConversationHandler state,
+# context.user_data and the order of a user's writes depend on it. An
+# update waiting on its user's lock counts toward its lane queue, and a
+# user with ADMISSION_USER_QUEUE updates already waiting is shed too, so
+# one user's burst can't queue without bound.
+_DEFAULTS = {"write": (16, 256), "read": (8, 32), "heavy": (2, 8)}
+LIMITS = {
+    lane: (
+        int(os.getenv(f"ADMISSION_{lane.upper()}_CONCURRENCY", str(concurrency))),
+        int(os.getenv(f"ADMISSION_{lane.upper()}_QUEUE", str(queue))),
+    )
+    for lane, (concurrency, queue) in _DEFAULTS.items()
+}
+USER_QUEUE = int(os.getenv("ADMISSION_USER_QUEUE", "2"))
+BUSY_TEXT = "⏳ Busy right now — please try again in a moment."
+
+HEAVY_COMMANDS = {"start", "s", "report", "r", "view_budget", "v_budget", "vb", "budget", "expense"}
+READ_COMMANDS = {"view_expenses", "view", "v", "search", "find"}
+HEAVY_TEXTS = {"Budget", "Expense", "Report"}  # reply keyboard taps -> start_command
+WEBAPP_LANES = {"expense.add": "write", "budget.save": "write", "expense.view": "read", "expense.search": "read"}
+
+
+def classify(update) -> str:
+    """Lane of an update (unknown kinds count as cheap writes)."""
+    if not isinstance(update, Update):
+        return "write"
+    if update.callback_query:
+        return "read"
+    msg = update.effective_message
+    if msg is None:
+        return "write"
+    if msg.web_app_data:
+        try:
+            kind = json.loads(msg.web_app_data.data).get("type")
+        except (ValueError, AttributeError):
+            return "write"
+        return WEBAPP_LANES.get(kind, "read")
+    text = (msg.text or "").strip()
+    if text.startswith("/"):
+        command = (text[1:].split() or [""])[0].split("@", 1)[0].lower()
+        if command in HEAVY_COMMANDS:
+            return "heavy"
+        if command in READ_COMMANDS:
+            return "read"
+        return "write"
+    return "heavy" if text in HEAVY_TEXTS else "write"
+
+
+class _Lane:
+    __slots__ = ("name", "slots", "queue", "waiting", "running")
+
+    def __init__(self, name: str, concurrency: int, queue: int):
+        self.name = name
+        self.slots = asyncio.Semaphore(concurrency)
+        self.queue = queue
+        self.waiting = 0
+        self.running = 0
+
+    def publish(self):
+        metrics.gauge(f"admission.{self.name}.waiting", self.waiting)
+        metrics.gauge(f"admission.{self.name}.running", self.running)
+
+
+class AdmissionProcessor(BaseUpdateProcessor):
+    """Update processor for ApplicationBuilder.concurrent_updates()."""
+
+    __slots__ = ("lanes", "users", "user_queue")
+
+    def __init__(self, limits: dict = None, user_queue: int = None):
+        limits = limits or LIMITS
+        # The base class cap only has to stay out of the way of the lanes.
+        super().__init__(sum(c + q for c, q in limits.values()) + 1)
+        self.lanes = {name: _Lane(name, c, q) for name, (c, q) in limits.items()}
+        self.users = {}  # user or chat id -> [asyncio.Lock, updates holding or waiting]
+        self.user_queue = USER_QUEUE if user_queue is None else user_queue
+
+    async def initialize(self):
+        for lane in self.lanes.values():
+            lane.publish()
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        lane = self.lanes[classify(update)]
+        key = _serial_key(update)
+        entry = self.users.get(key)
+        pending = entry[1] if entry else 0
+        if pending > self.user_queue or (
+            lane.waiting >= lane.queue and (pending or lane.slots.locked())
+        ):
+            metrics.inc(f"admission.{lane.name}.shed")
+            if hasattr(coroutine, "close"):
+                coroutine.close()
+            await _reply_busy(update)
+            return
+
+        if key is not None and entry is None:
+            entry = self.users[key] = [asyncio.Lock(), 0]
+        if entry:
+            entry[1] += 1
+        lane.waiting += 1
+        lane.publish()
+        queued_at = time.monotonic()
+        waiting = True
+        try:
+            async with entry[0] if entry else contextlib.nullcontext():
+                await lane.slots.acquire()
+                lane.waiting -= 1
+                waiting = False
+                await self._run(lane, coroutine, queued_at)
+        finally:
+            if waiting:
+                lane.waiting -= 1
+                lane.publish()
+            if entry:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.users[key]
+
+    async def _run(self, lane, coroutine, queued_at: float):
+        metrics.observe(f"admission.{lane.name}.wait", time.monotonic() - queued_at)
+        metrics.inc(f"admission.{lane.name}.admitted")
+        lane.running += 1
+        lane.publish()
+        started = time.monotonic()
+        try:
+            await coroutine
+        finally:
+            lane.running -= 1
+            lane.slots.release()
+            lane.publish()
+            metrics.observe(f"admission.{lane.name}.run", time.monotonic() - started)
+
+
+def _serial_key(update):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+async def _reply_busy(update):
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(BUSY_TEXT)
+        elif update.effective_message:
+            await update.effective_message.reply_text(BUSY_TEXT)
+    except Exception:
+        logging.exception("Could not send busy reply")
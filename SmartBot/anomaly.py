@@ -0,0 +1,176 @@
+# anomaly.py
+import io
+import os
+import math
+import asyncio
+import logging
+from datetime import date
+
+import numpy as np
+
+from database import get_db_connection, fan_out
+from forecast import fetch_columns
+
+BASELINE_JOB = "category_baselines"
+BASELINE_DAYS = int(os.getenv("ANOMALY_BASELINE_DAYS", "180"))
+MIN_SAMPLES = int(os.getenv("ANOMALY_MIN_SAMPLES", "5"))
+# Flag when amount > typical * max(exp(K * sigma), MIN_RATIO), in log space.
+SIGMA_K = float(os.getenv("ANOMALY_SIGMA_K", "3"))
+MIN_RATIO = float(os.getenv("ANOMALY_MIN_RATIO", "3"))
+
+# (user_id, category_id) -> (typical, threshold). Rebuilt wholesale by the
+# nightly job; read on every expense insert.
+_baselines = {}
+
+
+def compute_baselines(gid, n, log_sum, log_sumsq, groups: int):
+    """
+    Vectorized per-group baselines from daily log-space aggregates.
+    Returns (count, typical, threshold) arrays of length `groups`.
+    """
+    count = np.bincount(gid, weights=n, minlength=groups)
+    s1 = np.bincount(gid, weights=log_sum, minlength=groups)
+    s2 = np.bincount(gid, weights=log_sumsq, minlength=groups)
+    safe = np.maximum(count, 1)
+    mu = s1 / safe
+    sigma = np.sqrt(np.maximum(s2 / safe - mu * mu, 0.0))
+    typical = np.exp(mu)
+    threshold = typical * np.maximum(np.exp(SIGMA_K * sigma), MIN_RATIO)
+    return count, typical, threshold
+
+
+def run_baselines(today: date = None, force: bool = False) -> int:
+    """
+    Rebuild category_baselines from daily_spend on every shard and refresh
+    the in-memory cache. If today's run is already done, only the cache is
+    loaded.
+    """
+    cache = {}
+    for part in fan_out(_run_shard_baselines, today or date.today(), force):
+        cache.update(part)
+    _baselines.clear()
+    _baselines.update(cache)
+    logging.info("Category baselines: %s loaded.", len(_baselines))
+    return len(_baselines)
+
+
+def _run_shard_baselines(shard: int, today: date, force: bool) -> dict:
+    """One shard's rebuild; returns its {(user_id, category_id): (typical, threshold)}."""
+    since = date.fromordinal(today.toordinal() - BASELINE_DAYS)
+
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT done FROM job_checkpoints WHERE job_name = %s AND run_key = %s",
+                (BASELINE_JOB, today),
+            )
+            row = cur.fetchone()
+    if row and row[0] and not force:
+        return _load_shard_baselines(shard)
+
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor(name="baseline_daily") as cur:
+            uid, cid, n, log_sum, log_sumsq = fetch_columns(
+                cur,
+                """
+                SELECT user_id, category_id, n, log_sum, log_sumsq
+                FROM daily_spend
+                WHERE day >= %s AND category_id <> 0 AND n > 0
+                """,
+                (since,),
+                5,
+            )
+
+    if not uid.size:
+        return {}
+
+    keys, gid = np.unique(np.stack([uid, cid], axis=1).astype(np.int64), axis=0, return_inverse=True)
+    count, typical, threshold = compute_baselines(gid.ravel(), n, log_sum, log_sumsq, len(keys))
+    keep = count >= MIN_SAMPLES
+    keys, count, typical, threshold = keys[keep], count[keep], typical[keep], threshold[keep]
+
+    buf = io.StringIO()
+    buf.writelines(
+        f"{u}\t{c}\t{int(k)}\t{t:.2f}\t{h:.2f}\n"
+        for (u, c), k, t, h in zip(keys.tolist(), count.tolist(), typical.tolist(), threshold.tolist())
+    )
+    buf.seek(0)
+
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "CREATE TEMP TABLE baseline_stage (LIKE category_baselines INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            cur.copy_expert(
+                "COPY baseline_stage (user_id, category_id, n, typical, threshold) FROM STDIN", buf
+            )
+            cur.execute("DELETE FROM category_baselines")
+            cur.execute(
+                """
+                INSERT INTO category_baselines (user_id, category_id, n, typical, threshold)
+                SELECT s.user_id, s.category_id, s.n, s.typical, s.threshold
+                FROM baseline_stage s
+                JOIN categories c ON c.id = s.category_id
+                """
+            )
+            cur.execute(
+                """
+                INSERT INTO job_checkpoints (job_name, run_key, done)
+                VALUES (%s, %s, TRUE)
+                ON CONFLICT (job_name, run_key) DO UPDATE SET done = TRUE, updated_at = CURRENT_TIMESTAMP
+                """,
+                (BASELINE_JOB, today),
+            )
+
+    return dict(zip(map(tuple, keys.tolist()), zip(typical.tolist(), threshold.tolist())))
+
+
+def load_baselines() -> int:
+    """Fill the cache from category_baselines on every shard (startup path)."""
+    cache = {}
+    for part in fan_out(_load_shard_baselines):
+        cache.update(part)
+    _baselines.clear()
+    _baselines.update(cache)
+    return len(cache)
+
+
+def _load_shard_baselines(shard: int) -> dict:
+    cache = {}
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor(name="baseline_load") as cur:
+            cur.itersize = 100000
+            cur.execute("SELECT user_id, category_id, typical, threshold FROM category_baselines")
+            for user_id, category_id, typical, threshold in cur:
+                cache[(user_id, category_id)] = (float(typical), float(threshold))
+    return cache
+
+
+def forget(user_id: int, category_ids):
+    """Drop cached baselines of deleted (merged) categories."""
+    for category_id in category_ids:
+        _baselines.pop((user_id, category_id), None)
+
+
+def check_expense(user_id: int, category_id: int, amount) -> str:
+    """
+    Constant-time check of a new expense against the cached baseline.
+    Returns a short warning for the reply, or None.
+    """
+    baseline = _baselines.get((user_id, category_id))
+    if baseline is None:
+        return None
+    typical, threshold = baseline
+    amount = float(amount)
+    if amount <= threshold:
+        return None
+    ratio = amount / typical if typical > 0 else math.inf
+    return f"⚠️ Unusually high: about {ratio:.0f}x your typical {typical:.2f} here."
+
+
+async def baseline_job(context):
+    """JobQueue callback (nightly)."""
+    try:
+        await asyncio.to_thread(run_baselines)
+    except Exception:
+        logging.exception("Baseline job failed")
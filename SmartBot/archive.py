@@ -0,0 +1,220 @@
+# archive.py
+import os
+import asyncio
+import logging
+from datetime import date, timezone
+from decimal import Decimal
+
+import numpy as np
+
+import metrics
+from database import current_period, fan_out, get_db_connection
+
+# Cold storage for old expenses (Postgres backend). Nightly, the expenses of
+# months that ended more than ARCHIVE_AFTER_MONTHS months ago are moved out
+# of the expenses table into one compressed columnar file per user and
+# month (np.savez_compressed, one array per column):
+#   ARCHIVE_DIR/<user_id % 1000>/<user_id>/<YYYY-MM>.npz
+# and expense_archive records the month. daily_spend and budgets stay, so
+# reports, digests, forecasts and baselines cover archived months as
+# before; /export reads the files back one month at a time. Archived
+# expenses are read-only: /bulk, /delete, /view and /search see the
+# expenses table only. 0 (the default) turns archiving off.
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_BATCH_USERS = int(os.getenv("ARCHIVE_BATCH_USERS", "500"))
+ARCHIVE_JOB = "expense_archive"
+
+# Row layout of read_month() and the files (amounts in cents; 0, "" and
+# NaT stand for NULL). base_amount is in the base currency the user had
+# when the month was archived; files from before it was kept read it as NULL.
+ARCHIVE_COLUMNS = ("id", "category_id", "amount", "currency", "base_amount", "description", "date",
+                   "day", "is_anomaly", "recurring_rule_id", "recurring_due")
+
+# Writers of a user's files hold this for the rest of their transaction,
+# so the archive job and a category merge never rewrite one concurrently.
+_LOCK_SQL = "SELECT pg_advisory_xact_lock(%s)"
+
+# A chunk of users with the months they have before the cutoff (none: NULL).
+_CANDIDATES_SQL = """
+SELECT u.user_id, m.period_month
+FROM (
+    SELECT user_id FROM users WHERE user_id > %(after)s ORDER BY user_id LIMIT %(limit)s
+) u
+LEFT JOIN LATERAL (
+    SELECT DISTINCT period_month FROM expenses e
+    WHERE e.user_id = u.user_id AND e.period_month < %(before)s
+) m ON TRUE
+ORDER BY u.user_id, m.period_month
+"""
+
+
+def archive_path(user_id: int, period: date) -> str:
+    return os.path.join(ARCHIVE_DIR, f"{user_id % 1000:03d}", str(user_id), f"{period:%Y-%m}.npz")
+
+
+def _pack(rows) -> dict:
+    ids, cats, amounts, currencies, bases, descriptions, dates, days, anomalies, rules, dues = zip(*rows)
+    return {
+        "id": np.array(ids, dtype=np.int64),
+        "category_id": np.array([c or 0 for c in cats], dtype=np.int64),
+        "amount": np.array([int(a * 100) for a in amounts], dtype=np.int64),
+        "currency": np.array([c or "" for c in currencies], dtype="<U3"),
+        "base_amount": np.array([int((b or 0) * 100) for b in bases], dtype=np.int64),
+        "description": np.array([d or "" for d in descriptions], dtype=np.str_),
+        "date": np.array(
+            [d.astimezone(timezone.utc).replace(tzinfo=None) for d in dates], dtype="datetime64[us]"
+        ),
+        "day": np.array(days, dtype="datetime64[D]"),
+        "is_anomaly": np.array(anomalies, dtype=bool),
+        "recurring_rule_id": np.array([r or 0 for r in rules], dtype=np.int64),
+        "recurring_due": np.array(dues, dtype="datetime64[D]"),
+    }
+
+
+def _unpack(arrays) -> list:
+    n = len(arrays["id"])
+    columns = [
+        arrays[name].tolist() if name in arrays else [0] * n for name in ARCHIVE_COLUMNS
+    ]
+    return [
+        (id_, cat or None, Decimal(cents).scaleb(-2), cur or None,
+         Decimal(base).scaleb(-2) if base else None, desc or None,
+         when.replace(tzinfo=timezone.utc), day, anomaly, rule or None, due)
+        for id_, cat, cents, cur, base, desc, when, day, anomaly, rule, due in zip(*columns)
+    ]
+
+
+def read_month(user_id: int, period: date) -> list:
+    """The user's archived expenses of month `period` (ARCHIVE_COLUMNS), oldest first."""
+    try:
+        with np.load(archive_path(user_id, period), allow_pickle=False) as arrays:
+            return _unpack(arrays)
+    except FileNotFoundError:
+        return []
+
+
+def archived_months(user_id: int) -> list:
+    """Months with an archive file, oldest first."""
+    try:
+        names = os.listdir(os.path.dirname(archive_path(user_id, date.min)))
+    except FileNotFoundError:
+        return []
+    return sorted(date.fromisoformat(n[:7] + "-01") for n in names if n.endswith(".npz"))
+
+
+def iter_archived(user_id: int):
+    """All of the user's archived expenses, loaded one month at a time."""
+    for period in archived_months(user_id):
+        yield from read_month(user_id, period)
+
+
+def _save(path: str, rows):
+    # Written aside and renamed, so readers see the old file or the new one.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **_pack(rows))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _archive_month(user_id: int, period: date) -> int:
+    """
+    Move one user-month to its file. The file is written before the rows
+    are deleted and rows already in it are replaced by id, so a run that
+    fails halfway is redone by the next one.
+    """
+    with get_db_connection(user_id) as conn:
+        with conn.cursor() as cur:
+            cur.execute(_LOCK_SQL, (user_id,))
+            cur.execute(
+                f"""
+                SELECT {", ".join(ARCHIVE_COLUMNS)} FROM expenses
+                WHERE user_id = %s AND period_month = %s
+                ORDER BY id
+                FOR UPDATE
+                """,
+                (user_id, period),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                return 0
+            merged = {row[0]: row for row in read_month(user_id, period)}
+            merged.update((row[0], row) for row in rows)
+            _save(archive_path(user_id, period), sorted(merged.values(), key=lambda r: (r[6], r[0])))
+            cur.execute(
+                """
+                WITH gone AS (
+                    DELETE FROM expenses WHERE user_id = %(uid)s AND id = ANY(%(ids)s)
+                )
+                INSERT INTO expense_archive (user_id, period_month, n)
+                VALUES (%(uid)s, %(period)s, %(n)s)
+                ON CONFLICT (user_id, period_month)
+                DO UPDATE SET n = EXCLUDED.n, archived_at = CURRENT_TIMESTAMP
+                """,
+                {"uid": user_id, "period": period, "n": len(merged), "ids": [r[0] for r in rows]},
+            )
+    metrics.inc("archive.months")
+    metrics.inc("archive.expenses", len(rows))
+    return len(rows)
+
+
+def _archive_shard(shard: int, before: date) -> int:
+    after, moved = 0, 0
+    while True:
+        with get_db_connection(shard=shard) as conn:
+            with conn.cursor() as cur:
+                cur.execute(_CANDIDATES_SQL, {"after": after, "limit": ARCHIVE_BATCH_USERS, "before": before})
+                rows = cur.fetchall()
+        if not rows:
+            return moved
+        for user_id, period in rows:
+            if period is not None:
+                moved += _archive_month(user_id, period)
+        after = rows[-1][0]
+
+
+def archive_expenses(before: date = None) -> int:
+    """
+    Archive every user's expenses of months before `before` (default:
+    ARCHIVE_AFTER_MONTHS before this month) on all shards; returns how many.
+    """
+    if before is None:
+        period = current_period()
+        index = period.year * 12 + period.month - 1 - ARCHIVE_AFTER_MONTHS
+        before = date(index // 12, index % 12 + 1, 1)
+    moved = sum(fan_out(_archive_shard, before))
+    logging.info("Expense archive: %s expenses before %s moved to %s.", moved, before, ARCHIVE_DIR)
+    return moved
+
+
+def recategorize(user_id: int, source_ids, target_id: int) -> int:
+    """Point archived expenses of merged categories at the target; returns files rewritten."""
+    months = archived_months(user_id)
+    if not months:
+        return 0
+    sources = np.array(list(source_ids), dtype=np.int64)
+    rewritten = 0
+    with get_db_connection(user_id) as conn:
+        with conn.cursor() as cur:
+            cur.execute(_LOCK_SQL, (user_id,))
+            for period in months:
+                path = archive_path(user_id, period)
+                with np.load(path, allow_pickle=False) as npz:
+                    arrays = {name: npz[name] for name in npz.files}
+                moved = np.isin(arrays["category_id"], sources)
+                if moved.any():
+                    arrays["category_id"][moved] = target_id
+                    _save(path, _unpack(arrays))
+                    rewritten += 1
+    return rewritten
+
+
+async def archive_job(context):
+    """JobQueue callback (nightly)."""
+    try:
+        await asyncio.to_thread(archive_expenses)
+    except Exception:
+        logging.exception("Expense archive job failed")
@@ -0,0 +1,70 @@
+# benchmarks/bench_forecast.py
+"""
+Benchmark the nightly forecast batch (NumPy part + COPY staging) on
+synthetic daily aggregates.
+
+    python benchmarks/bench_forecast.py --users 100000
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import date
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from forecast import HISTORY_DAYS, project_month_end, _stage_rows  # noqa: E402
+
+
+def synthetic_aggregates(users, cats_per_user, active_ratio, today, seed=7):
+    rng = np.random.default_rng(seed)
+    days = HISTORY_DAYS + today.day
+    groups = users * cats_per_user
+
+    # Each group spends on roughly `active_ratio` of the days.
+    per_group = rng.binomial(days, active_ratio, size=groups)
+    gid = np.repeat(np.arange(groups), per_group)
+    offset = -rng.integers(0, days, size=gid.size)
+    scale = rng.lognormal(3.0, 1.0, size=groups)
+    amount = rng.gamma(2.0, 1.0, size=gid.size) * scale[gid]
+    budget = np.where(rng.random(groups) < 0.7, scale * 12, 0.0)
+    uid = np.repeat(np.arange(1, users + 1), cats_per_user)
+    cid = np.tile(np.arange(1, cats_per_user + 1), users)
+    return gid, offset, amount, budget, uid, cid
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--categories", type=int, default=6)
+    parser.add_argument("--active-ratio", type=float, default=0.25)
+    parser.add_argument("--day", type=int, default=17, help="day of month to project from")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    today = date.today().replace(day=args.day)
+    gid, offset, amount, budget, uid, cid = synthetic_aggregates(
+        args.users, args.categories, args.active_ratio, today
+    )
+    print(f"users={args.users} groups={budget.size} daily rows={gid.size} today={today}")
+
+    best_project = best_stage = float("inf")
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        projected, overrun = project_month_end(gid, offset, amount, budget, today)
+        t1 = time.perf_counter()
+        _stage_rows(uid, cid, today.replace(day=1), projected, overrun, today)
+        t2 = time.perf_counter()
+        best_project = min(best_project, t1 - t0)
+        best_stage = min(best_stage, t2 - t1)
+
+    print(f"project_month_end: {best_project * 1000:8.1f} ms")
+    print(f"COPY staging:      {best_stage * 1000:8.1f} ms")
+    print(f"total:             {(best_project + best_stage) * 1000:8.1f} ms "
+          f"({(best_project + best_stage) / args.users * 1e6:.2f} us/user)")
+
+
+if __name__ == "__main__":
+    main()
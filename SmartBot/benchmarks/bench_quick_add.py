@@ -0,0 +1,119 @@
+# benchmarks/bench_quick_add.py
+"""
+Messages and DB round trips per expense: /add conversation vs quick add.
+
+Runs against the database configured in .env (DB_*). Writes expenses for
+a throwaway user id, which is removed at the end.
+
+    python benchmarks/bench_quick_add.py --expenses 50
+"""
+import os
+import sys
+import time
+import argparse
+
+import psycopg2
+import psycopg2.extensions
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+from database import (  # noqa: E402
+    get_db_connection,
+    ensure_default_categories,
+    get_or_create_category_id,
+    insert_expense,
+)
+from handlers import get_expense_categories  # noqa: E402
+from statements import StatementConnection  # noqa: E402
+from quick_add import save_quick_add  # noqa: E402
+
+BENCH_USER_ID = -424242
+
+# Updates the user sends / replies the bot sends for one expense.
+# /add -> amount -> category -> description, each answered by the bot.
+LEGACY_MESSAGES = (4, 4)
+QUICK_ADD_MESSAGES = (1, 1)  # per message, whatever the number of lines
+
+
+class Counter:
+    round_trips = 0
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        Counter.round_trips += 1
+        return super().execute(query, vars)
+
+
+class CountingConnection(StatementConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        Counter.round_trips += 1  # connect/auth exchange
+        self.cursor_factory = CountingCursor
+
+    def commit(self):
+        Counter.round_trips += 1
+        return super().commit()
+
+
+def _connect(*args, **kwargs):
+    kwargs["connection_factory"] = CountingConnection
+    return _real_connect(*args, **kwargs)
+
+
+_real_connect = psycopg2.connect
+database.psycopg2.connect = _connect
+
+
+def legacy_flow(n: int):
+    for i in range(n):
+        get_expense_categories(BENCH_USER_ID)  # amount step builds the keyboard
+        with get_db_connection(BENCH_USER_ID) as conn:      # description step saves
+            with conn.cursor() as cur:
+                cat_id = get_or_create_category_id(cur, BENCH_USER_ID, "Food")
+                insert_expense(cur, BENCH_USER_ID, cat_id, 10 + i, f"lunch {i}")
+
+
+def quick_add(n: int):
+    save_quick_add(BENCH_USER_ID, "\n".join(f"{10 + i} Food lunch {i}" for i in range(n)))
+
+
+def measure(fn, n: int):
+    Counter.round_trips = 0
+    t0 = time.perf_counter()
+    fn(n)
+    return Counter.round_trips, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--expenses", type=int, default=50)
+    args = parser.parse_args()
+    n = args.expenses
+
+    with get_db_connection(BENCH_USER_ID) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO users (user_id, first_name) VALUES (%s, 'bench') ON CONFLICT DO NOTHING",
+                (BENCH_USER_ID,),
+            )
+    ensure_default_categories(BENCH_USER_ID)
+    try:
+        legacy_rt, legacy_s = measure(legacy_flow, n)
+        quick_rt, quick_s = measure(quick_add, n)
+    finally:
+        with get_db_connection(BENCH_USER_ID) as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM users WHERE user_id = %s", (BENCH_USER_ID,))
+
+    print(f"{n} expenses")
+    print(f"{'flow':<12}{'msgs in/exp':>12}{'msgs out/exp':>14}{'DB rt/exp':>11}{'ms/exp':>9}")
+    print(f"{'/add':<12}{LEGACY_MESSAGES[0]:>12.2f}{LEGACY_MESSAGES[1]:>14.2f}"
+          f"{legacy_rt / n:>11.2f}{legacy_s / n * 1000:>9.2f}")
+    print(f"{'quick add':<12}{QUICK_ADD_MESSAGES[0] / n:>12.2f}{QUICK_ADD_MESSAGES[1] / n:>14.2f}"
+          f"{quick_rt / n:>11.2f}{quick_s / n * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
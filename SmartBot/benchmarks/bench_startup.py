@@ -0,0 +1,125 @@
+# benchmarks/bench_startup.py
+"""
+Cold start vs. warmed start: time until the bot could take its first
+update, and the latency of the first requests of recently active users.
+
+Each start runs in a fresh process (empty caches, no connections):
+  cold  - setup only, as before warm-up existed
+  warm  - setup + warmup.warm_up(), as main() does now
+A "request" is what a quick add costs: the category keyboard, a
+categorizer suggestion, the quick-add write and the last-10 list.
+
+Runs against the Postgres database configured in .env (DB_*); warm-up
+is about its connection pools, so other backends are refused. Seeds
+throwaway users with recent expenses, which are removed at the end.
+
+    python benchmarks/bench_startup.py --users 50 --requests 20
+"""
+import time
+
+T0 = time.perf_counter()
+
+import os  # noqa: E402
+import sys  # noqa: E402
+import json  # noqa: E402
+import argparse  # noqa: E402
+import subprocess  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_USER_BASE = -450000
+WORDS = ["lunch", "coffee", "taxi", "bus", "cinema", "bread", "milk", "pharmacy", "rent", "phone"]
+CATEGORIES = ["Food", "Food", "Transport", "Transport", "Entertainment", "Groceries",
+              "Groceries", "Medical Treatment", "Rent", "Internet/Phone"]
+
+
+def bench_users(n: int):
+    return [BENCH_USER_BASE - i for i in range(n)]
+
+
+def seed(n: int, per_user: int = 30):
+    from repository import get_repository
+    repo = get_repository()
+    repo.setup()
+    for uid in bench_users(n):
+        with repo.write(uid) as store:
+            store.upsert_user("bench")
+            store.ensure_default_categories()
+            ids = {name: store.category_id(name) for name in set(CATEGORIES)}
+            store.add_expenses([
+                (ids[CATEGORIES[i % len(WORDS)]], 5 + i, f"{WORDS[i % len(WORDS)]} {i}", False, None, None)
+                for i in range(per_user)
+            ])
+
+
+def cleanup(n: int):
+    from database import get_db_connection
+    for uid in bench_users(n):
+        with get_db_connection(uid) as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM webapp_requests WHERE user_id = %s", (uid,))
+                cur.execute("DELETE FROM users WHERE user_id = %s", (uid,))
+
+
+def child(mode: str, users: int, requests: int):
+    """One bot start in this process; prints its timings as JSON."""
+    from repository import get_repository
+    from handlers import get_expense_categories
+    from categorizer import suggest_category
+    from quick_add import save_quick_add
+    from warmup import warm_up
+
+    get_repository().setup()
+    if mode == "warm":
+        warm_up(users)
+    ready = time.perf_counter() - T0
+
+    latencies = []
+    for uid in bench_users(users)[:requests]:
+        t0 = time.perf_counter()
+        get_expense_categories(uid)
+        suggest_category(uid, "lunch sandwich")
+        save_quick_add(uid, "12.50 Food lunch sandwich")
+        with get_repository().read(uid) as store:
+            store.recent_expenses(10)
+        latencies.append(time.perf_counter() - t0)
+    print(json.dumps({"ready": ready, "latencies": latencies}))
+
+
+def run(mode: str, users: int, requests: int) -> dict:
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode,
+         "--users", str(users), "--requests", str(requests)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--child", choices=["cold", "warm"])
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.users, args.requests)
+        return
+
+    from repository import get_repository
+    if get_repository().name != "postgres":
+        sys.exit("bench_startup measures Postgres warm-up; set STORAGE_BACKEND=postgres.")
+    seed(args.users)
+    try:
+        results = {mode: run(mode, args.users, args.requests) for mode in ("cold", "warm")}
+    finally:
+        cleanup(args.users)
+
+    print(f"{args.users} recently active users, first {args.requests} requests")
+    print(f"{'start':<8}{'ready s':>9}{'1st req ms':>12}{'mean ms':>9}{'max ms':>9}")
+    for mode, r in results.items():
+        lat = [x * 1000 for x in r["latencies"]]
+        print(f"{mode:<8}{r['ready']:>9.2f}{lat[0]:>12.2f}{sum(lat) / len(lat):>9.2f}{max(lat):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
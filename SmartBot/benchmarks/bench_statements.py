@@ -0,0 +1,100 @@
+# benchmarks/bench_statements.py
+"""
+Parse/plan savings of the prepared hot statements (statements.py): each
+one is run N times as a plain query and N times via EXECUTE on the same
+connection. "plan ms" is the server's planning time for one plain run
+(EXPLAIN SUMMARY), which is the part a prepared statement stops paying.
+
+Runs against the database configured in .env (DB_*) for a throwaway
+user inside one transaction that is rolled back at the end.
+
+    python benchmarks/bench_statements.py --runs 2000
+"""
+import os
+import re
+import sys
+import time
+import argparse
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import statements  # noqa: E402
+from statements import STATEMENTS  # noqa: E402
+from database import get_db_connection, get_or_create_category_id, DEFAULT_CATEGORIES  # noqa: E402
+
+BENCH_USER_ID = -434343
+_PARAM_RE = re.compile(r"\$(\d+)")
+
+
+def params_for(name: str, category_id: int):
+    period = date.today().replace(day=1)
+    return {
+        "category_id": (BENCH_USER_ID, "Food"),
+        "insert_expense": (BENCH_USER_ID, category_id, 12.5, "bench lunch", False, None, None),
+        "recent_expenses": (BENCH_USER_ID, 10),
+        "budget_items": (BENCH_USER_ID, period),
+    }[name]
+
+
+def plain_sql(name: str) -> str:
+    """The registered SQL with $n turned into psycopg2 %(n)s placeholders."""
+    return _PARAM_RE.sub(r"%(\1)s", STATEMENTS[name][1])
+
+
+def timed(fn, runs: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - t0) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=2000)
+    args = parser.parse_args()
+
+    results = []
+    with get_db_connection(BENCH_USER_ID) as conn:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO users (user_id, first_name) VALUES (%s, 'bench')", (BENCH_USER_ID,))
+            for name in DEFAULT_CATEGORIES:
+                get_or_create_category_id(cur, BENCH_USER_ID, name)
+            category_id = get_or_create_category_id(cur, BENCH_USER_ID, "Food")
+            cur.execute(
+                "INSERT INTO budgets (user_id, category_id, amount, period_month) VALUES (%s, %s, 100, %s)",
+                (BENCH_USER_ID, category_id, date.today().replace(day=1)),
+            )
+
+            for name in STATEMENTS:
+                params = params_for(name, category_id)
+                named = {str(i + 1): p for i, p in enumerate(params)}
+                sql = plain_sql(name)
+
+                cur.execute("EXPLAIN (SUMMARY) " + sql, named)
+                plan = next(
+                    float(line.split(":")[1].split()[0])
+                    for (line,) in cur.fetchall() if line.startswith("Planning Time")
+                )
+
+                def plain():
+                    cur.execute(sql, named)
+                    cur.fetchall()
+
+                def prepared():
+                    statements.execute(cur, name, params)
+                    cur.fetchall()
+
+                statements.prepare(cur, name)
+                results.append((name, plan, timed(plain, args.runs), timed(prepared, args.runs)))
+        conn.rollback()
+
+    print(f"{args.runs} runs per statement")
+    print(f"{'statement':<18}{'plan ms':>9}{'plain ms':>10}{'prepared ms':>13}{'saved':>8}")
+    for name, plan, plain_ms, prepared_ms in results:
+        saved = (plain_ms - prepared_ms) / plain_ms * 100
+        print(f"{name:<18}{plan:>9.3f}{plain_ms:>10.3f}{prepared_ms:>13.3f}{saved:>7.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# breaker.py
+import os
+import time
+import random
+import logging
+import threading
+
+import psycopg2
+
+import metrics
+
+# Every database endpoint (shard primary or replica) checks connections
+# out through a circuit breaker. DB_BREAKER_FAILURES failures in a row
+# (refused or timed-out connects, connections lost mid-query) open it:
+# for DB_BREAKER_OPEN_SECONDS every checkout fails at once with
+# DatabaseUnavailable instead of waiting on the connect timeout. After
+# that one caller at a time probes (half-open); success closes it, a
+# failure opens it again. A failed connect is retried up to
+# DB_CONNECT_RETRIES times after a random pause of up to
+# DB_RETRY_BASE_SECONDS (doubling per retry), so clients don't all
+# reconnect in lockstep while the server restarts. Handlers reach the
+# database from worker threads (asyncio.to_thread), never the event loop.
+# State changes are logged and counted as "db.breaker.<endpoint>.<state>";
+# the gauge "db.breaker.<endpoint>.state" is 0 closed, 1 half-open, 2 open.
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", "5"))
+DB_BREAKER_OPEN_SECONDS = float(os.getenv("DB_BREAKER_OPEN_SECONDS", "15"))
+DB_CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", "2"))
+DB_RETRY_BASE_SECONDS = float(os.getenv("DB_RETRY_BASE_SECONDS", "0.1"))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class DatabaseUnavailable(psycopg2.OperationalError):
+    """No connection could be had (breaker open or connects failing); nothing was run."""
+
+
+class CircuitBreaker:
+    """Breaker state of one endpoint; thread-safe."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = float("-inf")
+        self._lock = threading.Lock()
+        metrics.gauge(f"db.breaker.{name}.state", _STATE_GAUGE[CLOSED])
+
+    @property
+    def tripped(self) -> bool:
+        return self.state != CLOSED
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < DB_BREAKER_OPEN_SECONDS:
+                return False
+            # This caller probes; everyone else waits out another interval.
+            self.opened_at = now
+            if self.state == OPEN:
+                self._set(HALF_OPEN)
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._set(CLOSED)
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= DB_BREAKER_FAILURES):
+                self.opened_at = time.monotonic()
+                self._set(OPEN)
+
+    def _set(self, state: str):
+        logging.warning("Database breaker %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        metrics.inc(f"db.breaker.{self.name}.{state}")
+        metrics.gauge(f"db.breaker.{self.name}.state", _STATE_GAUGE[state])
+
+    def call(self, connect, retries: int = DB_CONNECT_RETRIES):
+        """
+        connect() with jittered retries on OperationalError; raises
+        DatabaseUnavailable when the breaker is open or every try failed.
+        """
+        error = None
+        for attempt in range(retries + 1):
+            if attempt:
+                metrics.inc(f"db.retry.{self.name}")
+                time.sleep(random.uniform(0, DB_RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+            if not self.allow():
+                metrics.inc(f"db.breaker.{self.name}.rejected")
+                raise DatabaseUnavailable(f"database {self.name} unavailable (breaker open)") from error
+            try:
+                result = connect()
+            except psycopg2.OperationalError as e:
+                self.failure()
+                error = e
+            else:
+                self.success()
+                return result
+        raise DatabaseUnavailable(f"database {self.name} unavailable: {error}".strip()) from error
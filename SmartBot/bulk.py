@@ -0,0 +1,232 @@
+# bulk.py
+import os
+import re
+import json
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+
+from database import MAX_AMOUNT, category_key
+from repository import get_repository
+
+# Bulk edits of many expenses at once:
+#   /bulk delete 12,15,20-25
+#   /bulk delete month=2026-09 cat=Taxi
+#   /bulk move since=2026-10-01 text=uber to Transport
+#   /bulk amount 40-45 to 12.50
+# A selection is IDs and ID ranges (any of them) plus filters cat=, since=,
+# until=, month=, text= (all of them). Each operation is one set-based
+# statement that also adjusts daily_spend, and is refused when it would
+# touch more than BULK_MAX_EXPENSES rows. The touched rows' previous
+# values are kept in the user's bulk_undo row (column-wise JSON, zlib) and
+# /undo puts them back within BULK_UNDO_SECONDS. Only the latest bulk
+# operation can be undone.
+BULK_MAX_EXPENSES = int(os.getenv("BULK_MAX_EXPENSES", "1000"))
+BULK_UNDO_SECONDS = int(os.getenv("BULK_UNDO_SECONDS", "600"))
+ACTIONS = ("delete", "move", "amount")
+
+# Row layout of UserStore.change_expenses() and restore_expenses().
+EXPENSE_COLUMNS = ("id", "category_id", "amount", "description", "date", "is_anomaly",
+                   "currency", "base_amount", "recurring_rule_id", "recurring_due")
+# What undoing each action needs; move and amount are reverted in place.
+UNDO_COLUMNS = {
+    "delete": EXPENSE_COLUMNS,
+    "move": ("id", "category_id", "amount", "base_amount"),
+    "amount": ("id", "category_id", "amount", "base_amount"),
+}
+
+_ID_RE = re.compile(r"^(\d+)(?:-(\d+))?$")
+_FILTER_RE = re.compile(r"(?:^|\s)(cat|since|until|month|text)=", re.IGNORECASE)
+_AMOUNT_RE = re.compile(r"^\d[\d,]*(\.\d{1,2})?$")
+_CENT = Decimal("0.01")
+
+
+class BulkError(ValueError):
+    """A bulk command that can't run as given; nothing was changed."""
+
+
+def _parse_date(value: str, key: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise BulkError(f"{key}= takes a date like 2026-10-01, not '{value}'.")
+
+
+def parse_selection(text: str, categories: dict) -> dict:
+    """
+    '12,15 20-25 cat=Food since=2026-10-01' -> selector dict.
+    `categories` maps category_key(name) to (id, name). Dates are inclusive
+    and in the user's time zone; the selector's `before` is the exclusive
+    upper bound and `month` the first day of a month.
+    """
+    parts = _FILTER_RE.split(text)
+    selector = {"ids": [], "ranges": [], "category_id": None, "since": None, "before": None,
+                "month": None, "text": None}
+    for token in parts[0].replace(",", " ").split():
+        m = _ID_RE.match(token)
+        if not m:
+            raise BulkError(f"'{token}' is not an expense ID or range (e.g. 12 or 20-25).")
+        lo, hi = sorted((int(m.group(1)), int(m.group(2) or m.group(1))))
+        if lo == hi:
+            selector["ids"].append(lo)
+        else:
+            selector["ranges"].append((lo, hi))
+
+    for key, value in zip(parts[1::2], parts[2::2]):
+        key, value = key.lower(), value.strip()
+        if not value:
+            raise BulkError(f"{key}= needs a value.")
+        if key == "cat":
+            match = categories.get(category_key(value))
+            if not match:
+                raise BulkError(f"You have no category named '{value}'.")
+            selector["category_id"] = match[0]
+        elif key == "text":
+            selector["text"] = value
+        elif key == "since":
+            selector["since"] = _parse_date(value, key)
+        elif key == "until":
+            selector["before"] = _parse_date(value, key) + timedelta(days=1)
+        else:
+            selector["month"] = _parse_date(value + "-01", key)
+
+    if not any(selector.values()):
+        raise BulkError("Say which expenses: IDs (12,15,20-25) or filters such as month=2026-10 cat=Food.")
+    return selector
+
+
+def selection_sql(selector: dict, mark: str, like: str = "ILIKE"):
+    """
+    (WHERE clause over expenses `e`, named parameters) for a selector.
+    `mark` renders a parameter name for the driver: "%({})s" or ":{}".
+    """
+    clauses, params = [], {}
+    ids = []
+    for i, expense_id in enumerate(selector["ids"]):
+        params[f"id{i}"] = expense_id
+        ids.append(mark.format(f"id{i}"))
+    any_of = [f"e.id IN ({', '.join(ids)})"] if ids else []
+    for i, (lo, hi) in enumerate(selector["ranges"]):
+        params[f"lo{i}"], params[f"hi{i}"] = lo, hi
+        any_of.append(f"e.id BETWEEN {mark.format(f'lo{i}')} AND {mark.format(f'hi{i}')}")
+    if any_of:
+        clauses.append("(" + " OR ".join(any_of) + ")")
+    if selector["category_id"] is not None:
+        params["cat"] = selector["category_id"]
+        clauses.append(f"e.category_id = {mark.format('cat')}")
+    if selector["since"]:
+        params["since"] = selector["since"]
+        clauses.append(f"e.day >= {mark.format('since')}")
+    if selector["before"]:
+        params["before"] = selector["before"]
+        clauses.append(f"e.day < {mark.format('before')}")
+    if selector["month"]:
+        params["month"] = selector["month"]
+        clauses.append(f"e.period_month = {mark.format('month')}")
+    if selector["text"]:
+        params["text"] = "%" + re.sub(r"([\\%_])", r"\\\1", selector["text"]) + "%"
+        clauses.append(f"e.description {like} {mark.format('text')} ESCAPE '\\'")
+    return " AND ".join(clauses), params
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+_UNPACK = {
+    "amount": lambda v: Decimal(v) if v is not None else None,
+    "base_amount": lambda v: Decimal(v) if v is not None else None,
+    "date": lambda v: datetime.fromisoformat(v) if v is not None else None,
+    "recurring_due": lambda v: date.fromisoformat(v) if v is not None else None,
+    "is_anomaly": bool,
+}
+
+
+def pack(action: str, rows) -> bytes:
+    """The undo record of `rows` (EXPENSE_COLUMNS): needed columns only, column-wise, compressed."""
+    index = [EXPENSE_COLUMNS.index(c) for c in UNDO_COLUMNS[action]]
+    columns = [[_plain(row[i]) for row in rows] for i in index]
+    return zlib.compress(json.dumps(columns, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def unpack(action: str, blob) -> list:
+    """Rows in UNDO_COLUMNS[action] order."""
+    columns = json.loads(zlib.decompress(bytes(blob)))
+    converted = [
+        [_UNPACK[name](v) for v in values] if name in _UNPACK else values
+        for name, values in zip(UNDO_COLUMNS[action], columns)
+    ]
+    return list(zip(*converted))
+
+
+def parse_amount(text: str) -> Decimal:
+    text = text.strip()
+    if not _AMOUNT_RE.match(text):
+        raise BulkError(f"'{text}' is not an amount.")
+    try:
+        amount = Decimal(text.replace(",", "")).quantize(_CENT)
+    except InvalidOperation:
+        raise BulkError(f"'{text}' is not an amount.")
+    if amount <= 0:
+        raise BulkError("The amount must be positive.")
+    if amount > MAX_AMOUNT:
+        raise BulkError(f"The amount must be at most {MAX_AMOUNT}.")
+    return amount
+
+
+def run_bulk(user_id: int, text: str):
+    """
+    Parse and apply '<action> <selection> [to <target>]'.
+    Returns (action, expenses changed, their total in the base currency, target).
+    """
+    action, _, rest = text.strip().partition(" ")
+    action = action.lower()
+    if action not in ACTIONS:
+        raise BulkError("Start with delete, move or amount.")
+    target = None
+    if action != "delete":
+        rest, sep, target = rest.rpartition(" to ")
+        target = target.strip()
+        if not sep or not target:
+            example = "Groceries" if action == "move" else "9.99"
+            raise BulkError(f"Say what to change them to, e.g. /bulk {action} 12-20 to {example}.")
+
+    repo = get_repository()
+    with repo.read(user_id) as store:
+        categories = {category_key(name): (cid, name) for cid, name in store.categories()}
+    selector = parse_selection(rest, categories)
+    value = parse_amount(target) if action == "amount" else None
+    if action == "move":
+        target = categories.get(category_key(target), (None, target))[1]
+
+    with repo.write(user_id) as store:
+        if action == "move":
+            value = store.category_id(target)
+        old = store.change_expenses(selector, action, value, BULK_MAX_EXPENSES)
+        if old and len(old) <= BULK_MAX_EXPENSES:
+            store.save_undo(action, pack(action, old))
+    if len(old) > BULK_MAX_EXPENSES:
+        raise BulkError(f"That selects more than {BULK_MAX_EXPENSES} expenses; narrow it down.")
+
+    amount, base = EXPENSE_COLUMNS.index("amount"), EXPENSE_COLUMNS.index("base_amount")
+    total = sum((row[base] if row[base] is not None else row[amount] for row in old), Decimal(0))
+    return action, len(old), total, target
+
+
+def undo_last(user_id: int):
+    """Revert the user's latest bulk operation if it is recent enough: (action, rows) or None."""
+    with get_repository().write(user_id) as store:
+        undo = store.take_undo()
+        if undo is None:
+            return None
+        action, blob, created_at = undo
+        if datetime.now(timezone.utc) - created_at > timedelta(seconds=BULK_UNDO_SECONDS):
+            return None
+        rows = unpack(action, blob)
+        if action == "delete":
+            return action, store.restore_expenses(rows)
+        return action, store.revert_expenses(rows)
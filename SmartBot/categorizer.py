@@ -0,0 +1,144 @@
+# categorizer.py
+import os
+import re
+import math
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from repository import get_repository
+
+# Per-user naive Bayes over description tokens, learned from the user's own
+# description -> category history. Models live in an LRU keyed by user_id
+# and are dropped after CATEGORIZER_IDLE_SECONDS without use.
+HISTORY_LIMIT = int(os.getenv("CATEGORIZER_HISTORY_LIMIT", "1000"))
+MAX_USERS = int(os.getenv("CATEGORIZER_MAX_USERS", "50000"))
+IDLE_SECONDS = int(os.getenv("CATEGORIZER_IDLE_SECONDS", "1800"))
+# Auto-assign only above this posterior and with enough history; below it
+# the prediction is only offered as a suggestion.
+AUTO_CONFIDENCE = float(os.getenv("CATEGORIZER_AUTO_CONFIDENCE", "0.8"))
+MIN_EXAMPLES = int(os.getenv("CATEGORIZER_MIN_EXAMPLES", "5"))
+
+_TOKEN_RE = re.compile(r"[^\W\d_]{2,}", re.UNICODE)
+
+
+def tokenize(text: str):
+    return set(_TOKEN_RE.findall((text or "").lower()))
+
+
+class UserModel:
+    __slots__ = ("token_counts", "cat_docs", "cat_tokens", "names", "docs", "last_used")
+
+    def __init__(self):
+        self.token_counts = {}  # token -> {category_id: count}
+        self.cat_docs = {}      # category_id -> examples
+        self.cat_tokens = {}    # category_id -> token occurrences
+        self.names = {}         # category_id -> name
+        self.docs = 0
+        self.last_used = time.monotonic()
+
+    def observe(self, category_id: int, category_name: str, description: str):
+        tokens = tokenize(description)
+        if not tokens:
+            return
+        self.names[category_id] = category_name
+        self.docs += 1
+        self.cat_docs[category_id] = self.cat_docs.get(category_id, 0) + 1
+        self.cat_tokens[category_id] = self.cat_tokens.get(category_id, 0) + len(tokens)
+        for tok in tokens:
+            counts = self.token_counts.setdefault(tok, {})
+            counts[category_id] = counts.get(category_id, 0) + 1
+
+    def predict(self, description: str):
+        """Return (category_id, name, probability) or None if nothing is known."""
+        known = [self.token_counts[t] for t in tokenize(description) if t in self.token_counts]
+        if not known:
+            return None
+        vocab = len(self.token_counts)
+        scores = {}
+        for cid, docs in self.cat_docs.items():
+            denom = math.log(self.cat_tokens[cid] + vocab)
+            score = math.log(docs / self.docs)
+            for counts in known:
+                score += math.log(counts.get(cid, 0) + 1) - denom
+            scores[cid] = score
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        prob = 1.0 / sum(math.exp(s - top) for s in scores.values())
+        return best, self.names[best], prob
+
+
+_models = OrderedDict()
+
+
+def _evict_idle(now: float):
+    while _models:
+        model = next(iter(_models.values()))
+        if len(_models) <= MAX_USERS and now - model.last_used < IDLE_SECONDS:
+            break
+        _models.popitem(last=False)
+
+
+def _load_model(user_id: int) -> UserModel:
+    model = UserModel()
+    with get_repository().read(user_id) as store:
+        for category_id, name, description in store.recent_descriptions(HISTORY_LIMIT):
+            model.observe(category_id, name, description)
+    return model
+
+
+def get_model(user_id: int) -> UserModel:
+    now = time.monotonic()
+    model = _models.get(user_id)
+    if model is None:
+        model = _load_model(user_id)
+        _models[user_id] = model
+    else:
+        _models.move_to_end(user_id)
+    model.last_used = now
+    _evict_idle(now)
+    return model
+
+
+def preload(user_ids, workers: int = 8) -> int:
+    """Load models for `user_ids` in parallel (startup warm-up); returns how many."""
+    user_ids = [uid for uid in user_ids if uid not in _models][:MAX_USERS]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        loaded = list(pool.map(_load_model, user_ids))
+    now = time.monotonic()
+    for user_id, model in zip(user_ids, loaded):
+        model.last_used = now
+        _models[user_id] = model
+    return len(loaded)
+
+
+def observe(user_id: int, category_id: int, category_name: str, description: str):
+    """Feed a freshly inserted expense into the user's model, if it is loaded."""
+    model = _models.get(user_id)
+    if model is not None:
+        model.observe(category_id, category_name, description)
+
+
+def forget(user_id: int):
+    """Drop the user's model (categories renamed or merged); the next use reloads it."""
+    _models.pop(user_id, None)
+
+
+def suggest_category(user_id: int, description: str):
+    """
+    Return (category_name, auto) for a description, or None.
+    `auto` is True when the model is confident enough to assign it outright.
+    """
+    if not tokenize(description):
+        return None
+    try:
+        model = get_model(user_id)
+    except Exception:
+        logging.exception("Could not load categorizer model for user %s", user_id)
+        return None
+    prediction = model.predict(description)
+    if prediction is None:
+        return None
+    _, name, prob = prediction
+    return name, (prob >= AUTO_CONFIDENCE and model.docs >= MIN_EXAMPLES)
@@ -1,9 +1,21 @@
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 import logging
 import os
+import time
+import itertools
+import threading
 from dotenv import load_dotenv
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from decimal import Decimal
+
+import statements
+from statements import StatementConnection
+from breaker import DB_CONNECT_RETRIES, CircuitBreaker, DatabaseUnavailable
+from timezones import DEFAULT_TIMEZONE, today_in
 
 # Load environment variables
 load_dotenv()
@@ -14,6 +26,30 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_PORT = os.getenv("DB_PORT")
 
+# Read replicas: "host[:port],host[:port]" (same database name and
+# credentials as the primary). Empty = all reads go to the primary.
+# A background thread checks their lag every DB_REPLICA_CHECK_SECONDS;
+# requests only read its latest verdicts.
+DB_REPLICAS = [h.strip() for h in os.getenv("DB_REPLICAS", "").split(",") if h.strip()]
+REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "2"))
+
+# Shards: "host:port/dbname|replica:port|...,host:port/dbname,..." (same
+# credentials everywhere). Unset = one shard: DB_HOST/DB_NAME + DB_REPLICAS.
+# Users are placed by jump consistent hash of user_id; users moved with
+# shards.py are pinned in user_shards on shard 0.
+DB_SHARDS = [s.strip() for s in os.getenv("DB_SHARDS", "").split(",") if s.strip()]
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+# Seconds to wait for a new connection before counting it as a failure
+# (see breaker.py for the circuit breaker and retries around checkout).
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "3"))
+SHARD_MAP_TTL = float(os.getenv("SHARD_MAP_TTL", "5"))
+# Serial ids on shard k start at k * SHARD_ID_SPAN, so rows keep their ids
+# when a user moves between shards.
+SHARD_ID_SPAN = 100_000_000
+# Largest amount expenses.amount (DECIMAL(10, 2)) holds.
+MAX_AMOUNT = Decimal("99999999.99")
+
 DEFAULT_CATEGORIES = [
     "Food", "Transport", "Entertainment", "Groceries", "Utilities",
     "Medical Treatment", "Personal Care", "Education", "Gift/Donation",
@@ -21,41 +57,457 @@ DEFAULT_CATEGORIES = [
     "Others"
 ]
 
-@contextmanager
-def get_db_connection():
-    conn = None
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
+
+class ShardMoveInProgress(RuntimeError):
+    """Writes for a user are paused while shards.py moves them."""
+
+
+class _Pool(psycopg2.pool.ThreadedConnectionPool):
+    """
+    Opens connections lazily and keeps up to `maxconn` of them idle (the
+    base class only keeps `minconn`, which it also opens up front).
+    """
+
+    def __init__(self, maxconn: int, **kwargs):
+        super().__init__(0, maxconn, **kwargs)
+        self.minconn = maxconn
+
+    def discard_idle(self):
+        """Close the idle connections (after the server went away they are all dead)."""
+        with self._lock:
+            idle, self._pool = self._pool, []
+        for conn in idle:
+            conn.close()
+
+
+class _Endpoint:
+    """One Postgres server/database with its own connection pools."""
+    __slots__ = ("host", "port", "dbname", "pools", "breaker", "healthy", "caught_up_at")
+
+    def __init__(self, host, port, dbname, name):
+        self.host = host
+        self.port = port or DB_PORT
+        self.dbname = dbname or DB_NAME
+        self.pools = {}  # readonly flag -> pool
+        self.breaker = CircuitBreaker(name)
+        # Replica state: healthy after a lag check passes; caught_up_at is
+        # the monotonic time it was seen to have replayed everything the
+        # primary had committed, so writes before it are visible there.
+        self.healthy = False
+        self.caught_up_at = float("-inf")
+
+    def connect(self, **kwargs):
+        kwargs.setdefault("connect_timeout", DB_CONNECT_TIMEOUT)
+        return psycopg2.connect(
+            host=self.host,
+            database=self.dbname,
             user=DB_USER,
             password=DB_PASSWORD,
-            port=DB_PORT
+            port=self.port,
+            connection_factory=StatementConnection,
+            **kwargs
         )
+
+    def checkout(self, readonly: bool = False, retries: int = DB_CONNECT_RETRIES):
+        """
+        Pooled connection (a fresh one if the pool is exhausted), through
+        the endpoint's circuit breaker; raises DatabaseUnavailable.
+        """
+        return self.breaker.call(lambda: self._checkout(readonly), retries)
+
+    def lost(self):
+        """A connection died under a query: count it and drop the idle ones."""
+        self.breaker.failure()
+        for pool in list(self.pools.values()):
+            pool.discard_idle()
+
+    def _checkout(self, readonly: bool):
+        pool = self.pools.get(readonly)
+        if pool is None:
+            with _pool_lock:
+                pool = self.pools.get(readonly)
+                if pool is None:
+                    pool = _Pool(
+                        DB_POOL_SIZE, host=self.host, database=self.dbname,
+                        user=DB_USER, password=DB_PASSWORD, port=self.port,
+                        connect_timeout=DB_CONNECT_TIMEOUT,
+                        connection_factory=StatementConnection,
+                    )
+                    self.pools[readonly] = pool
+        try:
+            conn = pool.getconn()
+        except psycopg2.pool.PoolError:
+            return self.connect(), None
+        if readonly and not conn.autocommit:
+            conn.set_session(readonly=True, autocommit=True)
+        return conn, pool
+
+
+def _release(conn, pool, broken: bool = False):
+    if pool is None:
+        conn.close()
+    else:
+        pool.putconn(conn, close=broken or bool(conn.closed))
+
+
+class _Shard:
+    __slots__ = ("index", "primary", "replicas")
+
+    def __init__(self, index: int, primary: _Endpoint, replicas):
+        self.index = index
+        self.primary = primary
+        self.replicas = replicas
+
+
+def _endpoint(address: str, dbname, name: str) -> _Endpoint:
+    host, _, port = address.partition(":")
+    return _Endpoint(host, port, dbname, name)
+
+
+def _replicas(index: int, addresses, dbname) -> list:
+    return [_endpoint(r, dbname, f"shard{index}.replica{i}") for i, r in enumerate(addresses)]
+
+
+def _parse_shard(index: int, spec: str) -> _Shard:
+    """'host:port/dbname|replica:port|...' -> _Shard."""
+    primary, *replicas = spec.split("|")
+    address, _, dbname = primary.partition("/")
+    endpoint = _endpoint(address, dbname, f"shard{index}.primary")
+    return _Shard(index, endpoint, _replicas(index, replicas, endpoint.dbname))
+
+
+if DB_SHARDS:
+    _shards = [_parse_shard(i, spec) for i, spec in enumerate(DB_SHARDS)]
+else:
+    _shards = [_Shard(
+        0,
+        _Endpoint(DB_HOST, DB_PORT, DB_NAME, "shard0.primary"),
+        _replicas(0, DB_REPLICAS, DB_NAME),
+    )]
+
+_pool_lock = threading.Lock()
+_replica_turn = itertools.count()
+_replica_lock = threading.Lock()
+_replica_monitor = None
+_last_write = {}  # user_id -> monotonic time of their last committed write
+_shard_map = (float("-inf"), {}, frozenset())  # (loaded_at, pinned user -> shard, moving users)
+_shard_map_lock = threading.Lock()
+
+
+def shard_count() -> int:
+    return len(_shards)
+
+
+def _jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash: adding a shard moves only ~1/n of the users."""
+    key &= 0xFFFFFFFFFFFFFFFF
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def _load_shard_map():
+    """Pinned users and in-flight moves from user_shards (cached SHARD_MAP_TTL)."""
+    global _shard_map
+    loaded_at, pinned, moving = _shard_map
+    now = time.monotonic()
+    if now - loaded_at < SHARD_MAP_TTL:
+        return pinned, moving
+    with _shard_map_lock:
+        if _shard_map[0] == loaded_at:
+            endpoint = _shards[0].primary
+            conn, pool = endpoint.checkout(readonly=True)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT user_id, shard, moving FROM user_shards")
+                    rows = cur.fetchall()
+            except psycopg2.Error:
+                if conn.closed:
+                    endpoint.lost()
+                _release(conn, pool, broken=True)
+                raise
+            _release(conn, pool)
+            _shard_map = (
+                now,
+                {uid: shard for uid, shard, _ in rows},
+                frozenset(uid for uid, _, mv in rows if mv),
+            )
+        return _shard_map[1], _shard_map[2]
+
+
+def shard_for(user_id) -> int:
+    if len(_shards) == 1 or user_id is None:
+        return 0
+    pinned, _ = _load_shard_map()
+    shard = pinned.get(user_id)
+    return shard if shard is not None else _jump_hash(user_id, len(_shards))
+
+
+def moving_users() -> frozenset:
+    """Users whose writes are paused while shards.py moves them."""
+    if len(_shards) == 1:
+        return frozenset()
+    return _load_shard_map()[1]
+
+
+def home_shard(user_id) -> int:
+    """Shard the hash alone assigns (where unpinned users live)."""
+    return _jump_hash(user_id, len(_shards))
+
+
+@contextmanager
+def get_db_connection(user_id=None, shard=None):
+    """
+    Primary (read-write) connection, committed on success. Routed to
+    `shard`, else to the user's shard (default 0). Passing `user_id` raises
+    ShardMoveInProgress while that user is being moved (whatever the
+    shard), and keeps their reads on the primary until a replica is known
+    to have replayed the write. Raises DatabaseUnavailable (nothing ran)
+    when no connection can be had.
+    """
+    conn = pool = None
+    broken = False
+    try:
+        if shard is None:
+            shard = shard_for(user_id)
+        if user_id is not None and user_id in moving_users():
+            raise ShardMoveInProgress(f"user {user_id} is being moved between shards")
+        endpoint = _shards[shard].primary
+        conn, pool = endpoint.checkout()
         yield conn
         conn.commit()
+        if user_id is not None:
+            _note_write(user_id)
     except (Exception, psycopg2.DatabaseError) as error:
-        logging.exception("Database error occurred.")
-        if conn:
+        if isinstance(error, DatabaseUnavailable):
+            # The breaker has logged it; no traceback per rejected request.
+            raise
+        if not isinstance(error, ValueError):
+            # ValueErrors are requests turned down (CategoryError, ...), for the caller to report.
+            logging.exception("Database error occurred.")
+        broken = isinstance(error, psycopg2.OperationalError)
+        if conn and conn.closed:
+            endpoint.lost()
+        elif conn:
             conn.rollback()
         raise error
     finally:
         if conn:
+            _release(conn, pool, broken)
+
+
+# ------------------------------ replicas ------------------------------ #
+def _refresh_replicas(shard: _Shard):
+    """
+    Read the primary's WAL position, then ask each replica how far it has
+    replayed and how old its last replayed transaction is. Unreachable or
+    too-laggy replicas are skipped.
+    """
+    now = time.monotonic()
+    if shard.primary.breaker.tripped:
+        # Keep the last verdicts; replicas are all there is to read from.
+        return
+    try:
+        conn = shard.primary.connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_current_wal_lsn()")
+                primary_lsn = cur.fetchone()[0]
+        finally:
             conn.close()
+    except Exception:
+        logging.warning("Could not read primary WAL position; replica checks skipped.")
+        return
+    for replica in shard.replicas:
+        try:
+            conn = replica.connect(connect_timeout=2)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn,
+                               COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                        """,
+                        (primary_lsn,),
+                    )
+                    caught_up, lag = cur.fetchone()
+            finally:
+                conn.close()
+        except Exception:
+            logging.warning("Replica %s:%s unavailable; reading from primary.", replica.host, replica.port)
+            replica.healthy = False
+            continue
+        if caught_up:
+            replica.caught_up_at = now
+        replica.healthy = bool(caught_up) or float(lag) <= REPLICA_MAX_LAG
+
+
+def _watch_replicas():
+    while True:
+        for shard in _shards:
+            if shard.replicas:
+                try:
+                    _refresh_replicas(shard)
+                except Exception:
+                    logging.exception("Replica check failed.")
+        time.sleep(REPLICA_CHECK_SECONDS)
+
+
+def _start_replica_monitor():
+    """Start the replica checks (once per process, on the first replica read)."""
+    global _replica_monitor
+    with _replica_lock:
+        if _replica_monitor is None:
+            _replica_monitor = threading.Thread(target=_watch_replicas, name="replica-monitor", daemon=True)
+            _replica_monitor.start()
 
 
-def setup_database():
-    """Sets up tables if not exists."""
+def _note_write(user_id):
+    if len(_last_write) > 100000:
+        cutoff = time.monotonic() - 600
+        for uid in [u for u, t in _last_write.items() if t < cutoff]:
+            del _last_write[uid]
+    _last_write[user_id] = time.monotonic()
+
+
+def _pick_replica(shard: _Shard, user_id=None):
+    """
+    Round-robin over healthy replicas. For a user with a recent write only
+    replicas seen caught up since that write qualify (unless the primary is
+    unavailable: a stale read beats none); otherwise None (primary).
+    """
+    if not shard.replicas:
+        return None
+    if _replica_monitor is None:
+        _start_replica_monitor()
+    written = None if shard.primary.breaker.tripped else _last_write.get(user_id)
+    start = next(_replica_turn)
+    for i in range(len(shard.replicas)):
+        replica = shard.replicas[(start + i) % len(shard.replicas)]
+        if replica.healthy and (written is None or replica.caught_up_at > written):
+            return replica
+    return None
+
+
+@contextmanager
+def get_read_connection(user_id=None, shard=None):
+    """
+    Read-only connection on the user's shard (or `shard`) for queries that
+    may be served by a replica (lag-aware, falls back to the primary). Pass
+    the reading user's id so they always see their own writes.
+    """
+    conn = pool = None
+    broken = False
     try:
-        with get_db_connection() as conn:
+        target = _shards[shard_for(user_id) if shard is None else shard]
+        endpoint = _pick_replica(target, user_id)
+        if endpoint is not None:
+            try:
+                conn, pool = endpoint.checkout(readonly=True, retries=0)
+            except psycopg2.OperationalError:
+                logging.warning("Replica %s:%s refused connection; reading from primary.",
+                                endpoint.host, endpoint.port)
+                endpoint.healthy = False
+        if conn is None:
+            endpoint = target.primary
+            conn, pool = endpoint.checkout(readonly=True)
+        yield conn
+    except (Exception, psycopg2.DatabaseError) as error:
+        if isinstance(error, DatabaseUnavailable):
+            raise
+        if not isinstance(error, ValueError):
+            logging.exception("Database error occurred.")
+        broken = isinstance(error, psycopg2.OperationalError)
+        if conn and conn.closed:
+            endpoint.lost()
+        raise error
+    finally:
+        if conn:
+            _release(conn, pool, broken)
+
+
+def fan_out(fn, *args, **kwargs) -> list:
+    """
+    Run fn(shard, *args, **kwargs) on every shard in parallel (admin-wide
+    jobs and aggregates). Returns the results in shard order.
+    """
+    if len(_shards) == 1:
+        return [fn(0, *args, **kwargs)]
+    with ThreadPoolExecutor(max_workers=len(_shards)) as pool:
+        futures = [pool.submit(fn, i, *args, **kwargs) for i in range(len(_shards))]
+        return [f.result() for f in futures]
+
+
+def _warm_endpoint(endpoint: _Endpoint, readonly: bool, connections: int) -> int:
+    held = []
+    try:
+        for _ in range(connections):
+            conn, pool = endpoint.checkout(readonly)
+            held.append((conn, pool))
+            with conn.cursor() as cur:
+                statements.prepare_all(cur)
+            if not conn.autocommit:
+                conn.commit()
+    finally:
+        for conn, pool in held:
+            _release(conn, pool)
+    return len(held)
+
+
+def warm_pool(connections: int = None) -> int:
+    """
+    Open `connections` (default DB_POOL_SIZE) pooled connections per shard
+    endpoint and prepare the hot statements on each, so the first updates
+    after a restart don't pay for connecting and planning. Unreachable
+    replicas are skipped. Returns the number of connections warmed.
+    """
+    connections = min(connections or DB_POOL_SIZE, DB_POOL_SIZE)
+    warmed = 0
+    for shard in _shards:
+        warmed += _warm_endpoint(shard.primary, False, connections)
+        warmed += _warm_endpoint(shard.primary, True, connections)
+        for replica in shard.replicas:
+            try:
+                warmed += _warm_endpoint(replica, True, connections)
+            except psycopg2.OperationalError:
+                logging.warning("Replica %s:%s unreachable; not warmed.", replica.host, replica.port)
+    return warmed
+
+
+def setup_database() -> list:
+    """
+    Sets up tables if not exists, on every shard. Returns the categories
+    merged on the way (see _merge_duplicate_categories).
+    """
+    merged = []
+    for shard in range(len(_shards)):
+        merged += _setup_shard(shard)
+    return merged
+
+
+def _setup_shard(shard: int):
+    try:
+        with get_db_connection(shard=shard) as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS users (
                         user_id BIGINT PRIMARY KEY,
-                        first_name VARCHAR(255)
+                        first_name VARCHAR(255),
+                        base_currency CHAR(3),
+                        digest VARCHAR(8),
+                        data_version BIGINT NOT NULL DEFAULT 0,
+                        timezone VARCHAR(64) NOT NULL DEFAULT 'UTC'
                     );
                 """)
 
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS users_digest_idx
+                    ON users (user_id) WHERE digest IS NOT NULL;
+                """)
+
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS categories (
                         id SERIAL PRIMARY KEY,
@@ -65,6 +517,31 @@ def setup_database():
                     );
                 """)
 
+                # Recurring expense templates. Occurrence k falls on
+                # anchor + k * step; next_due = anchor + n_done * step.
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS recurring_rules (
+                        id SERIAL PRIMARY KEY,
+                        user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+                        category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL,
+                        amount DECIMAL(10, 2) NOT NULL,
+                        currency CHAR(3),
+                        description TEXT,
+                        frequency VARCHAR(32) NOT NULL,
+                        step INTERVAL NOT NULL,
+                        anchor DATE NOT NULL,
+                        n_done INTEGER NOT NULL DEFAULT 0,
+                        next_due DATE NOT NULL,
+                        active BOOLEAN NOT NULL DEFAULT TRUE,
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
+
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS recurring_rules_due_idx
+                    ON recurring_rules (next_due) WHERE active;
+                """)
+
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS expenses (
                         id SERIAL PRIMARY KEY,
@@ -72,10 +549,38 @@ def setup_database():
                         category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL,
                         amount DECIMAL(10, 2) NOT NULL,
                         description TEXT,
-                        date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                        date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        is_anomaly BOOLEAN NOT NULL DEFAULT FALSE,
+                        currency CHAR(3),
+                        base_amount DECIMAL(12, 2),
+                        recurring_rule_id INTEGER REFERENCES recurring_rules(id) ON DELETE SET NULL,
+                        recurring_due DATE,
+                        day DATE NOT NULL,
+                        period_month DATE NOT NULL
                     );
                 """)
 
+                # day/period_month: the expense's date in its user's time
+                # zone, fixed on insert (see timezones.py).
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS expenses_user_period_idx
+                    ON expenses (user_id, period_month);
+                """)
+
+                # A user's expenses in given categories (/search by category
+                # name, merges, /bulk category selections).
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS expenses_user_category_idx
+                    ON expenses (user_id, category_id);
+                """)
+
+                # One expense per rule occurrence, so catch-up runs can't duplicate.
+                cur.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS expenses_recurring_uniq
+                    ON expenses (recurring_rule_id, recurring_due)
+                    WHERE recurring_rule_id IS NOT NULL;
+                """)
+
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS budgets (
                         id SERIAL PRIMARY KEY,
@@ -86,15 +591,188 @@ def setup_database():
                         UNIQUE (user_id, category_id, period_month)
                     );
                 """)
-        logging.info("Database setup successful: Tables checked/created.")
+
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS budgets_month_user_idx
+                    ON budgets (period_month, user_id);
+                """)
+
+                # Per-day spend per user/category in the user's base currency,
+                # kept in step with expenses by insert_expense/delete_expenses.
+                # day is expenses.day (the user's local day); category_id 0 =
+                # uncategorised. A table created here is filled from the
+                # existing expenses further down (migration 003 does the same).
+                cur.execute("SELECT to_regclass('daily_spend') IS NULL")
+                backfill = cur.fetchone()[0]
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS daily_spend (
+                        user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+                        category_id INTEGER NOT NULL DEFAULT 0,
+                        day DATE NOT NULL,
+                        amount DECIMAL(12, 2) NOT NULL DEFAULT 0,
+                        n INTEGER NOT NULL DEFAULT 0,
+                        log_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+                        log_sumsq DOUBLE PRECISION NOT NULL DEFAULT 0,
+                        PRIMARY KEY (user_id, category_id, day)
+                    );
+                """)
+
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS daily_spend_day_idx
+                    ON daily_spend (day);
+                """)
+
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS budget_forecasts (
+                        user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+                        category_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
+                        period_month DATE NOT NULL,
+                        projected DECIMAL(12, 2) NOT NULL,
+                        overrun_date DATE,
+                        computed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (user_id, category_id, period_month)
+                    );
+                """)
+
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS category_baselines (
+                        user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+                        category_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
+                        n INTEGER NOT NULL,
+                        typical DECIMAL(12, 2) NOT NULL,
+                        threshold DECIMAL(12, 2) NOT NULL,
+                        computed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (user_id, category_id)
+                    );
+                """)
+
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS fx_rates (
+                        currency CHAR(3) NOT NULL,
+                        rate_date DATE NOT NULL,
+                        per_usd NUMERIC(18, 8) NOT NULL,
+                        PRIMARY KEY (currency, rate_date)
+                    );
+                """)
+
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS webapp_requests (
+                        user_id BIGINT NOT NULL,
+                        idem_key VARCHAR(64) NOT NULL,
+                        response TEXT,
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (user_id, idem_key)
+                    );
+                """)
+
+                # Previous values of the user's latest bulk edit (bulk.py).
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS bulk_undo (
+                        user_id BIGINT PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
+                        action VARCHAR(16) NOT NULL,
+                        data BYTEA NOT NULL,
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
+
+                # Months of expenses moved to archive files (archive.py).
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS expense_archive (
+                        user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+                        period_month DATE NOT NULL,
+                        n INTEGER NOT NULL,
+                        archived_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (user_id, period_month)
+                    );
+                """)
+
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS job_checkpoints (
+                        job_name VARCHAR(64) NOT NULL,
+                        run_key DATE NOT NULL,
+                        last_user_id BIGINT NOT NULL DEFAULT 0,
+                        done BOOLEAN NOT NULL DEFAULT FALSE,
+                        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (job_name, run_key)
+                    );
+                """)
+                # Trigram index for /search. Needs the pg_trgm and btree_gin
+                # extensions; without them search is unavailable but the bot runs.
+                cur.execute("SAVEPOINT search_index")
+                try:
+                    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+                    cur.execute("CREATE EXTENSION IF NOT EXISTS btree_gin;")
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS expenses_user_desc_trgm_idx
+                        ON expenses USING gin (user_id, description gin_trgm_ops);
+                    """)
+                    cur.execute("RELEASE SAVEPOINT search_index")
+                except psycopg2.Error:
+                    cur.execute("ROLLBACK TO SAVEPOINT search_index")
+                    logging.warning("pg_trgm/btree_gin unavailable: /search index not created.")
+
+                # Users moved off their hash shard (read from shard 0 only).
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS user_shards (
+                        user_id BIGINT PRIMARY KEY,
+                        shard INTEGER NOT NULL,
+                        moving BOOLEAN NOT NULL DEFAULT FALSE
+                    );
+                """)
+
+                merged = _merge_duplicate_categories(cur)
+
+                if backfill:
+                    cur.execute("SELECT DISTINCT user_id FROM expenses")
+                    user_ids = [row[0] for row in cur.fetchall()]
+                    if user_ids:
+                        rebuild_daily_spend(cur, *user_ids)
+                        logging.info("daily_spend backfilled for %s users (shard %s).", len(user_ids), shard)
+
+                if shard > 0:
+                    floor = shard * SHARD_ID_SPAN
+                    for table in ("categories", "expenses", "budgets", "recurring_rules"):
+                        cur.execute(f"SELECT last_value FROM {table}_id_seq")
+                        if cur.fetchone()[0] < floor:
+                            cur.execute(f"SELECT setval('{table}_id_seq', %s)", (floor,))
+        logging.info("Database setup successful: Tables checked/created (shard %s).", shard)
+        return merged
     except Exception:
         logging.exception("FATAL: Could not set up database.")
+        return []
+
+
+def _merge_duplicate_categories(cur) -> list:
+    """
+    Before categories_user_key_uniq exists: merge each user's categories
+    whose names differ only in case or spacing into the oldest one, then
+    create it. Returns [(user_id, merged ids, target id)].
+    """
+    cur.execute("SELECT to_regclass('categories_user_key_uniq') IS NOT NULL")
+    if cur.fetchone()[0]:
+        return []
+    cur.execute(
+        f"""
+        SELECT user_id, array_agg(id ORDER BY id)
+        FROM categories
+        GROUP BY user_id, {CATEGORY_KEY_SQL}
+        HAVING COUNT(*) > 1
+        """
+    )
+    merged = []
+    for user_id, ids in cur.fetchall():
+        cur.execute(MERGE_CATEGORIES_SQL, {"uid": user_id, "sources": ids[1:], "target": ids[0]})
+        merged.append((user_id, ids[1:], ids[0]))
+    if merged:
+        logging.warning("Merged near-duplicate categories of %s users.", len(merged))
+    cur.execute(f"CREATE UNIQUE INDEX categories_user_key_uniq ON categories (user_id, {CATEGORY_KEY_SQL})")
+    return merged
 
 
 def ensure_default_categories(user_id: int):
     """Insert default categories for a user if they don't exist."""
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(user_id) as conn:
             with conn.cursor() as cur:
                 for name in DEFAULT_CATEGORIES:
                     try:
@@ -102,7 +780,7 @@ def ensure_default_categories(user_id: int):
                             """
                             INSERT INTO categories (user_id, name)
                             VALUES (%s, %s)
-                            ON CONFLICT (user_id, name) DO NOTHING
+                            ON CONFLICT DO NOTHING
                             """,
                             (user_id, name)
                         )
@@ -112,16 +790,245 @@ def ensure_default_categories(user_id: int):
         logging.exception("Error ensuring default categories for user %s", user_id)
 
 
-def current_period() -> date:
-    from datetime import datetime
-    now = datetime.now().date()
-    return now.replace(day=1)
+def current_period(tz: str = None) -> date:
+    """First day of the current month in zone `tz` (default DEFAULT_TIMEZONE)."""
+    return today_in(tz or DEFAULT_TIMEZONE).replace(day=1)
+
+
+def tidy_category_name(name: str) -> str:
+    """`name` with surrounding whitespace dropped and inner runs collapsed."""
+    return " ".join((name or "").split())
+
+
+# category_key() as SQL over categories.name: the "category_id" statement
+# and the unique index categories_user_key_uniq match on it.
+CATEGORY_KEY_SQL = r"lower(regexp_replace(btrim(name), '\s+', ' ', 'g'))"
+
+# Merge categories into one (categories.py) in one statement: re-point
+# expenses and recurring rules, fold budgets and daily_spend rows into the
+# target's (adding up where both have one), drop the sources' forecasts
+# and baselines (and the target's forecasts, now stale; the nightly jobs
+# recompute them) and the user's bulk undo record, whose rows may name a
+# source.
+MERGE_CATEGORIES_SQL = """
+WITH src AS (
+    SELECT id FROM categories
+    WHERE user_id = %(uid)s AND id = ANY(%(sources)s) AND id <> %(target)s
+      AND EXISTS (SELECT 1 FROM categories WHERE id = %(target)s AND user_id = %(uid)s)
+    FOR UPDATE
+), exp AS (
+    UPDATE expenses e SET category_id = %(target)s
+    FROM src
+    WHERE e.user_id = %(uid)s AND e.category_id = src.id
+    RETURNING e.id
+), rules AS (
+    UPDATE recurring_rules r SET category_id = %(target)s
+    FROM src
+    WHERE r.user_id = %(uid)s AND r.category_id = src.id
+), old_budgets AS (
+    DELETE FROM budgets b USING src
+    WHERE b.user_id = %(uid)s AND b.category_id = src.id
+    RETURNING b.period_month, b.amount
+), new_budgets AS (
+    INSERT INTO budgets (user_id, category_id, amount, period_month)
+    SELECT %(uid)s, %(target)s, SUM(amount), period_month
+    FROM old_budgets
+    GROUP BY period_month
+    ON CONFLICT (user_id, category_id, period_month)
+    DO UPDATE SET amount = budgets.amount + EXCLUDED.amount
+), old_spend AS (
+    DELETE FROM daily_spend d USING src
+    WHERE d.user_id = %(uid)s AND d.category_id = src.id
+    RETURNING d.day, d.amount, d.n, d.log_sum, d.log_sumsq
+), new_spend AS (
+    INSERT INTO daily_spend (user_id, category_id, day, amount, n, log_sum, log_sumsq)
+    SELECT %(uid)s, %(target)s, day, SUM(amount), SUM(n), SUM(log_sum), SUM(log_sumsq)
+    FROM old_spend
+    GROUP BY day
+    ON CONFLICT (user_id, category_id, day)
+    DO UPDATE SET amount = daily_spend.amount + EXCLUDED.amount,
+                  n = daily_spend.n + EXCLUDED.n,
+                  log_sum = daily_spend.log_sum + EXCLUDED.log_sum,
+                  log_sumsq = daily_spend.log_sumsq + EXCLUDED.log_sumsq
+), forecasts AS (
+    DELETE FROM budget_forecasts f
+    WHERE f.user_id = %(uid)s
+      AND (f.category_id IN (SELECT id FROM src)
+           OR f.category_id = %(target)s AND EXISTS (SELECT 1 FROM src))
+), baselines AS (
+    DELETE FROM category_baselines b USING src
+    WHERE b.user_id = %(uid)s AND b.category_id = src.id
+), cats AS (
+    DELETE FROM categories c USING src
+    WHERE c.id = src.id
+    RETURNING c.id
+), undo AS (
+    DELETE FROM bulk_undo WHERE user_id = %(uid)s AND EXISTS (SELECT 1 FROM src)
+), ver AS (
+    UPDATE users SET data_version = data_version + 1
+    WHERE user_id = %(uid)s AND EXISTS (SELECT 1 FROM src)
+)
+SELECT (SELECT COUNT(*) FROM cats), (SELECT COUNT(*) FROM exp)
+"""
+
+
+def category_key(name: str) -> str:
+    """
+    What category names are matched on: "Food", "food" and " Food  " are
+    the same category (the "category_id" statement matches the same way).
+    """
+    return tidy_category_name(name).lower()
 
 
 def get_or_create_category_id(cur, user_id, category_name: str) -> int:
-    cur.execute("SELECT id FROM categories WHERE user_id = %s AND name = %s", (user_id, category_name))
+    """Id of the user's category matching `category_name` (category_key), created if missing."""
+    name = tidy_category_name(category_name)
+    statements.execute(cur, "category_id", (user_id, name.lower(), name))
     row = cur.fetchone()
     if row:
         return row[0]
-    cur.execute("INSERT INTO categories (user_id, name) VALUES (%s, %s) RETURNING id", (user_id, category_name))
-    return cur.fetchone()[0]
\ No newline at end of file
+    # A concurrent insert of a near-duplicate waits for the other
+    # transaction and then finds its row (categories_user_key_uniq).
+    cur.execute(
+        f"""
+        INSERT INTO categories (user_id, name) VALUES (%s, %s)
+        ON CONFLICT (user_id, {CATEGORY_KEY_SQL}) DO NOTHING
+        RETURNING id
+        """,
+        (user_id, name),
+    )
+    row = cur.fetchone()
+    if row:
+        return row[0]
+    statements.execute(cur, "category_id", (user_id, name.lower(), name))
+    return cur.fetchone()[0]
+
+
+def insert_expense(cur, user_id, category_id, amount, description, is_anomaly=False,
+                   currency=None, base_amount=None) -> int:
+    """
+    Insert one expense and add it to daily_spend in the same (prepared) statement.
+    `base_amount` is `amount` in the user's base currency (defaults to amount).
+    """
+    statements.execute(
+        cur, "insert_expense",
+        (user_id, category_id, amount, description, is_anomaly, currency, base_amount),
+    )
+    return cur.fetchone()[0]
+
+
+def insert_expenses(cur, user_id, rows) -> list:
+    """
+    Multi-row insert_expense: rows are (category_id, amount, description,
+    is_anomaly, currency, base_amount). One statement for the expenses and
+    their daily_spend deltas. Returns the new ids in input order.
+    """
+    return [
+        r[0]
+        for r in psycopg2.extras.execute_values(
+            cur,
+            """
+            WITH v AS (
+                SELECT * FROM (VALUES %s)
+                    AS v(ord, user_id, category_id, amount, description, is_anomaly, currency, base_amount)
+            ), ins AS (
+                INSERT INTO expenses (user_id, category_id, amount, description, is_anomaly,
+                                      currency, base_amount, day, period_month)
+                SELECT v.user_id, category_id, amount, description, is_anomaly,
+                       currency, COALESCE(base_amount, amount), t.day,
+                       date_trunc('month', t.day)::date
+                FROM v
+                JOIN LATERAL (
+                    SELECT (CURRENT_TIMESTAMP AT TIME ZONE timezone)::date AS day
+                    FROM users WHERE user_id = v.user_id
+                ) t ON TRUE
+                ORDER BY ord
+                RETURNING id, user_id, category_id, base_amount AS amount, day
+            ), agg AS (
+                INSERT INTO daily_spend (user_id, category_id, day, amount, n, log_sum, log_sumsq)
+                SELECT user_id, COALESCE(category_id, 0), day, SUM(amount), COUNT(*),
+                       SUM(LN(GREATEST(amount, 0.01))), SUM(POWER(LN(GREATEST(amount, 0.01)), 2))
+                FROM ins
+                GROUP BY 1, 2, 3
+                ON CONFLICT (user_id, category_id, day)
+                DO UPDATE SET amount = daily_spend.amount + EXCLUDED.amount,
+                              n = daily_spend.n + EXCLUDED.n,
+                              log_sum = daily_spend.log_sum + EXCLUDED.log_sum,
+                              log_sumsq = daily_spend.log_sumsq + EXCLUDED.log_sumsq
+            ), ver AS (
+                UPDATE users SET data_version = data_version + 1
+                WHERE user_id IN (SELECT user_id FROM v)
+            )
+            SELECT id FROM ins ORDER BY id
+            """,
+            [(i, user_id) + tuple(row) for i, row in enumerate(rows)],
+            template="(%s, %s::bigint, %s::integer, %s::numeric, %s::text, %s::boolean, %s::char(3), %s::numeric)",
+            page_size=max(len(rows), 1),
+            fetch=True,
+        )
+    ]
+
+
+def delete_expenses(cur, user_id, expense_ids) -> list:
+    """Delete the user's expenses by id and take them out of daily_spend. Returns deleted ids."""
+    cur.execute(
+        """
+        WITH del AS (
+            DELETE FROM expenses
+            WHERE user_id = %s AND id = ANY(%s)
+            RETURNING id, user_id, category_id, COALESCE(base_amount, amount) AS amount, day
+        ), agg AS (
+            UPDATE daily_spend d
+            SET amount = d.amount - x.amount, n = d.n - x.n,
+                log_sum = d.log_sum - x.log_sum, log_sumsq = d.log_sumsq - x.log_sumsq
+            FROM (
+                SELECT user_id, COALESCE(category_id, 0) AS category_id, day,
+                       SUM(amount) AS amount, COUNT(*) AS n,
+                       SUM(LN(GREATEST(amount, 0.01))) AS log_sum,
+                       SUM(POWER(LN(GREATEST(amount, 0.01)), 2)) AS log_sumsq
+                FROM del
+                GROUP BY 1, 2, 3
+            ) x
+            WHERE d.user_id = x.user_id AND d.category_id = x.category_id AND d.day = x.day
+        ), ver AS (
+            UPDATE users SET data_version = data_version + 1
+            WHERE user_id IN (SELECT user_id FROM del)
+        )
+        SELECT id FROM del
+        """,
+        (user_id, list(expense_ids)),
+    )
+    return [r[0] for r in cur.fetchall()]
+
+
+# daily_spend rows of months whose expenses are archived (archive.py)
+# are kept as they are: those expenses are no longer in the table.
+_NOT_ARCHIVED = """NOT EXISTS (
+    SELECT 1 FROM expense_archive a
+    WHERE a.user_id = {t}.user_id AND a.period_month = date_trunc('month', {t}.day)::date
+)"""
+
+
+def rebuild_daily_spend(cur, *user_ids):
+    """Recompute the users' daily_spend rows from expenses in one pass (archived months kept)."""
+    user_ids = list(user_ids)
+    cur.execute(
+        "DELETE FROM daily_spend d WHERE user_id = ANY(%s) AND " + _NOT_ARCHIVED.format(t="d"),
+        (user_ids,),
+    )
+    cur.execute("UPDATE users SET data_version = data_version + 1 WHERE user_id = ANY(%s)", (user_ids,))
+    cur.execute(
+        """
+        INSERT INTO daily_spend (user_id, category_id, day, amount, n, log_sum, log_sumsq)
+        SELECT user_id, COALESCE(category_id, 0), day,
+               SUM(x.amount), COUNT(*),
+               SUM(LN(GREATEST(x.amount, 0.01))), SUM(POWER(LN(GREATEST(x.amount, 0.01)), 2))
+        FROM (
+            SELECT user_id, category_id, day, COALESCE(base_amount, amount) AS amount
+            FROM expenses e
+            WHERE user_id = ANY(%s) AND """ + _NOT_ARCHIVED.format(t="e") + """
+        ) x
+        GROUP BY 1, 2, 3
+        """,
+        (user_ids,),
+    )
@@ -0,0 +1,214 @@
+# degraded.py
+import os
+import json
+import uuid
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from decimal import Decimal
+
+import metrics
+from breaker import DatabaseUnavailable
+
+# Degraded mode, while the database is unavailable (DatabaseUnavailable:
+# its breaker is open or it can't be reached):
+# - reads made through read_through() remember their last result per
+#   user (up to DEGRADED_CACHE_ENTRIES) and serve it, with its age, when
+#   the database can't be asked;
+# - expense adds go through defer_write(): a FIFO of at most
+#   DEGRADED_QUEUE_MAX writes, replayed every DEGRADED_REPLAY_SECONDS by
+#   replay_job once the database is back. Each user then gets the reply
+#   they would have got. Replayed expenses are dated when they are saved.
+#   The queue is also appended to DEGRADED_QUEUE_FILE (one JSON line per
+#   write, then one per write finished; fsynced), so writes queued before
+#   a restart are replayed after it. Only functions marked @replayable can
+#   be deferred; their arguments must be JSON values or Decimals. An empty
+#   DEGRADED_QUEUE_FILE keeps the queue in memory only.
+DEGRADED_CACHE_ENTRIES = int(os.getenv("DEGRADED_CACHE_ENTRIES", "20000"))
+DEGRADED_QUEUE_MAX = int(os.getenv("DEGRADED_QUEUE_MAX", "1000"))
+DEGRADED_REPLAY_SECONDS = int(os.getenv("DEGRADED_REPLAY_SECONDS", "15"))
+DEGRADED_QUEUE_FILE = os.getenv("DEGRADED_QUEUE_FILE", "deferred_writes.jsonl")
+REPLAY_JOB = "degraded_replay"
+
+UNAVAILABLE_TEXT = "The database is unavailable right now; please try again in a minute."
+
+_reads = OrderedDict()  # (function, user_id, args) -> (read_at, value)
+_reads_lock = threading.Lock()
+_writes = deque()  # (key, user_id, chat_id, what, queued_at, fn, args)
+_writes_lock = threading.Lock()
+_writes_loaded = False
+_replayable = {}  # name -> function
+
+
+def read_through(fn, user_id: int, *args):
+    """
+    fn(user_id, *args), remembered; the remembered result while the
+    database is unavailable.
+    Returns (value, read_at): read_at is None for a fresh value, else when
+    the stale one was read.
+    """
+    key = (f"{fn.__module__}.{fn.__qualname__}", user_id, args)
+    try:
+        value = fn(user_id, *args)
+    except DatabaseUnavailable:
+        with _reads_lock:
+            hit = _reads.get(key)
+        if hit is None:
+            raise
+        metrics.inc("degraded.read.stale")
+        return hit[1], hit[0]
+    with _reads_lock:
+        _reads[key] = (datetime.now(), value)
+        _reads.move_to_end(key)
+        while len(_reads) > DEGRADED_CACHE_ENTRIES:
+            _reads.popitem(last=False)
+    return value, None
+
+
+def stale_note(read_at) -> str:
+    """Suffix for a reply built from read_through() data ('' when fresh)."""
+    if read_at is None:
+        return ""
+    return f"\n\n⚠️ The database is unavailable; this is from {read_at.strftime('%H:%M')}."
+
+
+def replayable(fn):
+    """Allow fn to be passed to defer_write (and replayed after a restart)."""
+    _replayable[fn.__name__] = fn
+    return fn
+
+
+def _encode(value):
+    return {"decimal": str(value)} if isinstance(value, Decimal) else value
+
+
+def _decode(value):
+    return Decimal(value["decimal"]) if isinstance(value, dict) else value
+
+
+def _append(record: dict):
+    """Add a line to DEGRADED_QUEUE_FILE (caller holds _writes_lock)."""
+    if not DEGRADED_QUEUE_FILE:
+        return
+    with open(DEGRADED_QUEUE_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _load_writes():
+    """
+    Put the writes left in DEGRADED_QUEUE_FILE by an earlier run back in
+    the queue and rewrite the file with just those (caller holds _writes_lock).
+    """
+    global _writes_loaded
+    _writes_loaded = True
+    if not DEGRADED_QUEUE_FILE:
+        return
+    pending = OrderedDict()
+    try:
+        with open(DEGRADED_QUEUE_FILE, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                if "fn" in record:
+                    pending[record["key"]] = record
+                else:
+                    pending.pop(record["key"], None)
+    except FileNotFoundError:
+        return
+    for record in pending.values():
+        fn = _replayable.get(record["fn"])
+        if fn is None:
+            logging.error("Deferred %s for user %s dropped: %s is not replayable",
+                          record["what"], record["user_id"], record["fn"])
+            continue
+        _writes.append((
+            record["key"], record["user_id"], record["chat_id"], record["what"],
+            datetime.fromisoformat(record["queued_at"]), fn, tuple(_decode(a) for a in record["args"]),
+        ))
+    tmp = DEGRADED_QUEUE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(r) + "\n" for r in pending.values() if r["fn"] in _replayable)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, DEGRADED_QUEUE_FILE)
+    if _writes:
+        logging.warning("%s deferred writes from before the restart queued for replay.", len(_writes))
+
+
+def defer_write(user_id: int, chat_id: int, what: str, fn, *args) -> str:
+    """
+    Queue fn(*args), which saves something and returns the reply text,
+    until the database is back. Returns the reply for now. fn must be
+    @replayable.
+    """
+    if _replayable.get(fn.__name__) is not fn:
+        raise ValueError(f"{fn.__name__} is not @replayable")
+    with _writes_lock:
+        if not _writes_loaded:
+            _load_writes()
+        if len(_writes) >= DEGRADED_QUEUE_MAX:
+            metrics.inc("degraded.write.rejected")
+            return f"The database is unavailable right now and too much is waiting; your {what} was NOT saved. Please try again in a few minutes."
+        key, queued_at = uuid.uuid4().hex, datetime.now()
+        try:
+            _append({
+                "key": key, "user_id": user_id, "chat_id": chat_id, "what": what,
+                "queued_at": queued_at.isoformat(), "fn": fn.__name__, "args": [_encode(a) for a in args],
+            })
+        except OSError:
+            logging.exception("Could not record a deferred %s for user %s", what, user_id)
+            metrics.inc("degraded.write.rejected")
+            return f"The database is unavailable right now; your {what} was NOT saved. Please try again in a few minutes."
+        _writes.append((key, user_id, chat_id, what, queued_at, fn, args))
+        metrics.gauge("degraded.write.queued", len(_writes))
+    metrics.inc("degraded.write.deferred")
+    return f"The database is unavailable right now. Your {what} is queued and will be saved as soon as it is back; you'll get a confirmation here."
+
+
+async def replay_job(context):
+    """JobQueue callback: replay deferred writes in order until the database turns them away."""
+    while True:
+        with _writes_lock:
+            if not _writes_loaded:
+                _load_writes()
+            if not _writes:
+                break
+            item = _writes.popleft()
+        key, user_id, chat_id, what, queued_at, fn, args = item
+        try:
+            text = await asyncio.to_thread(fn, *args)
+        except DatabaseUnavailable:
+            with _writes_lock:
+                _writes.appendleft(item)
+            break
+        except Exception:
+            logging.exception("Replaying a deferred %s for user %s failed", what, user_id)
+            metrics.inc("degraded.write.failed")
+            text = f"Sorry, your {what} from {queued_at.strftime('%H:%M')} could not be saved after all."
+        else:
+            metrics.inc("degraded.write.replayed")
+            text = f"Saved now (sent at {queued_at.strftime('%H:%M')} while the database was unavailable):\n{text}"
+        with _writes_lock:
+            try:
+                _append({"key": key})
+            except OSError:
+                logging.exception("Could not record a replayed %s for user %s", what, user_id)
+        try:
+            await context.bot.send_message(chat_id=chat_id, text=text)
+        except Exception:
+            logging.exception("Could not confirm a deferred %s to user %s", what, user_id)
+    with _writes_lock:
+        if not _writes and DEGRADED_QUEUE_FILE:
+            # Everything is saved: start the file afresh.
+            try:
+                if os.path.getsize(DEGRADED_QUEUE_FILE):
+                    open(DEGRADED_QUEUE_FILE, "w").close()
+            except OSError:
+                pass
+        metrics.gauge("degraded.write.queued", len(_writes))
@@ -0,0 +1,185 @@
+# digest.py
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from datetime import date, datetime, timedelta
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+import metrics
+from repository import get_repository
+
+# Opt-in spending digest (/digest daily|weekly|off). Once a day the job
+# pages through opted-in users in chunks of DIGEST_CHUNK_SIZE, one
+# set-based query per chunk (see Repository.digest_chunks), renders the
+# texts in a process pool and queues them for a sender that stays under
+# DIGEST_RATE messages/second, leaving the rest of Telegram's ~30/s
+# budget to interactive replies. Each chunk is checkpointed once sent, so
+# a restart resumes where it stopped; weekly users get theirs on
+# DIGEST_WEEKLY_DAY (0 = Monday) covering the week that just ended.
+DIGEST_JOB = "spending_digest"
+DIGEST_MODES = ("daily", "weekly")
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "8"))
+DIGEST_WEEKLY_DAY = int(os.getenv("DIGEST_WEEKLY_DAY", "0"))
+DIGEST_CHUNK_SIZE = int(os.getenv("DIGEST_CHUNK_SIZE", "5000"))
+DIGEST_RATE = float(os.getenv("DIGEST_RATE", "20"))
+DIGEST_IN_FLIGHT = int(os.getenv("DIGEST_IN_FLIGHT", "16"))
+DIGEST_RENDER_WORKERS = int(os.getenv("DIGEST_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_CHECKPOINT = object()
+
+
+def digest_window(today: date):
+    """(yesterday, start of its week, start of its month)."""
+    day = today - timedelta(days=1)
+    return day, day - timedelta(days=day.weekday()), day.replace(day=1)
+
+
+def render_digest(row, window) -> str:
+    user_id, currency, day_total, week_total, month_total, budget = row
+    day, week_start, month_start = window
+    lines = [
+        f"📊 Spending digest — {day.strftime('%a %d %b')}",
+        f"Yesterday: {day_total:.2f} {currency}",
+        f"This week (since {week_start.strftime('%a %d %b')}): {week_total:.2f} {currency}",
+    ]
+    if budget:
+        pct = float(month_total) / float(budget) * 100
+        lines.append(f"{month_start.strftime('%B')}: {month_total:.2f} of {budget:.2f} {currency} budget ({pct:.0f}%)")
+        if month_total > budget:
+            lines.append(f"⚠️ Over budget by {month_total - budget:.2f} {currency}")
+    else:
+        lines.append(f"{month_start.strftime('%B')}: {month_total:.2f} {currency} (no budget set)")
+    lines.append("\n/digest off to stop these.")
+    return "\n".join(lines)
+
+
+def render_batch(window, rows) -> list:
+    """[(user_id, text)] for one slice of a chunk (runs in a worker process)."""
+    return [(row[0], render_digest(row, window)) for row in rows]
+
+
+class RateLimiter:
+    """Evenly spaced permits, `rate` per second; pause() pushes the next one back."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_at = time.monotonic()
+
+    async def acquire(self):
+        now = time.monotonic()
+        wait = self.next_at - now
+        self.next_at = max(now, self.next_at) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+
+def _produce(loop, queue, today: date, modes):
+    """Worker thread: query chunks, render them, feed the sender's queue."""
+    repo = get_repository()
+    window = digest_window(today)
+    workers = max(DIGEST_RENDER_WORKERS, 1)
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    try:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            for marker, rows in repo.digest_chunks(today, modes, window, DIGEST_CHUNK_SIZE):
+                size = -(-len(rows) // workers) or 1
+                slices = [rows[i:i + size] for i in range(0, len(rows), size)]
+                for batch in pool.map(partial(render_batch, window), slices):
+                    for item in batch:
+                        put(item)
+                put((_CHECKPOINT, marker))
+    finally:
+        put(None)
+
+
+async def _send(bot, limiter, user_id: int, text: str):
+    for _ in range(2):
+        await limiter.acquire()
+        try:
+            await bot.send_message(chat_id=user_id, text=text)
+            metrics.inc("digest.sent")
+            return
+        except RetryAfter as e:
+            wait = e.retry_after
+            wait = wait.total_seconds() if isinstance(wait, timedelta) else float(wait)
+            metrics.inc("digest.retry_after")
+            limiter.pause(wait)
+        except Forbidden:
+            # Blocked the bot or deleted the chat: stop sending to them.
+            metrics.inc("digest.blocked")
+            await asyncio.to_thread(set_digest, user_id, None)
+            return
+        except TelegramError as e:
+            metrics.inc("digest.failed")
+            logging.warning("Digest to %s failed: %s", user_id, e)
+            return
+    metrics.inc("digest.failed")
+
+
+async def send_digests(bot, today: date = None) -> int:
+    """Send today's digests; returns how many were handed to Telegram."""
+    today = today or date.today()
+    modes = DIGEST_MODES if today.weekday() == DIGEST_WEEKLY_DAY else ("daily",)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=DIGEST_CHUNK_SIZE)
+    limiter = RateLimiter(DIGEST_RATE)
+    in_flight = asyncio.Semaphore(DIGEST_IN_FLIGHT)
+    pending = set()
+    queued = 0
+
+    async def send(user_id, text):
+        try:
+            await _send(bot, limiter, user_id, text)
+        except Exception:
+            metrics.inc("digest.failed")
+            logging.exception("Digest to %s failed", user_id)
+        finally:
+            in_flight.release()
+
+    producer = loop.run_in_executor(None, _produce, loop, queue, today, modes)
+    while (item := await queue.get()) is not None:
+        if item[0] is _CHECKPOINT:
+            # Everything before the marker is sent (or given up on).
+            await asyncio.gather(*pending)
+            await asyncio.to_thread(get_repository().digest_checkpoint, today, item[1])
+            continue
+        await in_flight.acquire()
+        task = asyncio.create_task(send(*item))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        queued += 1
+    await asyncio.gather(*pending)
+    await producer
+    logging.info("Digest %s: %s messages", today, queued)
+    return queued
+
+
+def set_digest(user_id: int, mode):
+    with get_repository().write(user_id) as store:
+        store.set_digest(mode)
+
+
+def get_digest(user_id: int):
+    with get_repository().read(user_id) as store:
+        return store.digest()
+
+
+async def digest_job(context):
+    """JobQueue callback (daily at DIGEST_HOUR, plus a catch-up after restarts)."""
+    # "Today" in the time zone the job is scheduled in, not the server's.
+    today = datetime.now(context.job_queue.scheduler.timezone).date()
+    try:
+        await send_digests(context.bot, today)
+    except Exception:
+        logging.exception("Digest job failed")
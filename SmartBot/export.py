@@ -0,0 +1,44 @@
+# export.py
+import io
+import csv
+
+from archive import iter_archived
+from fx import DEFAULT_CURRENCY
+from repository import get_repository
+
+# /export: every expense of the user as CSV, archived months first (read
+# from the archive files one month at a time, see archive.py), then the
+# expenses table EXPORT_PAGE_SIZE rows per read.
+EXPORT_PAGE_SIZE = 5000
+EXPORT_COLUMNS = ("id", "date", "day", "category", "amount", "currency", "description")
+
+
+def export_rows(user_id: int):
+    """Yield the user's expenses as EXPORT_COLUMNS tuples."""
+    repo = get_repository()
+    with repo.read(user_id) as store:
+        names = dict(store.categories())
+    archived = set()
+    for id_, category_id, amount, currency, _, description, when, day, *_ in iter_archived(user_id):
+        archived.add(id_)
+        yield id_, when, day, names.get(category_id), amount, currency, description
+
+    after = 0
+    while True:
+        with repo.read(user_id) as store:
+            page = store.export_expenses(after, EXPORT_PAGE_SIZE)
+        # A row archived while this ran can turn up twice.
+        yield from (row for row in page if row[0] not in archived)
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        after = page[-1][0]
+
+
+def export_csv(user_id: int) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_COLUMNS)
+    for id_, when, day, category, amount, currency, description in export_rows(user_id):
+        writer.writerow([id_, when.isoformat(), day.isoformat(), category or "",
+                         amount, currency or DEFAULT_CURRENCY, description or ""])
+    return out.getvalue().encode("utf-8")
@@ -0,0 +1,226 @@
+# forecast.py
+import io
+import os
+import asyncio
+import calendar
+import logging
+from datetime import date
+
+import numpy as np
+
+from database import get_db_connection, fan_out
+
+# History used for the weekday spending profile (12 full weeks).
+HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "84"))
+FORECAST_JOB = "spend_forecast"
+NO_OVERRUN = np.iinfo(np.int32).max
+
+# Groups projected per slice; bounds the (groups x remaining days) matrix.
+_GROUP_CHUNK = 65536
+_FETCH_SIZE = 200000
+
+
+def project_month_end(gid, offset, amount, budget, today: date):
+    """
+    Project month-end spend and the budget overrun day for every group.
+
+    gid     int array, group (user/category) index of each daily aggregate
+    offset  int array, day of the aggregate relative to `today` (<= 0)
+    amount  float array, spend on that day
+    budget  float array (G,), budget per group, 0 for none
+
+    Remaining days are filled with a blend of this month's daily run rate
+    and the group's weekday profile from the HISTORY_DAYS before the month;
+    the run rate gets more weight as the month goes on.
+
+    Returns (projected, overrun) arrays of length G. `overrun` is the day
+    offset from `today` at which month spend reaches the budget (negative if
+    it already has), NO_OVERRUN if it is not expected to.
+    """
+    G = budget.shape[0]
+    elapsed = today.day
+    remaining = calendar.monthrange(today.year, today.month)[1] - elapsed
+    month_start = 1 - elapsed
+
+    in_month = offset >= month_start
+    mtd = np.bincount(gid[in_month], weights=amount[in_month], minlength=G)
+
+    # Weekday profile: average spend per weekday over the history window.
+    hist = (~in_month) & (offset >= month_start - HISTORY_DAYS)
+    dow = (today.weekday() + offset) % 7
+    hist_sum = np.bincount(
+        gid[hist] * 7 + dow[hist], weights=amount[hist], minlength=G * 7
+    ).reshape(G, 7)
+    window_dows = (today.weekday() + np.arange(month_start - HISTORY_DAYS, month_start)) % 7
+    hist_rate = hist_sum / np.maximum(np.bincount(window_dows, minlength=7), 1)
+    has_hist = hist_sum.any(axis=1)
+
+    mtd_rate = mtd / elapsed
+    weight = np.where(has_hist, elapsed / (elapsed + 7.0), 1.0)
+    rem_dows = (today.weekday() + np.arange(1, remaining + 1)) % 7
+
+    projected = mtd.copy()
+    overrun = np.full(G, NO_OVERRUN, dtype=np.int32)
+
+    # Already over budget: first day this month where running spend crossed it.
+    has_budget = budget > 0
+    m_gid, m_off, m_amt = gid[in_month], offset[in_month], amount[in_month]
+    if m_gid.size:
+        order = np.lexsort((m_off, m_gid))
+        m_gid, m_off, m_amt = m_gid[order], m_off[order], m_amt[order]
+        running = np.cumsum(m_amt)
+        starts = np.r_[0, np.flatnonzero(np.diff(m_gid)) + 1]
+        lengths = np.diff(np.r_[starts, m_gid.size])
+        running -= np.repeat(running[starts] - m_amt[starts], lengths)
+        crossed = has_budget[m_gid] & (running >= budget[m_gid])
+        np.minimum.at(overrun, m_gid[crossed], m_off[crossed].astype(np.int32))
+
+    if remaining:
+        for lo in range(0, G, _GROUP_CHUNK):
+            hi = min(lo + _GROUP_CHUNK, G)
+            w = weight[lo:hi, None]
+            daily = w * mtd_rate[lo:hi, None] + (1.0 - w) * hist_rate[lo:hi][:, rem_dows]
+            cum = np.cumsum(daily, axis=1)
+            projected[lo:hi] += cum[:, -1]
+
+            need = budget[lo:hi] - mtd[lo:hi]
+            pending = has_budget[lo:hi] & (overrun[lo:hi] == NO_OVERRUN)
+            hit = cum >= need[:, None]
+            will = pending & hit.any(axis=1)
+            overrun[lo:hi][will] = hit[will].argmax(axis=1) + 1
+
+    return projected, overrun
+
+
+# ------------------------------ batch job ------------------------------ #
+def fetch_columns(cur, query, params, ncols):
+    cur.execute(query, params)
+    chunks = []
+    while True:
+        rows = cur.fetchmany(_FETCH_SIZE)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.float64))
+    if not chunks:
+        return [np.empty(0) for _ in range(ncols)]
+    data = np.concatenate(chunks)
+    return [data[:, i] for i in range(ncols)]
+
+
+def _stage_rows(uid, cid, period: date, projected, overrun, today: date) -> io.StringIO:
+    """Tab-separated COPY input for budget_forecasts."""
+    dates = np.datetime_as_string(
+        np.datetime64(today, "D") + np.where(overrun == NO_OVERRUN, 0, overrun)
+    )
+    dates = np.where(overrun == NO_OVERRUN, "\\N", dates)
+    buf = io.StringIO()
+    p = period.isoformat()
+    buf.writelines(
+        f"{u}\t{c}\t{p}\t{v:.2f}\t{d}\n"
+        for u, c, v, d in zip(uid.tolist(), cid.tolist(), projected.tolist(), dates.tolist())
+    )
+    buf.seek(0)
+    return buf
+
+
+def run_forecasts(today: date = None, force: bool = False) -> int:
+    """
+    Recompute month-end projections for every user/category and store them
+    in budget_forecasts, each shard in parallel. Returns groups projected.
+    """
+    return sum(fan_out(_run_shard_forecasts, today or date.today(), force))
+
+
+def _run_shard_forecasts(shard: int, today: date, force: bool) -> int:
+    """
+    One shard's forecasts: two streaming reads, NumPy, one COPY.
+    Skipped if it already ran for `today` unless `force` is set.
+    """
+    period = today.replace(day=1)
+    since = date.fromordinal(period.toordinal() - HISTORY_DAYS)
+
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT done FROM job_checkpoints WHERE job_name = %s AND run_key = %s",
+                (FORECAST_JOB, today),
+            )
+            row = cur.fetchone()
+    if row and row[0] and not force:
+        return 0
+
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor(name="forecast_daily") as cur:
+            s_uid, s_cid, s_off, s_amt = fetch_columns(
+                cur,
+                """
+                SELECT user_id, category_id, (day - %s::date), amount::float8
+                FROM daily_spend
+                WHERE day >= %s AND day <= %s AND category_id <> 0 AND n > 0
+                """,
+                (today, since, today),
+                4,
+            )
+        with conn.cursor(name="forecast_budgets") as cur:
+            b_uid, b_cid, b_amt = fetch_columns(
+                cur,
+                "SELECT user_id, category_id, amount::float8 FROM budgets WHERE period_month = %s",
+                (period,),
+                3,
+            )
+
+    keys = np.concatenate(
+        [np.stack([s_uid, s_cid], axis=1), np.stack([b_uid, b_cid], axis=1)]
+    ).astype(np.int64)
+    if not keys.size:
+        return 0
+    groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    budget = np.zeros(len(groups))
+    budget[inverse[s_uid.size:]] = b_amt
+
+    projected, overrun = project_month_end(
+        inverse[: s_uid.size], s_off.astype(np.int64), s_amt, budget, today
+    )
+    buf = _stage_rows(groups[:, 0], groups[:, 1], period, projected, overrun, today)
+
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "CREATE TEMP TABLE forecast_stage (LIKE budget_forecasts INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            cur.copy_expert(
+                "COPY forecast_stage (user_id, category_id, period_month, projected, overrun_date) FROM STDIN",
+                buf,
+            )
+            cur.execute(
+                """
+                INSERT INTO budget_forecasts (user_id, category_id, period_month, projected, overrun_date)
+                SELECT s.user_id, s.category_id, s.period_month, s.projected, s.overrun_date
+                FROM forecast_stage s
+                JOIN categories c ON c.id = s.category_id
+                ON CONFLICT (user_id, category_id, period_month)
+                DO UPDATE SET projected = EXCLUDED.projected,
+                              overrun_date = EXCLUDED.overrun_date,
+                              computed_at = CURRENT_TIMESTAMP
+                """
+            )
+            cur.execute(
+                """
+                INSERT INTO job_checkpoints (job_name, run_key, done)
+                VALUES (%s, %s, TRUE)
+                ON CONFLICT (job_name, run_key) DO UPDATE SET done = TRUE, updated_at = CURRENT_TIMESTAMP
+                """,
+                (FORECAST_JOB, today),
+            )
+
+    logging.info("Spend forecasts: %s groups projected for %s (shard %s).", len(groups), period, shard)
+    return len(groups)
+
+
+async def forecast_job(context):
+    """JobQueue callback (nightly)."""
+    try:
+        await asyncio.to_thread(run_forecasts)
+    except Exception:
+        logging.exception("Forecast job failed")
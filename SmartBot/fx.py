@@ -0,0 +1,198 @@
+# fx.py
+import os
+import sys
+import time
+import logging
+from decimal import Decimal, ROUND_HALF_UP
+from datetime import date
+
+from repository import get_repository
+
+# Rates are loaded locally into fx_rates as "units of currency per 1 USD"
+# by date (python fx.py rates.csv). Stored amounts keep their original
+# currency; expenses.base_amount and daily_spend are in the user's base
+# currency, so reports aggregate without converting anything.
+DEFAULT_CURRENCY = os.getenv("DEFAULT_CURRENCY", "USD").upper()
+PIVOT = "USD"
+_CENT = Decimal("0.01")
+# Rates and the set of known currencies are cached this long in the bot
+# process, so rates loaded with `python fx.py` reach it within that time.
+FX_CACHE_SECONDS = float(os.getenv("FX_CACHE_SECONDS", "3600"))
+_RATE_CACHE_SIZE = 8192
+
+_base_currency = {}  # user_id -> code
+_known = (None, frozenset())
+_rates = (None, {})  # (loaded_at, (currency, day) -> per-USD rate)
+
+
+class FxError(ValueError):
+    pass
+
+
+def _rate(currency: str, day: date) -> Decimal:
+    """
+    Latest per-USD rate on or before `day`, else the earliest one (cached
+    per currency/day for FX_CACHE_SECONDS).
+    """
+    global _rates
+    if currency == PIVOT:
+        return Decimal(1)
+    loaded_at, rates = _rates
+    now = time.monotonic()
+    if loaded_at is None or now - loaded_at > FX_CACHE_SECONDS or len(rates) > _RATE_CACHE_SIZE:
+        _rates = (now, {})
+        rates = _rates[1]
+    rate = rates.get((currency, day))
+    if rate is None:
+        rate = get_repository().fx_rate(currency, day)
+        if rate is None:
+            raise FxError(f"No exchange rate for {currency}")
+        rate = rates[(currency, day)] = Decimal(str(rate))
+    return rate
+
+
+def convert(amount, from_currency: str, to_currency: str, day: date = None) -> Decimal:
+    amount = Decimal(str(amount))
+    if from_currency == to_currency:
+        return amount
+    day = day or date.today()
+    converted = amount * _rate(to_currency, day) / _rate(from_currency, day)
+    return converted.quantize(_CENT, rounding=ROUND_HALF_UP)
+
+
+def known_currencies() -> frozenset:
+    """Currency codes with at least one rate (cached FX_CACHE_SECONDS)."""
+    global _known
+    loaded_at, codes = _known
+    if loaded_at is None or time.monotonic() - loaded_at > FX_CACHE_SECONDS:
+        codes = frozenset(get_repository().currencies()) | {PIVOT, DEFAULT_CURRENCY}
+        _known = (time.monotonic(), codes)
+    return codes
+
+
+def normalize_currency(code) -> str:
+    """Upper-cased known code, or None for empty input; FxError if unknown."""
+    code = (code or "").strip().upper()
+    if not code:
+        return None
+    if code not in known_currencies():
+        raise FxError(f"Unknown currency {code}")
+    return code
+
+
+def base_currency(user_id: int) -> str:
+    code = _base_currency.get(user_id)
+    if code is None:
+        with get_repository().read(user_id) as store:
+            code = store.base_currency() or DEFAULT_CURRENCY
+        if len(_base_currency) > 100000:
+            _base_currency.clear()
+        _base_currency[user_id] = code
+    return code
+
+
+def rebase_currencies(expense_currencies, base: str, old: str) -> set:
+    """
+    Currencies whose rates switching from `old` to `base` converts with,
+    for a user with expenses in `expense_currencies`.
+    """
+    needed = set(expense_currencies) | {old}
+    needed.discard(base)
+    if needed:
+        needed.add(base)
+    needed.discard(PIVOT)
+    return needed
+
+
+# Per-USD rate of `cur` on `day` as a SQL expression, as _rate(): USD is 1,
+# days before the first rate take the earliest one, and a currency without
+# rates is NULL (set_base_currency checks for those first).
+RATE_SQL = """CASE WHEN {cur} = '%s' THEN 1 ELSE COALESCE((
+    SELECT r.per_usd FROM fx_rates r
+    WHERE r.currency = {cur} AND r.rate_date <= {day}
+    ORDER BY r.rate_date DESC LIMIT 1
+), (
+    SELECT r.per_usd FROM fx_rates r
+    WHERE r.currency = {cur}
+    ORDER BY r.rate_date LIMIT 1
+)) END""" % PIVOT
+
+REBASE_EXPENSES_SQL = """
+UPDATE expenses e
+SET base_amount = CASE
+    WHEN COALESCE(e.currency, %(default)s) = %(base)s THEN e.amount
+    ELSE ROUND(e.amount * {to_rate} / {from_rate}, 2)
+END
+WHERE e.user_id = %(uid)s
+""".format(
+    to_rate=RATE_SQL.format(cur="%(base)s", day="e.date::date"),
+    from_rate=RATE_SQL.format(cur="COALESCE(e.currency, %(default)s)", day="e.date::date"),
+)
+
+REBASE_BUDGETS_SQL = """
+UPDATE budgets b
+SET amount = ROUND(b.amount * {to_rate} / {from_rate}, 2)
+WHERE b.user_id = %(uid)s
+  AND b.period_month >= (
+      SELECT date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE timezone)::date
+      FROM users WHERE user_id = %(uid)s
+  )
+""".format(
+    to_rate=RATE_SQL.format(cur="%(base)s", day="CURRENT_DATE"),
+    from_rate=RATE_SQL.format(cur="%(old)s", day="CURRENT_DATE"),
+)
+
+# daily_spend of archived months (archive.py) cannot be rebuilt from
+# expenses; it is all in the old base currency, so each day is re-priced by
+# that day's rate between the two (ln of the amounts shifts by ln(ratio)).
+REBASE_ARCHIVED_SPEND_SQL = """
+UPDATE daily_spend d
+SET amount = ROUND(d.amount * k.ratio, 2),
+    log_sum = d.log_sum + d.n * k.ln,
+    log_sumsq = d.log_sumsq + 2 * k.ln * d.log_sum + d.n * k.ln * k.ln
+FROM (
+    SELECT s.category_id, s.day, r.ratio, LN(r.ratio)::float8 AS ln
+    FROM daily_spend s
+    JOIN expense_archive a
+      ON a.user_id = s.user_id AND a.period_month = date_trunc('month', s.day)::date
+    CROSS JOIN LATERAL (SELECT {to_rate} / {from_rate} AS ratio) r
+    WHERE s.user_id = %(uid)s
+) k
+WHERE d.user_id = %(uid)s AND d.category_id = k.category_id AND d.day = k.day
+""".format(
+    to_rate=RATE_SQL.format(cur="%(base)s", day="s.day"),
+    from_rate=RATE_SQL.format(cur="%(old)s", day="s.day"),
+)
+
+
+def set_base_currency(user_id: int, code: str):
+    """
+    Switch the user's base currency and re-convert in bulk: every
+    expenses.base_amount and this month's budgets. FxError (nothing
+    changed) if a currency involved has no rates.
+    """
+    get_repository().set_base_currency(user_id, code, base_currency(user_id))
+    _base_currency[user_id] = code
+
+
+def load_rates(path: str) -> int:
+    """
+    Load a CSV of date,currency,per_usd (header row optional) into fx_rates
+    (on every shard). Existing (currency, date) rows are overwritten.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text and not text[0].isdigit():
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+    loaded = get_repository().load_rates(text)
+    global _known, _rates
+    _known = (None, frozenset())
+    _rates = (None, {})
+    return loaded
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 2:
+        sys.exit("usage: python fx.py rates.csv   (columns: date,currency,per_usd)")
+    print(f"{load_rates(sys.argv[1])} rates loaded.")
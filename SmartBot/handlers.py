@@ -1,11 +1,12 @@
 # handlers.py
 import os
 import json
+import asyncio
 import base64
+import hashlib
 import logging
 import time
 from decimal import Decimal
-from datetime import datetime
 
 from telegram import (
     Update,
@@ -18,12 +19,21 @@ from telegram import (
 )
 from telegram.ext import ContextTypes, ConversationHandler
 
-from database import (
-    get_db_connection,
-    ensure_default_categories,
-    get_or_create_category_id,
-    current_period,
-)
+from repository import get_repository
+from timezones import normalize_timezone, set_user_timezone, user_period, user_timezone, user_today
+from anomaly import check_expense
+from categorizer import suggest_category, observe as observe_expense
+from quick_add import QUICK_ADD_PATTERN, QuickAddError, parse_quick_add, save_quick_add
+from fx import FxError, base_currency, normalize_currency, set_base_currency
+from recurring import parse_frequency
+from digest import DIGEST_HOUR, DIGEST_MODES, get_digest, set_digest
+from report import REPORT_MONTHS, report_payload
+from bulk import BULK_UNDO_SECONDS, BulkError, run_bulk, undo_last
+from categories import CategoryError, run_category
+from export import export_csv
+from database import MAX_AMOUNT, category_key
+from breaker import DatabaseUnavailable
+from degraded import UNAVAILABLE_TEXT, defer_write, read_through, replayable, stale_note
 
 from config import (
     ADD_EXPENSE_AMOUNT,
@@ -48,42 +58,30 @@ def _encode_payload(payload_dict: dict) -> str:
 
 def _per_user_budget_items(user_id: int):
     """
-    Return list of {name, setBudget, used} for the current month.
+    Return list of {name, setBudget, used, projected, overrunDate} for the
+    current month. projected/overrunDate come from the nightly forecast job
+    and are None until it has run.
     """
     items = []
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT c.name, b.amount,
-                       COALESCE((
-                           SELECT SUM(e.amount)
-                           FROM expenses e
-                           WHERE e.user_id = b.user_id
-                             AND e.category_id = b.category_id
-                             AND e.date >= b.period_month
-                             AND e.date < (b.period_month + INTERVAL '1 month')
-                       ), 0) AS used
-                FROM budgets b
-                JOIN categories c ON b.category_id = c.id
-                WHERE b.user_id = %s
-                  AND b.period_month = DATE_TRUNC('month', CURRENT_DATE)
-                ORDER BY c.name
-                """,
-                (user_id,),
-            )
-            for name, amount, used in cur.fetchall():
-                items.append(
-                    {
-                        "name": name,
-                        "setBudget": float(amount),
-                        "used": float(used or 0.0),
-                    }
-                )
+    rows, _ = read_through(_budget_rows, user_id, user_period(user_id))
+    for name, amount, used, projected, overrun_date in rows:
+        items.append(
+            {
+                "name": name,
+                "setBudget": float(amount),
+                "used": float(used or 0.0),
+                "projected": float(projected) if projected is not None else None,
+                "overrunDate": overrun_date.isoformat() if overrun_date else None,
+            }
+        )
     return items
 
 
-def _reply_kb(budget_url: str, expense_url: str, version: int) -> ReplyKeyboardMarkup:
+def _report_url(user_id: int, version: int) -> str:
+    return f"{WEBAPP_BASE}/report.html?v={version}&payload={report_payload(user_id)}"
+
+
+def _reply_kb(budget_url: str, expense_url: str, report_url: str) -> ReplyKeyboardMarkup:
     """
     One row with 3 WebApp buttons (Budget, Expense, Report).
     """
@@ -92,10 +90,7 @@ def _reply_kb(budget_url: str, expense_url: str, version: int) -> ReplyKeyboardM
             [
                 KeyboardButton(text="💰 Budget", web_app=WebAppInfo(url=budget_url)),
                 KeyboardButton(text="💸 Expense", web_app=WebAppInfo(url=expense_url)),
-                KeyboardButton(
-                    text="📊 Report",
-                    web_app=WebAppInfo(url=f"{WEBAPP_BASE}/report.html?v={version}"),
-                ),
+                KeyboardButton(text="📊 Report", web_app=WebAppInfo(url=report_url)),
             ],
         ],
         resize_keyboard=True,
@@ -104,16 +99,15 @@ def _reply_kb(budget_url: str, expense_url: str, version: int) -> ReplyKeyboardM
 
 
 # (legacy helpers for CLI flows)
+def _category_names(user_id: int):
+    with get_repository().read(user_id) as store:
+        return [name for _, name in store.categories()]
+
+
 def get_expense_categories(user_id: int):
     categories = []
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT name FROM categories WHERE user_id = %s ORDER BY name",
-                    (user_id,),
-                )
-                categories = [r[0] for r in cur.fetchall()]
+        categories, _ = read_through(_category_names, user_id)
     except Exception:
         logging.exception("Error retrieving categories for user %s", user_id)
     return categories
@@ -128,34 +122,36 @@ def build_category_keyboard(categories):
 
 
 # ----------------------------- Start / Menu ----------------------------- #
+def ensure_categories(user_id: int):
+    """Seed the default categories."""
+    with get_repository().write(user_id) as store:
+        store.ensure_default_categories()
+
+
+def _start_user(user_id: int, first_name: str, version: int):
+    with get_repository().write(user_id) as store:
+        store.upsert_user(first_name)
+    ensure_categories(user_id)
+    return _per_user_budget_items(user_id), _report_url(user_id, version)
+
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Welcome + show WebApp buttons. Uses separate pages:
     - index.html  -> Budget
     - expense.html -> Expense
+    - report.html -> Report
     """
     user = update.effective_user
     user_id = user.id
     first_name = user.first_name or "there"
 
     try:
-        # Ensure user row
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO users (user_id, first_name)
-                    VALUES (%s, %s)
-                    ON CONFLICT (user_id) DO UPDATE SET first_name = EXCLUDED.first_name
-                    """,
-                    (user_id, first_name),
-                )
-
-        # Seed default categories once
-        ensure_default_categories(user_id)
+        version = int(time.time())
 
-        # Build items for this user/month
-        items = _per_user_budget_items(user_id)
+        # Ensure user row, seed default categories once and build items for
+        # this user/month, off the event loop (heavy lane, see admission.py).
+        items, report_url = await asyncio.to_thread(_start_user, user_id, first_name, version)
 
         # Two payloads with ui hints (optional on client)
         p_budget = {"type": "budget.init", "ui": "budget", "items": items}
@@ -163,8 +159,6 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         b64_budget = _encode_payload(p_budget)
         b64_expense = _encode_payload(p_expense)
 
-        version = int(time.time())
-
         # Multi-page URLs (no SPA routing/404 issues)
         budget_url = f"{WEBAPP_BASE}/index.html?v={version}&payload={b64_budget}"
         expense_url = f"{WEBAPP_BASE}/expense.html?v={version}&payload={b64_expense}"
@@ -176,15 +170,17 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "Use the bottom buttons to open the Web App:\n"
                 "• Budget → edit amounts → Save\n"
                 "• Expense → quick add or view last 10\n"
-                "• Report  → (coming next)\n"
+                f"• Report  → last {REPORT_MONTHS} months by category, budget vs. used\n"
             )
         )
 
         # Show the reply keyboard (one row, three buttons)
         await update.message.reply_text(
-            "Quick menu ready below.", reply_markup=_reply_kb(budget_url, expense_url, version)
+            "Quick menu ready below.", reply_markup=_reply_kb(budget_url, expense_url, report_url)
         )
 
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
     except Exception:
         logging.exception("Error in start_command for user %s", user_id)
         await update.message.reply_text(
@@ -194,11 +190,16 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Kept only for compatibility if you later add inline callback buttons.
+    Inline callback buttons. Currently only search paging
+    ("search:<cursor>:<query ref>", see search_reply).
     """
     try:
-        if update.callback_query:
-            await update.callback_query.answer()
+        query = update.callback_query
+        if not query:
+            return
+        await query.answer()
+        if (query.data or "").startswith("search:"):
+            await _search_next_page(update, context, query.data[len("search:"):])
     except Exception:
         logging.exception("button_handler error")
 
@@ -219,11 +220,13 @@ def _build_webapp_urls_for_user(user_id: int):
 async def open_budget_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = update.effective_user.id
-        budget_url, _ = _build_webapp_urls_for_user(user_id)
+        budget_url, _ = await asyncio.to_thread(_build_webapp_urls_for_user, user_id)
         kb = InlineKeyboardMarkup(
             [[InlineKeyboardButton("Open Budget WebApp", web_app=WebAppInfo(url=budget_url))]]
         )
         await update.message.reply_text("Tap to open Budget:", reply_markup=kb)
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
     except Exception:
         logging.exception("open_budget_command error")
         await update.message.reply_text("Sorry, couldn't open Budget.")
@@ -232,11 +235,13 @@ async def open_budget_command(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def open_expense_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = update.effective_user.id
-        _, expense_url = _build_webapp_urls_for_user(user_id)
+        _, expense_url = await asyncio.to_thread(_build_webapp_urls_for_user, user_id)
         kb = InlineKeyboardMarkup(
             [[InlineKeyboardButton("Open Expense WebApp", web_app=WebAppInfo(url=expense_url))]]
         )
         await update.message.reply_text("Tap to open Expense:", reply_markup=kb)
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
     except Exception:
         logging.exception("open_expense_command error")
         await update.message.reply_text("Sorry, couldn't open Expense.")
@@ -249,124 +254,194 @@ async def add_expense_command(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 
 async def add_expense_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Accepts "120" or "120 coffee with Sam". With a description, the category
+    is predicted from the user's history: auto-assigned when confident,
+    otherwise offered first on the keyboard.
+    """
     try:
-        amount = Decimal(update.message.text.strip())
+        amount_text, _, description = update.message.text.strip().partition(" ")
+        amount = Decimal(amount_text)
         if amount <= 0:
             await update.message.reply_text("Amount must be a positive number. Try again.")
             return ADD_EXPENSE_AMOUNT
-
-        context.user_data["amount"] = amount
-        categories = get_expense_categories(update.effective_user.id)
-        keyboard = build_category_keyboard(categories)
-        await update.message.reply_text(
-            "Select a category or type a new one:", reply_markup=keyboard
-        )
-        return ADD_EXPENSE_CATEGORY
+        if amount > MAX_AMOUNT:
+            await update.message.reply_text(f"Amount must be at most {MAX_AMOUNT}. Try again.")
+            return ADD_EXPENSE_AMOUNT
     except Exception:
         await update.message.reply_text("Invalid amount. Enter a valid number.")
         return ADD_EXPENSE_AMOUNT
 
+    user_id = update.effective_user.id
+    context.user_data["amount"] = amount
+    description = description.strip()
+    suggestion = None
+    if description:
+        context.user_data["description"] = description
+        suggestion = await asyncio.to_thread(suggest_category, user_id, description)
+        if suggestion and suggestion[1]:
+            context.user_data["category"] = suggestion[0]
+            return await _save_expense(update, context)
+
+    categories = await asyncio.to_thread(get_expense_categories, user_id)
+    prompt = "Select a category or type a new one:"
+    if suggestion:
+        categories = [suggestion[0]] + [c for c in categories if c != suggestion[0]]
+        prompt = f"Suggested: {suggestion[0]}. " + prompt
+    keyboard = build_category_keyboard(categories)
+    await update.message.reply_text(prompt, reply_markup=keyboard)
+    return ADD_EXPENSE_CATEGORY
+
 
 async def add_expense_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data["category"] = update.message.text.strip()
+    if context.user_data.get("description"):
+        return await _save_expense(update, context)
     await update.message.reply_text("Now enter a short description:")
     return ADD_EXPENSE_DESCRIPTION
 
 
 async def add_expense_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data["description"] = update.message.text.strip()
+    return await _save_expense(update, context)
+
+
+@replayable
+def _add_expense(user_id: int, amount, category_name: str, description: str) -> str:
+    """Save one expense from the /add flow; the reply text."""
+    currency = base_currency(user_id)
+    with get_repository().write(user_id) as store:
+        category_id = store.category_id(category_name)
+        warning = check_expense(user_id, category_id, amount)
+        store.add_expense(
+            category_id, amount, description,
+            is_anomaly=bool(warning), currency=currency,
+        )
+    observe_expense(user_id, category_id, category_name, description)
+    text = f"Saved ✅ Amount: {amount} | Category: {category_name}"
+    if warning:
+        text += f"\n{warning}"
+    return text
+
+
+async def _save_expense(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     amount = context.user_data["amount"]
     category_name = context.user_data["category"]
     description = context.user_data["description"]
     user_id = update.effective_user.id
 
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                category_id = get_or_create_category_id(cur, user_id, category_name)
-                cur.execute(
-                    "INSERT INTO expenses (user_id, category_id, amount, description) VALUES (%s, %s, %s, %s)",
-                    (user_id, category_id, amount, description),
-                )
-        await update.message.reply_text(
-            f"Saved ✅ Amount: {amount} | Category: {category_name}",
-            reply_markup=ReplyKeyboardRemove(),
+        text = await asyncio.to_thread(_add_expense, user_id, amount, category_name, description)
+    except DatabaseUnavailable:
+        text = await asyncio.to_thread(
+            defer_write, user_id, update.effective_chat.id, "expense",
+            _add_expense, user_id, amount, category_name, description,
         )
     except Exception:
         logging.exception("Error adding expense for user %s", user_id)
-        await update.message.reply_text("Sorry, an error occurred while saving your expense.")
+        text = "Sorry, an error occurred while saving your expense."
     finally:
         context.user_data.clear()
+    await update.message.reply_text(text, reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
 
+async def quick_add_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Plain messages starting with a number: one expense per line
+    ("120 food lunch"), all saved together or none at all.
+    """
+    user_id = update.effective_user.id
+    text = update.message.text
+    try:
+        reply = await asyncio.to_thread(_quick_add, user_id, text)
+    except DatabaseUnavailable:
+        reply = await asyncio.to_thread(
+            defer_write, user_id, update.effective_chat.id, "quick add", _quick_add, user_id, text
+        )
+    except Exception:
+        logging.exception("Error in quick add for user %s", user_id)
+        await update.message.reply_text("Sorry, an error occurred while saving your expenses.")
+        return
+    await update.message.reply_text(reply)
+
+
+@replayable
+def _quick_add(user_id: int, text: str) -> str:
+    """Save a quick-add message; the reply text."""
+    try:
+        saved = save_quick_add(user_id, text)
+    except QuickAddError as e:
+        return "Nothing saved:\n" + "\n".join(e.errors)
+
+    total = sum(base_amount for _, _, base_amount, _, _, _ in saved)
+    lines = [f"Saved ✅ {len(saved)} expense(s) • Total: {total:.2f} {base_currency(user_id)}"]
+    for amount, currency, _, name, desc, warning in saved:
+        lines.append(f"• {amount:.2f} {currency} {name}" + (f" — {desc}" if desc else ""))
+        if warning:
+            lines.append(f"  {warning}")
+    return "\n".join(lines)
+
+
 async def view_expenses_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT e.id, e.amount, c.name, e.description, e.date
-                    FROM expenses e
-                    LEFT JOIN categories c ON e.category_id = c.id
-                    WHERE e.user_id = %s
-                    ORDER BY e.date DESC
-                    LIMIT 10
-                    """,
-                    (user_id,),
-                )
-                expenses = cur.fetchall()
+        expenses, read_at = await asyncio.to_thread(read_through, recent_expenses, user_id, 10)
         if not expenses:
             await update.message.reply_text('No expenses yet. Use the "💸 Expense" button to add.')
             return
 
         message = "Your latest 10 expenses:\n\n"
-        for exp_id, amount, cat, desc, dt in expenses:
+        for exp_id, amount, cat, desc, dt, currency in expenses:
             date_str = dt.strftime("%Y-%m-%d")
             message += (
                 f"ID: {exp_id}\n"
-                f"Amount: {amount:.2f}\n"
+                f"Amount: {amount:.2f} {currency or ''}\n"
                 f"Category: {cat or 'N/A'}\n"
                 f"Description: {desc or 'N/A'}\n"
                 f"Date: {date_str}\n\n"
             )
-        await update.message.reply_text(message)
+        await update.message.reply_text(message.rstrip() + stale_note(read_at))
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
     except Exception:
         logging.exception("Error retrieving expenses for user %s", user_id)
         await update.message.reply_text("Sorry, error while retrieving your expenses.")
 
 
+def recent_expenses(user_id: int, n: int):
+    with get_repository().read(user_id) as store:
+        return store.recent_expenses(n)
+
+
+def _month_spend(user_id: int, period):
+    with get_repository().read(user_id) as store:
+        return store.month_spend(period)
+
+
 async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                today = datetime.now()
-                start_of_month = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-                cur.execute(
-                    "SELECT COALESCE(SUM(amount),0) FROM expenses WHERE user_id = %s AND date >= %s",
-                    (user_id, start_of_month),
-                )
-                total_expense = cur.fetchone()[0] or 0
-
-                cur.execute(
-                    """
-                    SELECT c.name, COALESCE(SUM(e.amount),0)
-                    FROM expenses e
-                    JOIN categories c ON e.category_id = c.id
-                    WHERE e.user_id = %s AND e.date >= %s
-                    GROUP BY c.name
-                    ORDER BY 2 DESC
-                    """,
-                    (user_id, start_of_month),
-                )
-                by_cat = cur.fetchall()
+        today = await asyncio.to_thread(user_today, user_id)
+        (total_expense, by_cat), read_at = await asyncio.to_thread(
+            read_through, _month_spend, user_id, today.replace(day=1)
+        )
 
-        message = f"This Month ({today.strftime('%B, %Y')})\n\nTotal: {float(total_expense):.2f}\n\nBy Category:\n"
+        currency = await asyncio.to_thread(base_currency, user_id)
+        message = (
+            f"This Month ({today.strftime('%B, %Y')})\n\n"
+            f"Total: {float(total_expense):.2f} {currency}\n\nBy Category:\n"
+        )
         for cat, amt in by_cat:
             message += f"- {cat}: {float(amt):.2f}\n"
-        await update.message.reply_text(message)
+        message += stale_note(read_at)
+        report_url = await asyncio.to_thread(_report_url, user_id, int(time.time()))
+        kb = InlineKeyboardMarkup(
+            [[InlineKeyboardButton("Open Report WebApp", web_app=WebAppInfo(url=report_url))]]
+        )
+        await update.message.reply_text(message, reply_markup=kb)
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
     except Exception:
         logging.exception("Error generating report for user %s", user_id)
         await update.message.reply_text("Sorry, error while generating report.")
@@ -374,8 +449,11 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def set_budget_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    ensure_default_categories(user_id)
-    categories = get_expense_categories(user_id)
+    try:
+        await asyncio.to_thread(ensure_categories, user_id)
+    except Exception:
+        logging.exception("Error ensuring default categories for user %s", user_id)
+    categories = await asyncio.to_thread(get_expense_categories, user_id)
     keyboard = build_category_keyboard(categories)
     await update.message.reply_text(
         "Select a category for the budget or type a new one:", reply_markup=keyboard
@@ -389,32 +467,32 @@ async def set_budget_category(update: Update, context: ContextTypes.DEFAULT_TYPE
     return SET_BUDGET_AMOUNT
 
 
+def _set_budget(user_id: int, category_name: str, amount: Decimal):
+    period = user_period(user_id)
+    with get_repository().write(user_id) as store:
+        store.set_budget(store.category_id(category_name), amount, period)
+
+
 async def set_budget_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
     category_name = context.user_data["budget_category"]
     amount_text = update.message.text.strip()
     try:
         amount = Decimal(amount_text)
-        if amount <= 0:
+        if not amount.is_finite() or amount <= 0:
             await update.message.reply_text("Amount must be positive. Try again.")
             return SET_BUDGET_AMOUNT
+        if amount > MAX_AMOUNT:
+            await update.message.reply_text(f"Amount must be at most {MAX_AMOUNT}. Try again.")
+            return SET_BUDGET_AMOUNT
 
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                category_id = get_or_create_category_id(cur, user_id, category_name)
-                cur.execute(
-                    """
-                    INSERT INTO budgets (user_id, category_id, amount, period_month)
-                    VALUES (%s, %s, %s, DATE_TRUNC('month', CURRENT_DATE))
-                    ON CONFLICT (user_id, category_id, period_month)
-                    DO UPDATE SET amount = EXCLUDED.amount
-                    """,
-                    (user_id, category_id, amount),
-                )
+        await asyncio.to_thread(_set_budget, user_id, category_name, amount)
         await update.message.reply_text(
             f"Budget saved ✅ {category_name}: {amount}",
             reply_markup=ReplyKeyboardRemove(),
         )
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
     except Exception:
         logging.exception("Error setting budget for user %s", user_id)
         await update.message.reply_text("Sorry, error while setting your budget.")
@@ -423,74 +501,457 @@ async def set_budget_amount(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return ConversationHandler.END
 
 
+def _budget_rows(user_id: int, period):
+    with get_repository().read(user_id) as store:
+        return store.budget_items(period)
+
+
 async def view_budget_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    period = current_period()
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT c.name, b.amount,
-                           COALESCE((
-                               SELECT SUM(e.amount)
-                               FROM expenses e
-                               WHERE e.user_id = b.user_id
-                                 AND e.category_id = b.category_id
-                                 AND e.date >= b.period_month
-                                 AND e.date < (b.period_month + INTERVAL '1 month')
-                           ), 0) AS used
-                    FROM budgets b
-                    JOIN categories c ON b.category_id = c.id
-                    WHERE b.user_id = %s AND b.period_month = %s
-                    ORDER BY c.name
-                    """,
-                    (user_id, period),
-                )
-                rows = cur.fetchall()
+        period = await asyncio.to_thread(user_period, user_id)
+        rows, read_at = await asyncio.to_thread(read_through, _budget_rows, user_id, period)
         if not rows:
             await update.message.reply_text(
                 'No budgets set for this month. Use the "💰 Budget" button to add.'
             )
             return
         message = "Current month budgets (quick view):\n\n"
-        for name, amount, used in rows:
+        for name, amount, used, projected, overrun_date in rows:
             in_hand = (float(amount) - float(used))
             message += (
                 f"{name} — Set: {float(amount):.2f}, Used: {float(used):.2f}, In Hand: {in_hand:.2f}\n"
             )
-        await update.message.reply_text(message)
+            if projected is not None:
+                message += f"   Projected: {float(projected):.2f}"
+                if overrun_date:
+                    message += f" (over budget by {overrun_date.strftime('%d %b')})"
+                message += "\n"
+        await update.message.reply_text(message.rstrip() + stale_note(read_at))
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
     except Exception:
         logging.exception("Error retrieving budgets for user %s", user_id)
         await update.message.reply_text("Sorry, error while retrieving budgets.")
 
 
 async def delete_expense_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text("Send the ID of the expense you want to delete.")
+    await update.message.reply_text(
+        "Send the ID of the expense you want to delete (or several: 12, 15, 20-25)."
+    )
     return DELETE_EXPENSE_ID
 
 
 async def delete_expense_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
+    ids = update.message.text.strip()
     try:
-        expense_id = int(update.message.text.strip())
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "DELETE FROM expenses WHERE id = %s AND user_id = %s RETURNING id",
-                    (expense_id, user_id),
-                )
-                deleted_row = cur.fetchone()
-        if deleted_row:
-            await update.message.reply_text(f"Deleted ✅ Expense ID {expense_id}")
+        _, count, _, _ = await asyncio.to_thread(run_bulk, user_id, f"delete {ids}")
+        if count == 1 and ids.isdigit():
+            await update.message.reply_text(f"Deleted ✅ Expense ID {ids}. /undo to restore it.")
+        elif count:
+            await update.message.reply_text(f"Deleted ✅ {count} expenses. /undo to restore them.")
         else:
             await update.message.reply_text("No expense found with that ID.")
+    except BulkError as e:
+        await update.message.reply_text(str(e))
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
     except Exception:
         logging.exception("Error deleting expense for user %s", user_id)
         await update.message.reply_text("Error while deleting the expense.")
     return ConversationHandler.END
 
 
+# ------------------------------ Bulk edit ------------------------------ #
+BULK_USAGE = (
+    "Bulk edit (IDs are shown by /view and /search):\n"
+    "/bulk delete 12,15,20-25\n"
+    "/bulk delete month=2026-09 cat=Taxi\n"
+    "/bulk move 40-52 to Groceries\n"
+    "/bulk move since=2026-10-01 text=uber to Transport\n"
+    "/bulk amount 31,32 to 9.99\n"
+    "Filters: cat=, since=, until=, month=, text= (all must match).\n"
+    f"/undo reverts the last bulk edit within {BULK_UNDO_SECONDS // 60} minutes."
+)
+
+
+async def bulk_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/bulk delete|move|amount <selection> [to <category|amount>]"""
+    user_id = update.effective_user.id
+    if not context.args:
+        await update.message.reply_text(BULK_USAGE)
+        return
+    try:
+        action, count, total, target = await asyncio.to_thread(run_bulk, user_id, " ".join(context.args))
+        if not count:
+            await update.message.reply_text("No expenses match that selection.")
+            return
+        currency = await asyncio.to_thread(base_currency, user_id)
+        done = {
+            "delete": f"Deleted ✅ {count} expense(s), {total:.2f} {currency} in total.",
+            "move": f"Moved ✅ {count} expense(s) to {target}.",
+            "amount": f"Updated ✅ {count} expense(s) to {target}.",
+        }[action]
+        await update.message.reply_text(
+            f"{done} /undo within {BULK_UNDO_SECONDS // 60} minutes to revert."
+        )
+    except BulkError as e:
+        await update.message.reply_text(f"Nothing changed: {e}\n\n{BULK_USAGE}")
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
+    except Exception:
+        logging.exception("Error in /bulk for user %s", user_id)
+        await update.message.reply_text("Sorry, error while editing your expenses.")
+
+
+async def undo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/undo reverts the latest bulk edit or delete."""
+    user_id = update.effective_user.id
+    try:
+        undone = await asyncio.to_thread(undo_last, user_id)
+        if undone is None:
+            await update.message.reply_text(
+                f"Nothing to undo: bulk edits can be reverted for {BULK_UNDO_SECONDS // 60} minutes."
+            )
+            return
+        action, count = undone
+        verb = "restored" if action == "delete" else "reverted"
+        await update.message.reply_text(f"Undone ✅ {count} expense(s) {verb}.")
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
+    except Exception:
+        logging.exception("Error in /undo for user %s", user_id)
+        await update.message.reply_text("Sorry, error while undoing.")
+
+
+# ------------------------------ Categories ------------------------------ #
+CATEGORY_USAGE = (
+    "Tidy up categories (case and extra spaces are ignored):\n"
+    "/category rename Food to Eating out\n"
+    "/category merge food, Groceries into Food\n"
+    "A merge moves the expenses, budgets (added up per month) and recurring "
+    "expenses to the category after 'into' and deletes the others."
+)
+
+
+async def category_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/category rename <old> to <new> | merge <names> into <target>"""
+    user_id = update.effective_user.id
+    if not context.args:
+        await update.message.reply_text(CATEGORY_USAGE)
+        return
+    try:
+        result = await asyncio.to_thread(run_category, user_id, " ".join(context.args))
+        if result[0] == "rename":
+            _, old, new = result
+            await update.message.reply_text(f"Renamed ✅ {old} to {new}.")
+        else:
+            _, target, merged, moved = result
+            await update.message.reply_text(
+                f"Merged ✅ {', '.join(merged)} into {target}: {moved} expense(s) moved."
+            )
+    except CategoryError as e:
+        await update.message.reply_text(f"Nothing changed: {e}\n\n{CATEGORY_USAGE}")
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
+    except Exception:
+        logging.exception("Error in /category for user %s", user_id)
+        await update.message.reply_text("Sorry, error while updating your categories.")
+
+
+async def currency_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/currency shows the base currency; /currency EUR switches it."""
+    user_id = update.effective_user.id
+    try:
+        if not context.args:
+            code = await asyncio.to_thread(base_currency, user_id)
+            await update.message.reply_text(f"Base currency: {code}. Change it with /currency <CODE>.")
+            return
+        code = await asyncio.to_thread(normalize_currency, context.args[0])
+        await asyncio.to_thread(set_base_currency, user_id, code)
+        await update.message.reply_text(f"Base currency set to {code} ✅ Reports and budgets converted.")
+    except FxError as e:
+        await update.message.reply_text(str(e))
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
+    except Exception:
+        logging.exception("Error setting currency for user %s", user_id)
+        await update.message.reply_text("Sorry, error while changing your currency.")
+
+
+# ------------------------------- Digest -------------------------------- #
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/digest shows the setting; /digest daily|weekly|off changes it."""
+    user_id = update.effective_user.id
+    try:
+        if not context.args:
+            mode = await asyncio.to_thread(get_digest, user_id)
+            await update.message.reply_text(
+                f"Spending digest: {mode or 'off'}. Change it with /digest daily, weekly or off."
+            )
+            return
+        mode = context.args[0].lower()
+        if mode not in DIGEST_MODES + ("off",):
+            await update.message.reply_text("Use /digest daily, /digest weekly or /digest off.")
+            return
+        await asyncio.to_thread(set_digest, user_id, None if mode == "off" else mode)
+        if mode == "off":
+            await update.message.reply_text("Spending digest turned off.")
+        else:
+            await update.message.reply_text(
+                f"You'll get a {mode} spending digest at {DIGEST_HOUR:02d}:00 ✅"
+            )
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
+    except Exception:
+        logging.exception("Error changing digest for user %s", user_id)
+        await update.message.reply_text("Sorry, error while changing your digest.")
+
+
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/timezone shows the user's zone; /timezone Europe/Berlin changes it."""
+    user_id = update.effective_user.id
+    try:
+        if not context.args:
+            name = await asyncio.to_thread(user_timezone, user_id)
+            await update.message.reply_text(
+                f"Your time zone: {name} (today is {user_today(user_id):%a %d %b}). "
+                "Change it with /timezone followed by a name like Europe/Berlin or America/New_York."
+            )
+            return
+        name = normalize_timezone(context.args[0])
+        if not name:
+            await update.message.reply_text(
+                f"Unknown time zone '{context.args[0]}'. Use a name like Europe/Berlin or Asia/Kolkata."
+            )
+            return
+        await asyncio.to_thread(set_user_timezone, user_id, name)
+        await update.message.reply_text(
+            f"Time zone set to {name} ✅ New expenses count on your local day and month; "
+            "those already saved keep theirs."
+        )
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
+    except Exception:
+        logging.exception("Error changing time zone for user %s", user_id)
+        await update.message.reply_text("Sorry, error while changing your time zone.")
+
+
+# ------------------------------ Recurring ------------------------------ #
+RECURRING_USAGE = (
+    "Recurring expenses:\n"
+    "/recurring — list your rules\n"
+    "/recurring add monthly 1200 Rent flat\n"
+    "/recurring add every 2 weeks 15 EUR Subscriptions cleaning\n"
+    "/recurring stop <id>\n"
+    "Frequencies: daily, weekly, biweekly, monthly, quarterly, yearly, every N days/weeks/months."
+)
+
+
+def _add_recurring(user_id: int, words):
+    """Parse '<frequency> <amount> [currency] <category> [description]' and save the rule."""
+    freq = parse_frequency(words)
+    if not freq:
+        raise QuickAddError(["Start with a frequency, e.g. monthly or 'every 2 weeks'."])
+    label, step, used = freq
+    with get_repository().read(user_id) as store:
+        categories = {category_key(name): (cid, name) for cid, name in store.categories()}
+    entries = parse_quick_add(user_id, " ".join(words[used:]), categories, base_currency(user_id))
+    if len(entries) != 1:
+        raise QuickAddError(["Give one amount and category, e.g. monthly 1200 Rent."])
+    amount, currency, _, category_id, name, description = entries[0]
+    repo = get_repository()
+    today = user_today(user_id)
+    with repo.write(user_id) as store:
+        rule_id = store.add_rule(category_id, amount, currency, description, label, step, today)
+    # The first occurrence is today's; write it now rather than at the next job run.
+    repo.materialize_recurring(today, user_id=user_id)
+    return rule_id, amount, currency, name, label
+
+
+def _stop_recurring(user_id: int, rule_id: int) -> bool:
+    with get_repository().write(user_id) as store:
+        return store.stop_rule(rule_id)
+
+
+def _list_recurring(user_id: int):
+    with get_repository().read(user_id) as store:
+        rules = store.list_rules()
+    return rules, base_currency(user_id)
+
+
+async def recurring_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/recurring [add <rule> | stop <id>]"""
+    user_id = update.effective_user.id
+    args = context.args or []
+    try:
+        if args and args[0].lower() == "add":
+            rule_id, amount, currency, name, label = await asyncio.to_thread(_add_recurring, user_id, args[1:])
+            await update.message.reply_text(
+                f"Recurring #{rule_id} saved ✅ {amount:.2f} {currency} {name}, {label}. "
+                "Today's expense is added."
+            )
+        elif args and args[0].lower() == "stop":
+            if len(args) != 2 or not args[1].isdigit():
+                await update.message.reply_text("Usage: /recurring stop <id>")
+            elif await asyncio.to_thread(_stop_recurring, user_id, int(args[1])):
+                await update.message.reply_text(f"Recurring #{args[1]} stopped.")
+            else:
+                await update.message.reply_text("No active recurring rule with that ID.")
+        elif args:
+            await update.message.reply_text(RECURRING_USAGE)
+        else:
+            rules, base = await asyncio.to_thread(_list_recurring, user_id)
+            if not rules:
+                await update.message.reply_text("No recurring expenses.\n\n" + RECURRING_USAGE)
+                return
+            lines = ["Your recurring expenses:\n"]
+            for rule_id, amount, currency, cat, desc, label, next_due in rules:
+                lines.append(
+                    f"#{rule_id} • {float(amount):.2f} {currency or base} • "
+                    f"{cat or 'N/A'} • {label} • next {next_due.strftime('%Y-%m-%d')}"
+                )
+                if desc:
+                    lines.append(f"  - {desc}")
+            await update.message.reply_text("\n".join(lines))
+    except (QuickAddError, FxError) as e:
+        await update.message.reply_text("Not saved: " + str(e))
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
+    except Exception:
+        logging.exception("Error in /recurring for user %s", user_id)
+        await update.message.reply_text("Sorry, error while handling your recurring expenses.")
+
+
+# -------------------------------- Export -------------------------------- #
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export sends every expense, archived months included, as a CSV file."""
+    user_id = update.effective_user.id
+    try:
+        data = await asyncio.to_thread(export_csv, user_id)
+        await update.message.reply_document(document=data, filename="expenses.csv")
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
+    except Exception:
+        logging.exception("Error in /export for user %s", user_id)
+        await update.message.reply_text("Sorry, error while exporting your expenses.")
+
+
+# -------------------------------- Search -------------------------------- #
+SEARCH_PAGE_SIZE = 10
+# The "More" button carries the query itself ("=" + text) when it fits in
+# Telegram's 64-byte callback_data next to the cursor, else "#" + a token
+# for it kept in user_data (the last SEARCH_TOKENS of them).
+SEARCH_REF_BYTES = 64 - len("search:1.0000:9223372036854775807:")
+SEARCH_TOKENS = 20
+
+
+def search_expenses(user_id: int, query: str, after=None, limit: int = SEARCH_PAGE_SIZE):
+    """
+    Typo-tolerant search over descriptions and category names, best match
+    first (trigram word similarity).
+    Keyset paging: `after` is the (score, id) of the previous page's last row.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    with get_repository().read(user_id) as store:
+        rows = store.search(query, after, limit + 1)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last[5]}:{last[0]}"
+    return rows, next_cursor
+
+
+def parse_search_cursor(cursor):
+    """'0.8571:123' -> (Decimal('0.8571'), 123); None/invalid -> None."""
+    try:
+        score, exp_id = (cursor or "").split(":")
+        return Decimal(score), int(exp_id)
+    except (ValueError, ArithmeticError):
+        return None
+
+
+def search_ref(query: str, user_data) -> str:
+    """What the "More" button's callback_data says about `query`."""
+    if len(query.encode("utf-8")) < SEARCH_REF_BYTES:
+        return "=" + query
+    token = hashlib.sha1(query.encode("utf-8")).hexdigest()[:10]
+    tokens = user_data.setdefault("search_tokens", {})
+    tokens.pop(token, None)
+    tokens[token] = query
+    while len(tokens) > SEARCH_TOKENS:
+        del tokens[next(iter(tokens))]
+    return "#" + token
+
+
+def search_query(ref: str, user_data):
+    """Inverse of search_ref; None if the token is gone."""
+    if ref.startswith("="):
+        return ref[1:]
+    if ref.startswith("#"):
+        return user_data.get("search_tokens", {}).get(ref[1:])
+    return None
+
+
+def search_reply(user_id: int, query: str, after=None, user_data=None):
+    """
+    Text and optional "More" button for one page of search results
+    (`user_data` keeps a token for queries too long for the button).
+    """
+    rows, next_cursor = search_expenses(user_id, query, after)
+    if not rows:
+        return f'No expenses match "{query}".', None
+
+    lines = [f'Results for "{query}":\n']
+    for exp_id, amount, cat, desc, dt, _score in rows:
+        lines.append(
+            f"ID {exp_id} • {float(amount):.2f} • {cat or 'N/A'} • {dt.strftime('%Y-%m-%d')}"
+        )
+        if desc:
+            lines.append(f"  - {desc}")
+    markup = None
+    if next_cursor:
+        markup = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(
+                "More ▶", callback_data=f"search:{next_cursor}:{search_ref(query, user_data or {})}"
+            )]]
+        )
+    return "\n".join(lines), markup
+
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    query = " ".join(context.args or []).strip()
+    if not query:
+        await update.message.reply_text("Usage: /search <text>, e.g. /search coffee")
+        return
+    try:
+        text, markup = await asyncio.to_thread(search_reply, user_id, query, None, context.user_data)
+        await update.message.reply_text(text, reply_markup=markup)
+    except DatabaseUnavailable:
+        await update.message.reply_text(UNAVAILABLE_TEXT)
+    except Exception:
+        logging.exception("Error searching expenses for user %s", user_id)
+        await update.message.reply_text("Sorry, error while searching your expenses.")
+
+
+async def _search_next_page(update: Update, context: ContextTypes.DEFAULT_TYPE, data: str):
+    score, _, rest = data.partition(":")
+    exp_id, _, ref = rest.partition(":")
+    query = search_query(ref, context.user_data)
+    after = parse_search_cursor(f"{score}:{exp_id}")
+    if not query or not after:
+        await update.callback_query.message.reply_text("Search expired. Run /search again.")
+        return
+    text, markup = await asyncio.to_thread(
+        search_reply, update.effective_user.id, query, after, context.user_data
+    )
+    await update.callback_query.message.reply_text(text, reply_markup=markup)
+
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Operation cancelled.", reply_markup=ReplyKeyboardRemove())
     context.user_data.clear()
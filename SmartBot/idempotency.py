@@ -0,0 +1,116 @@
+# idempotency.py
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+from database import get_db_connection, fan_out
+from repository import get_repository
+
+# WebApp payloads carry a client-generated "idem" key. Replies are kept in
+# a bounded, time-expiring in-memory map, so a repeated key is answered
+# without touching the database. Writes also claim the key in
+# webapp_requests inside their own transaction; the primary key there is
+# the backstop for duplicates that race past (or outlive) the memory map.
+SEEN_MAX = int(os.getenv("IDEMPOTENCY_SEEN_MAX", "20000"))
+SEEN_TTL = int(os.getenv("IDEMPOTENCY_SEEN_TTL", "600"))
+RETENTION_DAYS = int(os.getenv("IDEMPOTENCY_RETENTION_DAYS", "2"))
+PRUNE_JOB = "webapp_requests_prune"
+
+_KEY_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+_seen = OrderedDict()  # (user_id, key) -> (expires_at, reply)
+
+
+def request_key(data: dict):
+    """The payload's idempotency key, or None if missing/malformed."""
+    key = data.get("idem")
+    if isinstance(key, str) and _KEY_RE.match(key):
+        return key
+    return None
+
+
+def cached_reply(user_id: int, key: str):
+    if not key:
+        return None
+    entry = _seen.get((user_id, key))
+    if entry is None:
+        return None
+    if entry[0] < time.monotonic():
+        del _seen[(user_id, key)]
+        return None
+    return entry[1]
+
+
+def remember_reply(user_id: int, key: str, reply: str):
+    if not key:
+        return
+    now = time.monotonic()
+    _seen[(user_id, key)] = (now + SEEN_TTL, reply)
+    _seen.move_to_end((user_id, key))
+    while _seen:
+        oldest = next(iter(_seen.values()))
+        if len(_seen) <= SEEN_MAX and oldest[0] >= now:
+            break
+        _seen.popitem(last=False)
+
+
+def claim_request(cur, user_id: int, key: str):
+    """
+    Claim `key` inside the caller's write transaction.
+    Returns None if claimed (go ahead and write), else the reply stored by
+    the request that claimed it first. A concurrent duplicate blocks on the
+    primary key until the first transaction commits.
+    """
+    if not key:
+        return None
+    cur.execute(
+        """
+        INSERT INTO webapp_requests (user_id, idem_key)
+        VALUES (%s, %s)
+        ON CONFLICT (user_id, idem_key) DO NOTHING
+        RETURNING idem_key
+        """,
+        (user_id, key),
+    )
+    if cur.fetchone():
+        return None
+    cur.execute(
+        "SELECT response FROM webapp_requests WHERE user_id = %s AND idem_key = %s",
+        (user_id, key),
+    )
+    row = cur.fetchone()
+    return (row[0] if row else None) or ""
+
+
+def finish_request(cur, user_id: int, key: str, reply: str):
+    """Store the reply with the claimed key, in the same transaction as the write."""
+    if not key:
+        return
+    cur.execute(
+        "UPDATE webapp_requests SET response = %s WHERE user_id = %s AND idem_key = %s",
+        (reply, user_id, key),
+    )
+
+
+def prune_requests() -> int:
+    return sum(fan_out(_prune_shard))
+
+
+def _prune_shard(shard: int) -> int:
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM webapp_requests WHERE created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'",
+                (RETENTION_DAYS,),
+            )
+            return cur.rowcount
+
+
+async def prune_requests_job(context):
+    """JobQueue callback (daily)."""
+    try:
+        await asyncio.to_thread(get_repository().prune_requests)
+    except Exception:
+        logging.exception("Pruning webapp_requests failed")
@@ -0,0 +1,249 @@
+# jobs.py
+import os
+import asyncio
+import logging
+from datetime import date, datetime, time as dtime
+
+from database import get_db_connection, current_period, fan_out, moving_users
+from forecast import FORECAST_JOB, forecast_job
+from anomaly import BASELINE_JOB, baseline_job
+from archive import ARCHIVE_AFTER_MONTHS, ARCHIVE_JOB, archive_job
+from idempotency import PRUNE_JOB, prune_requests_job
+from recurring import RECURRING_JOB, recurring_job
+from repository import get_repository
+from metrics import METRICS_JOB, METRICS_LOG_SECONDS, metrics_job
+from digest import DIGEST_JOB, DIGEST_HOUR, digest_job
+from degraded import REPLAY_JOB, DEGRADED_REPLAY_SECONDS, replay_job
+from timezones import EARLIEST_TIMEZONE
+
+# Rows (not users) copied per transaction. Small enough that each chunk
+# holds its row locks for milliseconds, big enough to keep round trips low.
+ROLLOVER_CHUNK_SIZE = int(os.getenv("ROLLOVER_CHUNK_SIZE", "5000"))
+ROLLOVER_JOB = "budget_rollover"
+# Months missed while the job was not running are caught up, oldest
+# first, at most this many back.
+ROLLOVER_CATCHUP_MONTHS = int(os.getenv("ROLLOVER_CATCHUP_MONTHS", "12"))
+
+
+def previous_period(period: date) -> date:
+    if period.month == 1:
+        return period.replace(year=period.year - 1, month=12)
+    return period.replace(month=period.month - 1)
+
+
+def rollover_periods(period: date, last_done: date = None) -> list:
+    """
+    Months to roll over, oldest first: those after `last_done` (the latest
+    finished rollover, None if there is none) up to `period`.
+    """
+    periods = [period]
+    while last_done is not None and len(periods) < ROLLOVER_CATCHUP_MONTHS:
+        month = previous_period(periods[-1])
+        if month <= last_done:
+            break
+        periods.append(month)
+    return periods[::-1]
+
+
+# -------------------------- checkpoint helpers -------------------------- #
+def _load_checkpoint(job_name: str, run_key: date, shard: int = 0):
+    """
+    Return (last_user_id, done) for a job run on a shard, creating the row on first use.
+    """
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO job_checkpoints (job_name, run_key)
+                VALUES (%s, %s)
+                ON CONFLICT (job_name, run_key) DO NOTHING
+                """,
+                (job_name, run_key),
+            )
+            cur.execute(
+                "SELECT last_user_id, done FROM job_checkpoints WHERE job_name = %s AND run_key = %s",
+                (job_name, run_key),
+            )
+            return cur.fetchone()
+
+
+def _save_checkpoint(cur, job_name: str, run_key: date, last_user_id: int, done: bool = False):
+    cur.execute(
+        """
+        UPDATE job_checkpoints
+        SET last_user_id = %s, done = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE job_name = %s AND run_key = %s
+        """,
+        (last_user_id, done, job_name, run_key),
+    )
+
+
+# ---------------------------- budget rollover ---------------------------- #
+def rollover_budgets(period: date = None, chunk_size: int = ROLLOVER_CHUNK_SIZE) -> int:
+    """
+    Copy the previous month's budgets into `period` for every user, each
+    shard in parallel. Returns the number of budget rows created. Months
+    since the last finished rollover are filled in first, each from the
+    one before (rollover_periods).
+
+    By default `period` is the month the earliest time zone is in, so
+    every user finds their budgets when their own month starts; a change
+    to the old month made after that (still the current one further
+    west) is not carried over.
+    """
+    return sum(fan_out(_rollover_shard, period or current_period(EARLIEST_TIMEZONE), chunk_size))
+
+
+def _rollover_shard(shard: int, period: date, chunk_size: int) -> int:
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT MAX(run_key) FROM job_checkpoints WHERE job_name = %s AND done AND run_key < %s",
+                (ROLLOVER_JOB, period),
+            )
+            last_done = cur.fetchone()[0]
+    created = 0
+    for month in rollover_periods(period, last_done):
+        n, done = _rollover_month(shard, month, chunk_size)
+        created += n
+        if not done:
+            # The next month copies from this one; the next run carries on.
+            break
+    return created
+
+
+def _rollover_month(shard: int, period: date, chunk_size: int):
+    """
+    One shard's rollover of one month; returns (rows created, finished). Users are walked in user_id order, one chunk per transaction. Each chunk
+    commits together with its checkpoint, so a crash resumes after the last
+    committed user. Budgets the user already set for `period` win
+    (ON CONFLICT DO NOTHING), which also makes re-runs harmless.
+    """
+    source = previous_period(period)
+
+    last_user_id, done = _load_checkpoint(ROLLOVER_JOB, period, shard)
+    if done:
+        return 0, True
+
+    created = 0
+    while True:
+        moving = moving_users()
+        with get_db_connection(shard=shard) as conn:
+            with conn.cursor() as cur:
+                # Upper user_id bound of this chunk: the user owning the
+                # chunk_size-th source row. Chunks never split a user.
+                cur.execute(
+                    """
+                    SELECT user_id FROM budgets
+                    WHERE period_month = %s AND user_id > %s
+                    ORDER BY user_id
+                    OFFSET %s LIMIT 1
+                    """,
+                    (source, last_user_id, chunk_size - 1),
+                )
+                row = cur.fetchone()
+                if row:
+                    upper = row[0]
+                else:
+                    cur.execute(
+                        "SELECT MAX(user_id) FROM budgets WHERE period_month = %s AND user_id > %s",
+                        (source, last_user_id),
+                    )
+                    upper = cur.fetchone()[0]
+
+                if upper is None:
+                    done = True
+                    _save_checkpoint(cur, ROLLOVER_JOB, period, last_user_id, done=True)
+                    break
+
+                # Stop short of a user who is being moved between shards;
+                # the next hourly run carries on from there.
+                held = min((u for u in moving if last_user_id < u <= upper), default=None)
+                if held is not None:
+                    upper = held - 1
+
+                cur.execute(
+                    """
+                    WITH ins AS (
+                        INSERT INTO budgets (user_id, category_id, amount, period_month)
+                        SELECT user_id, category_id, amount, %s
+                        FROM budgets
+                        WHERE period_month = %s AND user_id > %s AND user_id <= %s
+                        ON CONFLICT (user_id, category_id, period_month) DO NOTHING
+                        RETURNING user_id
+                    ), ver AS (
+                        UPDATE users SET data_version = data_version + 1
+                        WHERE user_id IN (SELECT user_id FROM ins)
+                    )
+                    SELECT COUNT(*) FROM ins
+                    """,
+                    (period, source, last_user_id, upper),
+                )
+                created += cur.fetchone()[0]
+                last_user_id = max(last_user_id, upper)
+                done = row is None and held is None
+                _save_checkpoint(cur, ROLLOVER_JOB, period, last_user_id, done=done)
+
+        if row is None or held is not None:
+            break
+
+    logging.info("Budget rollover %s -> %s: %s rows created (shard %s).", source, period, created, shard)
+    return created, done
+
+
+async def budget_rollover_job(context):
+    """JobQueue callback. The copy runs in a worker thread so polling continues."""
+    try:
+        await asyncio.to_thread(get_repository().rollover_budgets)
+    except Exception:
+        logging.exception("Budget rollover job failed")
+
+
+def schedule_jobs(application):
+    job_queue = application.job_queue
+    if job_queue is None:
+        logging.warning("JobQueue not available (install python-telegram-bot[job-queue]); jobs disabled.")
+        return
+
+    # Hourly rather than monthly: months start at a different hour in each
+    # time zone, a finished month is a no-op, and a bot that was down on
+    # the 1st catches up on its next start.
+    job_queue.run_once(budget_rollover_job, when=10, name=ROLLOVER_JOB)
+    job_queue.run_repeating(budget_rollover_job, interval=3600, first=3600, name=ROLLOVER_JOB)
+
+    if get_repository().analytics_jobs:
+        # Nightly month-end projections; the startup run is skipped if today's is done.
+        job_queue.run_once(forecast_job, when=60, name=FORECAST_JOB)
+        job_queue.run_daily(forecast_job, time=dtime(hour=1, minute=30), name=FORECAST_JOB)
+
+        # Anomaly baselines; at startup this just loads the cache if today's run is done.
+        job_queue.run_once(baseline_job, when=5, name=BASELINE_JOB)
+        job_queue.run_daily(baseline_job, time=dtime(hour=2, minute=0), name=BASELINE_JOB)
+
+        # Old months of expenses out to archive files, when enabled.
+        if ARCHIVE_AFTER_MONTHS > 0:
+            job_queue.run_daily(archive_job, time=dtime(hour=4, minute=0), name=ARCHIVE_JOB)
+    else:
+        logging.info("Storage backend has no forecasts/anomaly baselines/archive; those jobs are off.")
+
+    # Recurring expenses: the startup run catches up on anything missed while down.
+    job_queue.run_once(recurring_job, when=15, name=RECURRING_JOB)
+    job_queue.run_daily(recurring_job, time=dtime(hour=0, minute=10), name=RECURRING_JOB)
+
+    # Old WebApp idempotency keys.
+    job_queue.run_daily(prune_requests_job, time=dtime(hour=3, minute=0), name=PRUNE_JOB)
+
+    # Opt-in spending digests. After a restart past DIGEST_HOUR, the startup
+    # run resumes today's (checkpointed, so nobody gets one twice). The hour
+    # is read in the JobQueue's time zone, the one run_daily schedules in.
+    job_queue.run_daily(digest_job, time=dtime(hour=DIGEST_HOUR, minute=0), name=DIGEST_JOB)
+    if datetime.now(job_queue.scheduler.timezone).hour >= DIGEST_HOUR:
+        job_queue.run_once(digest_job, when=120, name=DIGEST_JOB)
+
+    # Writes deferred while the database was unavailable (see degraded.py).
+    job_queue.run_repeating(replay_job, interval=DEGRADED_REPLAY_SECONDS, first=DEGRADED_REPLAY_SECONDS,
+                            name=REPLAY_JOB)
+
+    # Admission and other in-process metrics, one log line per interval.
+    job_queue.run_repeating(metrics_job, interval=METRICS_LOG_SECONDS, first=METRICS_LOG_SECONDS,
+                            name=METRICS_JOB)
@@ -0,0 +1,416 @@
+# legacy_import.py
+import io
+import os
+import csv
+import sys
+import logging
+from decimal import Decimal
+from functools import partial
+
+import psycopg2
+import psycopg2.extras
+
+from database import (
+    CATEGORY_KEY_SQL,
+    MAX_AMOUNT,
+    current_period,
+    fan_out,
+    get_db_connection,
+    rebuild_daily_spend,
+    shard_count,
+    shard_for,
+    tidy_category_name,
+)
+from timezones import DEFAULT_TIMEZONE, local_day
+
+# One-shot converter from the legacy bot at the repository root (its
+# database.py: users, categories.budget, expenses.created_at) into this
+# schema (period budgets, expenses.date, daily_spend):
+#   python legacy_import.py run      import everything, resuming a stopped run
+#   python legacy_import.py verify   compare per-user counts and sums
+#   python legacy_import.py status   progress per phase and shard
+# LEGACY_DB_URL is the legacy database (only read, in one snapshot); the
+# target is this bot's Postgres (DB_* / DB_SHARDS). Each legacy table is
+# streamed in key order through a server-side cursor, LEGACY_CHUNK_SIZE
+# rows at a time. A chunk is written to every shard in one transaction per
+# shard together with that shard's progress row in legacy_import, so a
+# rerun skips what was committed and never writes a row twice. Phases:
+#   users        new users only (existing SmartBot users are kept as-is),
+#                in DEFAULT_TIMEZONE
+#   categories   by (user, name) with names matched as the bot does
+#                (database.category_key), so "food" lands in an existing
+#                "Food"; remembered in legacy_category_map;
+#                categories.budget > 0 becomes a budget for the current month
+#                unless the user already has one there
+#   expenses     COPY, dated created_at (day and month in the user's zone),
+#                in the default currency; amounts too large for this schema
+#                (legacy DECIMAL(12,2) vs DECIMAL(10,2)) are not copied but
+#                listed in legacy_skipped, and status/verify report them
+#   daily_spend  rebuilt from expenses for every legacy user
+# Drop legacy_import and legacy_category_map once verify is happy; a run
+# after that would import the expenses again.
+LEGACY_DB_URL = os.getenv("LEGACY_DB_URL", "")
+LEGACY_CHUNK_SIZE = int(os.getenv("LEGACY_CHUNK_SIZE", "50000"))
+
+STATE_SQL = """
+CREATE TABLE IF NOT EXISTS legacy_import (
+    phase VARCHAR(16) PRIMARY KEY,
+    last_key BIGINT NOT NULL DEFAULT 0,
+    copied BIGINT NOT NULL DEFAULT 0,
+    total DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    done BOOLEAN NOT NULL DEFAULT FALSE
+);
+CREATE TABLE IF NOT EXISTS legacy_category_map (
+    legacy_id INTEGER PRIMARY KEY,
+    category_id INTEGER NOT NULL REFERENCES categories(id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS legacy_skipped (
+    legacy_id BIGINT PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    amount DECIMAL(12, 2) NOT NULL
+);
+"""
+
+# phase -> legacy query (key first, then user_id; ids are positive, so
+# last_key 0 means from the start)
+PHASE_QUERIES = {
+    "users": """
+        SELECT user_id, user_id, first_name FROM users
+        WHERE user_id > %s ORDER BY user_id
+    """,
+    "categories": """
+        SELECT id, user_id, name, budget FROM categories
+        WHERE id > %s AND user_id IS NOT NULL ORDER BY id
+    """,
+    "expenses": """
+        SELECT id, user_id, category_id, amount, description, COALESCE(created_at, now())
+        FROM expenses
+        WHERE id > %s AND user_id IS NOT NULL ORDER BY id
+    """,
+    "daily_spend": """
+        SELECT user_id, user_id FROM users
+        WHERE user_id > %s ORDER BY user_id
+    """,
+}
+PHASES = tuple(PHASE_QUERIES)
+
+EXPENSE_COPY = """
+COPY expenses (user_id, category_id, amount, description, date, base_amount, day, period_month)
+FROM STDIN WITH (FORMAT csv)
+"""
+
+
+def _prepare(shard: int):
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute(STATE_SQL)
+            psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO legacy_import (phase) VALUES %s ON CONFLICT (phase) DO NOTHING",
+                [(phase,) for phase in PHASES],
+            )
+
+
+def _state(shard: int):
+    """{phase: (last_key, copied, total, done)} on one shard."""
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT phase, last_key, copied, total, done FROM legacy_import")
+            return {row[0]: row[1:] for row in cur.fetchall()}
+
+
+def _skipped(shard: int):
+    """(expenses, amount) left out for not fitting expenses.amount, on one shard."""
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM legacy_skipped")
+            return cur.fetchone()
+
+
+def _write_users(cur, rows):
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO users (user_id, first_name, timezone) VALUES %s ON CONFLICT (user_id) DO NOTHING",
+        [(user_id, first_name, DEFAULT_TIMEZONE) for _, user_id, first_name in rows],
+        page_size=1000,
+    )
+    return Decimal(0)
+
+
+def _write_categories(cur, rows):
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO categories (user_id, name) VALUES %s ON CONFLICT DO NOTHING",
+        [(user_id, tidy_category_name(name)) for _, user_id, name, _ in rows],
+        page_size=1000,
+    )
+    psycopg2.extras.execute_values(
+        cur,
+        f"""
+        INSERT INTO legacy_category_map (legacy_id, category_id)
+        SELECT v.legacy_id, c.id
+        FROM (VALUES %s) v (legacy_id, user_id, tidy)
+        JOIN categories c ON c.user_id = v.user_id AND {CATEGORY_KEY_SQL} = lower(v.tidy)
+        ON CONFLICT (legacy_id) DO NOTHING
+        """,
+        [(legacy_id, user_id, tidy_category_name(name)) for legacy_id, user_id, name, _ in rows],
+        page_size=1000,
+    )
+    period = current_period()
+    budgets = [(legacy_id, budget, period) for legacy_id, _, _, budget in rows if budget and budget > 0]
+    psycopg2.extras.execute_values(
+        cur,
+        """
+        INSERT INTO budgets (user_id, category_id, amount, period_month)
+        SELECT c.user_id, c.id, v.amount, v.period
+        FROM (VALUES %s) v (legacy_id, amount, period)
+        JOIN legacy_category_map m ON m.legacy_id = v.legacy_id
+        JOIN categories c ON c.id = m.category_id
+        ON CONFLICT (user_id, category_id, period_month) DO NOTHING
+        """,
+        budgets,
+        page_size=1000,
+    )
+    return sum((budget for _, budget, _ in budgets), Decimal(0))
+
+
+def _write_expenses(cur, rows, categories: dict):
+    cur.execute(
+        "SELECT user_id, timezone FROM users WHERE user_id = ANY(%s)",
+        (list({row[1] for row in rows}),),
+    )
+    zones = dict(cur.fetchall())
+    skipped = [(row[0], row[1], row[3]) for row in rows if abs(row[3]) > MAX_AMOUNT]
+    if skipped:
+        psycopg2.extras.execute_values(
+            cur,
+            "INSERT INTO legacy_skipped (legacy_id, user_id, amount) VALUES %s ON CONFLICT DO NOTHING",
+            skipped,
+        )
+        logging.warning("legacy expenses: %s amounts over %s skipped (legacy ids %s)",
+                        len(skipped), MAX_AMOUNT, ", ".join(str(s[0]) for s in skipped[:20]))
+        rows = [row for row in rows if abs(row[3]) <= MAX_AMOUNT]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    total = Decimal(0)
+    for _, user_id, category_id, amount, description, created_at in rows:
+        day = local_day(created_at, zones.get(user_id, DEFAULT_TIMEZONE))
+        writer.writerow((
+            user_id, categories.get(category_id), amount, description, created_at.isoformat(), amount,
+            day, day.replace(day=1),
+        ))
+        total += amount
+    buf.seek(0)
+    cur.copy_expert(EXPENSE_COPY, buf)
+    if cur.rowcount != len(rows):
+        raise RuntimeError(f"expenses: copied {cur.rowcount} of {len(rows)} rows")
+    return total
+
+
+def _write_daily_spend(cur, rows):
+    rebuild_daily_spend(cur, *(user_id for _, user_id in rows))
+    return Decimal(0)
+
+
+def _write_chunk(shard: int, phase: str, write, by_shard: list, last_key: int):
+    """One shard's part of a chunk and its progress, in one transaction."""
+    rows = by_shard[shard]
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            total = write(cur, rows) if rows else Decimal(0)
+            cur.execute(
+                """
+                UPDATE legacy_import
+                SET last_key = GREATEST(last_key, %s), copied = copied + %s, total = total + %s
+                WHERE phase = %s
+                """,
+                (last_key, len(rows), total, phase),
+            )
+
+
+def _finish(shard: int, phase: str):
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE legacy_import SET done = TRUE WHERE phase = %s", (phase,))
+
+
+def _category_map(shard: int) -> dict:
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT legacy_id, category_id FROM legacy_category_map")
+            return dict(cur.fetchall())
+
+
+def _run_phase(src, phase: str, write, chunk_size: int) -> int:
+    """Stream one legacy table into every shard; returns the rows written now."""
+    states = [s[phase] for s in fan_out(_state)]
+    if all(done for _, _, _, done in states):
+        return 0
+    written = 0
+    with src.cursor(name=f"legacy_{phase}") as cur:
+        cur.itersize = chunk_size
+        cur.execute(PHASE_QUERIES[phase], (min(last_key for last_key, _, _, _ in states),))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            by_shard = [[] for _ in range(shard_count())]
+            for row in rows:
+                shard = shard_for(row[1])
+                # Already committed there by an earlier run.
+                if row[0] > states[shard][0]:
+                    by_shard[shard].append(row)
+            fan_out(_write_chunk, phase, write, by_shard, rows[-1][0])
+            written += sum(len(part) for part in by_shard)
+            logging.info("legacy %s: %s rows so far (last key %s)", phase, written, rows[-1][0])
+    fan_out(_finish, phase)
+    return written
+
+
+def _connect_legacy():
+    if not LEGACY_DB_URL:
+        sys.exit("Set LEGACY_DB_URL to the legacy database.")
+    src = psycopg2.connect(LEGACY_DB_URL)
+    # Every phase reads the same snapshot.
+    src.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    return src
+
+
+def run_import(chunk_size: int = LEGACY_CHUNK_SIZE) -> dict:
+    """Run (or resume) every phase; returns rows written per phase by this run."""
+    fan_out(_prepare)
+    src = _connect_legacy()
+    written = {}
+    try:
+        for phase in PHASES:
+            if phase == "expenses":
+                categories = {}
+                for part in fan_out(_category_map):
+                    categories.update(part)
+                write = partial(_write_expenses, categories=categories)
+            else:
+                write = {
+                    "users": _write_users,
+                    "categories": _write_categories,
+                    "daily_spend": _write_daily_spend,
+                }[phase]
+            written[phase] = _run_phase(src, phase, write, chunk_size)
+    finally:
+        src.close()
+    return written
+
+
+def _target_users(shard: int, user_ids: list):
+    """
+    {user_id: (expenses, amount, amount in base currency, daily_spend
+    amount, expenses skipped, amount skipped)} on `shard`.
+    """
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT u.user_id, COALESCE(e.n, 0), COALESCE(e.amount, 0), COALESCE(e.base, 0),
+                       COALESCE(d.amount, 0), COALESCE(s.n, 0), COALESCE(s.amount, 0)
+                FROM users u
+                LEFT JOIN (
+                    SELECT user_id, COUNT(*) AS n, SUM(amount) AS amount,
+                           SUM(COALESCE(base_amount, amount)) AS base
+                    FROM expenses WHERE user_id = ANY(%(ids)s) GROUP BY user_id
+                ) e USING (user_id)
+                LEFT JOIN (
+                    SELECT user_id, SUM(amount) AS amount
+                    FROM daily_spend WHERE user_id = ANY(%(ids)s) GROUP BY user_id
+                ) d USING (user_id)
+                LEFT JOIN (
+                    SELECT user_id, COUNT(*) AS n, SUM(amount) AS amount
+                    FROM legacy_skipped WHERE user_id = ANY(%(ids)s) GROUP BY user_id
+                ) s USING (user_id)
+                WHERE u.user_id = ANY(%(ids)s)
+                """,
+                {"ids": user_ids},
+            )
+            return {row[0]: row[1:] for row in cur.fetchall()}
+
+
+def _verify_chunk(shard: int, by_shard: list):
+    ids = [user_id for user_id, _, _ in by_shard[shard]]
+    return _target_users(shard, ids) if ids else {}
+
+
+def verify(chunk_size: int = LEGACY_CHUNK_SIZE) -> list:
+    """
+    Per legacy user: present, same number of expenses and the same total,
+    daily_spend in step. Returns [(user_id, problem)] (empty = all good).
+    Users who also saved expenses with this bot show up as differences.
+    """
+    fan_out(_prepare)
+    src = _connect_legacy()
+    problems = []
+    users = expenses = 0
+    try:
+        with src.cursor(name="legacy_verify") as cur:
+            cur.itersize = chunk_size
+            cur.execute(
+                """
+                SELECT u.user_id, COUNT(e.id), COALESCE(SUM(e.amount), 0)
+                FROM users u LEFT JOIN expenses e ON e.user_id = u.user_id
+                GROUP BY u.user_id ORDER BY u.user_id
+                """
+            )
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                by_shard = [[] for _ in range(shard_count())]
+                for row in rows:
+                    by_shard[shard_for(row[0])].append(row)
+                found = {}
+                for part in fan_out(_verify_chunk, by_shard):
+                    found.update(part)
+                for user_id, count, amount in rows:
+                    users += 1
+                    expenses += count
+                    target = found.get(user_id)
+                    if target is None:
+                        problems.append((user_id, "missing"))
+                    elif (target[0] + target[4], target[1] + target[5]) != (count, amount):
+                        problems.append((user_id, f"{target[0]} expenses / {target[1]} vs legacy {count} / {amount}"))
+                    elif target[3] != target[2]:
+                        problems.append((user_id, f"daily_spend {target[3]} vs expenses {target[2]}"))
+                    elif target[4]:
+                        problems.append((user_id, f"{target[4]} expenses over {MAX_AMOUNT} not imported (legacy_skipped)"))
+    finally:
+        src.close()
+    logging.info("Verified %s legacy users, %s expenses: %s problems", users, expenses, len(problems))
+    return problems
+
+
+USAGE = """usage:
+  python legacy_import.py run
+  python legacy_import.py verify
+  python legacy_import.py status"""
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = sys.argv[1:]
+    if args == ["run"]:
+        for phase, n in run_import().items():
+            print(f"{phase}: {n} rows")
+    elif args == ["verify"]:
+        problems = verify()
+        for user_id, problem in problems[:50]:
+            print(f"user {user_id}: {problem}")
+        if problems:
+            sys.exit(f"{len(problems)} users differ")
+        print("all legacy users match")
+    elif args == ["status"]:
+        fan_out(_prepare)
+        for i, state in enumerate(fan_out(_state)):
+            for phase in PHASES:
+                last_key, copied, total, done = state[phase]
+                print(f"shard {i} {phase}: {copied} rows, {total:.2f}, last key {last_key}" + (" (done)" if done else ""))
+        for i, (n, amount) in enumerate(fan_out(_skipped)):
+            if n:
+                print(f"shard {i}: {n} expenses ({amount:.2f}) over {MAX_AMOUNT} skipped, see legacy_skipped")
+    else:
+        sys.exit(USAGE)
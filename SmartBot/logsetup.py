@@ -0,0 +1,150 @@
+# logsetup.py
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+import metrics
+
+# Log records are put on a bounded in-memory queue by the calling thread
+# (the event loop included) and written by one background thread, so a
+# slow disk or log collector never stalls an update. When the queue is
+# full, records are dropped and counted (metrics "logging.dropped").
+#   LOG_LEVEL       root level (INFO)
+#   LOG_FORMAT      "text" (default) or "json", one object per line
+#   LOG_SAMPLE      per-logger sampling of INFO/DEBUG lines, e.g.
+#                   "webapp=0.05,httpx=0.1" (a logger and its children;
+#                   warnings and errors are always kept)
+#   LOG_QUEUE_SIZE  queued records before dropping (10000)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Payload keys whose values may appear in logs; everything else is masked.
+SAFE_PAYLOAD_KEYS = {"type", "ui"}
+
+_listener = None
+_EXC_FORMATTER = logging.Formatter()
+
+
+class Redacted:
+    """A WebApp payload that renders with only SAFE_PAYLOAD_KEYS values visible."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        if not isinstance(self.data, dict):
+            return f"<{type(self.data).__name__}>"
+        return json.dumps(
+            {k: (v if k in SAFE_PAYLOAD_KEYS else "***") for k, v in self.data.items()},
+            ensure_ascii=False,
+        )
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keep roughly `rate` of the records below WARNING from each sampled
+    logger (and its children). Runs before the record is formatted.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+        self._by_name = {}  # logger name -> rate of its nearest sampled ancestor
+
+    def _rate(self, name: str):
+        if name not in self._by_name:
+            rate, probe = None, name
+            while probe:
+                if probe in self.rates:
+                    rate = self.rates[probe]
+                    break
+                probe = probe.rpartition(".")[0]
+            self._by_name[name] = rate
+        return self._by_name[name]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate is None or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Merge args and render the traceback here (arguments may change
+        # after the call returns); formatting is left to the writer thread.
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("logging.dropped")
+
+
+def parse_sampling(spec: str) -> dict:
+    """'a=0.1,b.c=0.5' -> {'a': 0.1, 'b.c': 0.5}."""
+    rates = {}
+    for part in spec.split(","):
+        name, _, rate = part.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+def setup_logging():
+    """Route all logging through the background writer (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    target = logging.StreamHandler(sys.stderr)
+    target.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+    records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = _DroppingQueueHandler(records)
+    rates = parse_sampling(LOG_SAMPLE)
+    if rates:
+        handler.addFilter(SampleFilter(rates))
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(records, target, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
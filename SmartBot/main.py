@@ -1,6 +1,8 @@
 # main.py
+import asyncio
 import logging
 import json
+from decimal import Decimal, InvalidOperation
 
 from telegram import Update
 from telegram.ext import (
@@ -21,11 +23,23 @@ from config import (
     SET_BUDGET_AMOUNT,
     DELETE_EXPENSE_ID,
 )
-from database import (
-    setup_database,
-    get_db_connection,
-    get_or_create_category_id,
+from database import MAX_AMOUNT
+from timezones import user_period
+from repository import get_repository
+from jobs import schedule_jobs
+from warmup import warm_up
+from logsetup import Redacted, setup_logging
+from admission import AdmissionProcessor
+from anomaly import check_expense
+from categorizer import suggest_category, observe as observe_expense
+from fx import FxError, base_currency, convert, normalize_currency
+from idempotency import (
+    request_key,
+    cached_reply,
+    remember_reply,
 )
+from breaker import DatabaseUnavailable
+from degraded import UNAVAILABLE_TEXT, defer_write, read_through, replayable, stale_note
 from handlers import (
     start_command,
     button_handler,
@@ -44,121 +58,219 @@ from handlers import (
     view_budget_command,
     delete_expense_command,
     delete_expense_id,
+    bulk_command,
+    undo_command,
+    category_command,
+    export_command,
+    search_command,
+    search_reply,
+    parse_search_cursor,
+    recent_expenses,
+    quick_add_handler,
+    QUICK_ADD_PATTERN,
+    currency_command,
+    recurring_command,
+    digest_command,
+    timezone_command,
 )
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
+# Queue-backed, optionally JSON and sampled (see logsetup.py).
+setup_logging()
+webapp_log = logging.getLogger("webapp")
 
 # ---------------- WebApp service message handlers ---------------- #
 
-async def webapp_data_handler(update: Update, context):
-    """Handles Telegram WebApp service messages (preferred path)."""
+@replayable
+def _save_webapp_expense(user_id: int, idem, amt, currency, base_amt, cat_name, desc) -> str:
+    """Insert a WebApp expense once per idempotency key; the reply text."""
+    inserted = False
+    with get_repository().write(user_id) as store:
+        text = store.claim_request(idem)
+        if text is None:
+            cat_id = store.category_id(cat_name)
+            warning = check_expense(user_id, cat_id, base_amt)
+            store.add_expense(
+                cat_id, amt, desc,
+                is_anomaly=bool(warning), currency=currency, base_amount=base_amt,
+            )
+            text = f"Expense saved ✅ {amt:.2f} {currency} • {cat_name}"
+            if warning:
+                text += f"\n{warning}"
+            store.finish_request(idem, text)
+            inserted = True
+    if inserted:
+        observe_expense(user_id, cat_id, cat_name, desc)
+    return text
+
+
+def _amount(value):
+    """A WebApp amount as a Decimal; None unless it is a finite number."""
     try:
-        # 👇 এই লাইনটা try ব্লকের ভেতরেই আছে (৪ স্পেস ইন্ডেন্ট)
-        logging.info(
-            "WEBAPP DATA: %s",
-            getattr(getattr(update, "effective_message", None), "web_app_data", None).data
-            if getattr(getattr(update, "effective_message", None), "web_app_data", None)
-            else "NONE",
+        amount = Decimal(str(value or 0))
+    except InvalidOperation:
+        return None
+    return amount if amount.is_finite() else None
+
+
+def _save_webapp_budget(user_id: int, idem, items) -> str:
+    """Save a WebApp budget (items: [(name, amount)]) once per idempotency key; the reply text."""
+    period = user_period(user_id)
+    with get_repository().write(user_id) as store:
+        text = store.claim_request(idem)
+        if text is None:
+            for name, amount in items:
+                store.set_budget(store.category_id(name), amount, period)
+            text = "Budget saved successfully ✅"
+            store.finish_request(idem, text)
+    return text
+
+
+def _webapp_amounts(user_id: int, amt, currency):
+    """(currency, amount in the base currency) of a WebApp expense; FxError if unknown."""
+    base = base_currency(user_id)
+    currency = normalize_currency(currency) or base
+    return currency, convert(amt, currency, base)
+
+
+async def _handle_webapp_payload(update: Update, context, data: dict):
+    """Dispatches one decoded web_app_data payload by its `type`."""
+    user_id = update.effective_user.id
+    idem = request_key(data)
+
+    cached = cached_reply(user_id, idem)
+    if cached is not None:
+        # Repeated submission (double tap, button + MainButton): answer again, write nothing.
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=cached,
         )
-
-        msg = update.effective_message
-        wad = getattr(msg, "web_app_data", None) if msg else None
-        if not wad:
+        return
+
+    if data.get("type") == "budget.save":
+        items = [
+            ((it.get("name") or "").strip(), _amount(it.get("amount")))
+            for it in data.get("items", [])
+        ]
+        items = [(name, amount) for name, amount in items if name]
+        if any(amount is None or amount < 0 or amount > MAX_AMOUNT for _, amount in items):
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text=f"Budget amounts must be numbers from 0 to {MAX_AMOUNT}.",
+            )
             return
+        text = await asyncio.to_thread(_save_webapp_budget, user_id, idem, items)
+        remember_reply(user_id, idem, text)
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=text,
+        )
 
-        data = json.loads(wad.data)
-        user_id = update.effective_user.id
-
-        if data.get("type") == "budget.save":
-            items = data.get("items", [])
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    for it in items:
-                        name = (it.get("name") or "").strip()
-                        amount = float(it.get("amount") or 0)
-                        if not name:
-                            continue
-                        cat_id = get_or_create_category_id(cur, user_id, name)
-                        cur.execute(
-                            """
-                            INSERT INTO budgets (user_id, category_id, amount, period_month)
-                            VALUES (%s, %s, %s, DATE_TRUNC('month', CURRENT_DATE))
-                            ON CONFLICT (user_id, category_id, period_month)
-                            DO UPDATE SET amount = EXCLUDED.amount
-                            """,
-                            (user_id, cat_id, amount),
-                        )
+    elif data.get("type") == "expense.add":
+        amt = _amount(data.get("amount"))
+        cat_name = (data.get("category") or "").strip()
+        desc = (data.get("description") or "").strip()
+        if not cat_name and desc:
+            # No category picked: take the model's guess if it is confident.
+            suggestion = await asyncio.to_thread(suggest_category, user_id, desc)
+            if suggestion and suggestion[1]:
+                cat_name = suggestion[0]
+        if amt is None or amt <= 0 or not cat_name:
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
-                text="Budget saved successfully ✅",
+                text="Invalid amount/category.",
             )
-
-        elif data.get("type") == "expense.add":
-            amt = float(data.get("amount") or 0)
-            cat_name = (data.get("category") or "").strip()
-            desc = (data.get("description") or "").strip()
-            if amt <= 0 or not cat_name:
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text="Invalid amount/category.",
-                )
-                return
-
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    cat_id = get_or_create_category_id(cur, user_id, cat_name)
-                    cur.execute(
-                        "INSERT INTO expenses (user_id, category_id, amount, description) VALUES (%s, %s, %s, %s)",
-                        (user_id, cat_id, amt, desc),
-                    )
+            return
+        try:
+            currency, base_amt = await asyncio.to_thread(_webapp_amounts, user_id, amt, data.get("currency"))
+        except FxError as e:
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text=str(e),
+            )
+            return
+        if max(amt, base_amt) > MAX_AMOUNT:
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
-                text=f"Expense saved ✅ {amt:.2f} • {cat_name}",
+                text=f"The amount must be at most {MAX_AMOUNT}.",
             )
+            return
 
-        elif data.get("type") == "expense.view":
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        SELECT e.id, e.amount, c.name, e.description, e.date
-                        FROM expenses e
-                        LEFT JOIN categories c ON e.category_id = c.id
-                        WHERE e.user_id = %s
-                        ORDER BY e.date DESC
-                        LIMIT 10
-                        """,
-                        (user_id,),
-                    )
-                    rows = cur.fetchall()
-
-            if not rows:
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text="No expenses yet.",
-                )
-            else:
-                lines = ["Last 10 expenses:\n"]
-                for exp_id, amount, cat, desc, dt in rows:
-                    lines.append(
-                        f"ID {exp_id} • {float(amount):.2f} • {cat or 'N/A'} • {dt.strftime('%Y-%m-%d')}"
-                    )
-                    if desc:
-                        lines.append(f"  - {desc}")
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text="\n".join(lines),
-                )
+        try:
+            text = await asyncio.to_thread(
+                _save_webapp_expense, user_id, idem, amt, currency, base_amt, cat_name, desc
+            )
+        except DatabaseUnavailable:
+            # The idem key is claimed on replay, so a resubmission can't add it twice.
+            text = await asyncio.to_thread(
+                defer_write, user_id, update.effective_chat.id, "expense",
+                _save_webapp_expense, user_id, idem, amt, currency, base_amt, cat_name, desc,
+            )
+        else:
+            remember_reply(user_id, idem, text)
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=text,
+        )
+
+    elif data.get("type") == "expense.view":
+        rows, read_at = await asyncio.to_thread(read_through, recent_expenses, user_id, 10)
 
+        if not rows:
+            text = "No expenses yet."
         else:
+            lines = ["Last 10 expenses:\n"]
+            for exp_id, amount, cat, desc, dt, currency in rows:
+                lines.append(
+                    f"ID {exp_id} • {float(amount):.2f} {currency or ''} • {cat or 'N/A'} • {dt.strftime('%Y-%m-%d')}"
+                )
+                if desc:
+                    lines.append(f"  - {desc}")
+            text = "\n".join(lines)
+        text += stale_note(read_at)
+        remember_reply(user_id, idem, text)
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=text,
+        )
+
+    elif data.get("type") == "expense.search":
+        query = (data.get("query") or "").strip()
+        if not query:
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
-                text=f"Unknown type: {data.get('type')}",
+                text="Nothing to search for.",
             )
+            return
+        text, markup = await asyncio.to_thread(
+            search_reply, user_id, query, parse_search_cursor(data.get("after")), context.user_data
+        )
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=text,
+            reply_markup=markup,
+        )
+
+    else:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"Unknown type: {data.get('type')}",
+        )
 
+
+async def webapp_data_handler(update: Update, context):
+    """Handles Telegram WebApp service messages (preferred path)."""
+    try:
+        msg = update.effective_message
+        wad = getattr(msg, "web_app_data", None) if msg else None
+        if not wad:
+            return
+
+        data = json.loads(wad.data)
+        webapp_log.info("WEBAPP DATA: %s", Redacted(data))
+        await _handle_webapp_payload(update, context, data)
+
+    except DatabaseUnavailable:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=UNAVAILABLE_TEXT)
     except Exception:
         logging.exception("Error handling web_app_data")
         await context.bot.send_message(
@@ -173,108 +285,17 @@ async def webapp_fallback_handler(update: Update, context):
     We catch ANY message and process if web_app_data exists.
     """
     try:
-        logging.info(
-            "WEBAPP DATA (fallback): %s",
-            getattr(getattr(update, "effective_message", None), "web_app_data", None).data
-            if getattr(getattr(update, "effective_message", None), "web_app_data", None)
-            else "NONE",
-        )
-
         msg = update.effective_message
         wad = getattr(msg, "web_app_data", None) if msg else None
         if not wad:
             return
 
         data = json.loads(wad.data)
-        user_id = update.effective_user.id
-
-        if data.get("type") == "budget.save":
-            items = data.get("items", [])
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    for it in items:
-                        name = (it.get("name") or "").strip()
-                        amount = float(it.get("amount") or 0)
-                        if not name:
-                            continue
-                        cat_id = get_or_create_category_id(cur, user_id, name)
-                        cur.execute(
-                            """
-                            INSERT INTO budgets (user_id, category_id, amount, period_month)
-                            VALUES (%s, %s, %s, DATE_TRUNC('month', CURRENT_DATE))
-                            ON CONFLICT (user_id, category_id, period_month)
-                            DO UPDATE SET amount = EXCLUDED.amount
-                            """,
-                            (user_id, cat_id, amount),
-                        )
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Budget saved successfully ✅",
-            )
-
-        elif data.get("type") == "expense.add":
-            amt = float(data.get("amount") or 0)
-            cat_name = (data.get("category") or "").strip()
-            desc = (data.get("description") or "").strip()
-            if amt <= 0 or not cat_name:
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text="Invalid amount/category.",
-                )
-                return
-
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    cat_id = get_or_create_category_id(cur, user_id, cat_name)
-                    cur.execute(
-                        "INSERT INTO expenses (user_id, category_id, amount, description) VALUES (%s, %s, %s, %s)",
-                        (user_id, cat_id, amt, desc),
-                    )
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=f"Expense saved ✅ {amt:.2f} • {cat_name}",
-            )
-
-        elif data.get("type") == "expense.view":
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        SELECT e.id, e.amount, c.name, e.description, e.date
-                        FROM expenses e
-                        LEFT JOIN categories c ON e.category_id = c.id
-                        WHERE e.user_id = %s
-                        ORDER BY e.date DESC
-                        LIMIT 10
-                        """,
-                        (user_id,),
-                    )
-                    rows = cur.fetchall()
-
-            if not rows:
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text="No expenses yet.",
-                )
-            else:
-                lines = ["Last 10 expenses:\n"]
-                for exp_id, amount, cat, desc, dt in rows:
-                    lines.append(
-                        f"ID {exp_id} • {float(amount):.2f} • {cat or 'N/A'} • {dt.strftime('%Y-%m-%d')}"
-                    )
-                    if desc:
-                        lines.append(f"  - {desc}")
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text="\n".join(lines),
-                )
-
-        else:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=f"Unknown type: {data.get('type')}",
-            )
+        webapp_log.info("WEBAPP DATA (fallback): %s", Redacted(data))
+        await _handle_webapp_payload(update, context, data)
 
+    except DatabaseUnavailable:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=UNAVAILABLE_TEXT)
     except Exception:
         logging.exception("Error in webapp_fallback_handler")
         await context.bot.send_message(
@@ -286,8 +307,17 @@ async def webapp_fallback_handler(update: Update, context):
 
 def main():
     """Start the bot."""
-    setup_database()
-    application = Application.builder().token(BOT_TOKEN).build()
+    get_repository().setup()
+    # Connections, prepared statements and caches before the first update.
+    warm_up()
+    # Concurrent updates across users (one at a time per user), admitted per
+    # priority lane (see admission.py).
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(AdmissionProcessor())
+        .build()
+    )
 
     # Conversation handlers (legacy CLI flows, optional)
     add_expense_conv_handler = ConversationHandler(
@@ -333,6 +363,15 @@ def main():
     application.add_handler(CommandHandler(["view_expenses", "view", "v"], view_expenses_command))
     application.add_handler(CommandHandler(["report", "r"], report_command))
     application.add_handler(CommandHandler(["view_budget", "v_budget", "vb"], view_budget_command))
+    application.add_handler(CommandHandler(["search", "find"], search_command))
+    application.add_handler(CommandHandler(["currency"], currency_command))
+    application.add_handler(CommandHandler(["recurring", "rec"], recurring_command))
+    application.add_handler(CommandHandler(["digest"], digest_command))
+    application.add_handler(CommandHandler(["timezone", "tz"], timezone_command))
+    application.add_handler(CommandHandler(["bulk"], bulk_command))
+    application.add_handler(CommandHandler(["undo"], undo_command))
+    application.add_handler(CommandHandler(["category"], category_command))
+    application.add_handler(CommandHandler(["export"], export_command))
 
     # UX: reply keyboard taps (Budget/Expense/Report) loop back to the start menu
     application.add_handler(
@@ -342,12 +381,23 @@ def main():
         )
     )
 
+    # Quick add: "120 food lunch", one expense per line
+    application.add_handler(
+        MessageHandler(
+            filters.TEXT & ~filters.COMMAND & filters.Regex(QUICK_ADD_PATTERN),
+            quick_add_handler,
+        )
+    )
+
     # Receive WebApp service messages
     application.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, webapp_data_handler))
 
     # Fallback catcher: safety net
     application.add_handler(MessageHandler(filters.ALL, webapp_fallback_handler))
 
+    # Background jobs (monthly budget rollover)
+    schedule_jobs(application)
+
     logging.info("Bot is polling...")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
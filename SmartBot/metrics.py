@@ -0,0 +1,55 @@
+# metrics.py
+import os
+import json
+import logging
+import threading
+from collections import defaultdict
+
+# In-process counters, gauges and timings, logged as one JSON line every
+# METRICS_LOG_SECONDS by metrics_job. Names are dotted:
+# "<component>.<detail>.<what>", e.g. "admission.heavy.shed".
+METRICS_LOG_SECONDS = int(os.getenv("METRICS_LOG_SECONDS", "60"))
+METRICS_JOB = "metrics_log"
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}  # name -> [count, total seconds, max seconds]
+
+
+def inc(name: str, n: int = 1):
+    with _lock:
+        _counters[name] += n
+
+
+def gauge(name: str, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, seconds: float):
+    with _lock:
+        t = _timings.get(name)
+        if t is None:
+            _timings[name] = [1, seconds, seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+            t[2] = max(t[2], seconds)
+
+
+def snapshot(reset_timings: bool = False) -> dict:
+    """Counters and gauges as-is; timings as count / mean ms / max ms."""
+    with _lock:
+        timings = {
+            name: {"count": n, "mean_ms": round(total / n * 1000, 2), "max_ms": round(peak * 1000, 2)}
+            for name, (n, total, peak) in _timings.items()
+        }
+        if reset_timings:
+            _timings.clear()
+        return {"counters": dict(_counters), "gauges": dict(_gauges), "timings": timings}
+
+
+async def metrics_job(context):
+    """JobQueue callback: log a snapshot; timings cover the interval since the last one."""
+    logging.info("metrics %s", json.dumps(snapshot(reset_timings=True), sort_keys=True))
@@ -0,0 +1,13 @@
+-- Walk budgets month by month in user order (rollover job chunks)
+CREATE INDEX IF NOT EXISTS budgets_month_user_idx
+  ON budgets(period_month, user_id);
+
+-- Resume points for batch jobs (one row per job run)
+CREATE TABLE IF NOT EXISTS job_checkpoints (
+  job_name VARCHAR(64) NOT NULL,
+  run_key DATE NOT NULL,
+  last_user_id BIGINT NOT NULL DEFAULT 0,
+  done BOOLEAN NOT NULL DEFAULT FALSE,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (job_name, run_key)
+);
@@ -0,0 +1,31 @@
+-- Per-day spend aggregates (category_id 0 = uncategorised)
+CREATE TABLE IF NOT EXISTS daily_spend (
+  user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+  category_id INTEGER NOT NULL DEFAULT 0,
+  day DATE NOT NULL,
+  amount DECIMAL(12, 2) NOT NULL DEFAULT 0,
+  n INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, category_id, day)
+);
+
+CREATE INDEX IF NOT EXISTS daily_spend_day_idx
+  ON daily_spend(day);
+
+-- Backfill from existing expenses (run once, before the bot writes again)
+INSERT INTO daily_spend (user_id, category_id, day, amount, n)
+SELECT user_id, COALESCE(category_id, 0), date::date, SUM(amount), COUNT(*)
+FROM expenses
+GROUP BY 1, 2, 3
+ON CONFLICT (user_id, category_id, day)
+DO UPDATE SET amount = EXCLUDED.amount, n = EXCLUDED.n;
+
+-- Nightly month-end projections, read by /view_budget and the Budget WebApp
+CREATE TABLE IF NOT EXISTS budget_forecasts (
+  user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+  category_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
+  period_month DATE NOT NULL,
+  projected DECIMAL(12, 2) NOT NULL,
+  overrun_date DATE,
+  computed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (user_id, category_id, period_month)
+);
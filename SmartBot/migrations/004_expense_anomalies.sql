@@ -0,0 +1,30 @@
+-- Flag set at insert time when an expense is far above the category baseline
+ALTER TABLE expenses
+  ADD COLUMN IF NOT EXISTS is_anomaly BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Log-space sums per day, so per-expense mean/stddev come from the aggregates
+ALTER TABLE daily_spend
+  ADD COLUMN IF NOT EXISTS log_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS log_sumsq DOUBLE PRECISION NOT NULL DEFAULT 0;
+
+UPDATE daily_spend d
+SET log_sum = x.log_sum, log_sumsq = x.log_sumsq
+FROM (
+  SELECT user_id, COALESCE(category_id, 0) AS category_id, date::date AS day,
+         SUM(LN(GREATEST(amount, 0.01))) AS log_sum,
+         SUM(POWER(LN(GREATEST(amount, 0.01)), 2)) AS log_sumsq
+  FROM expenses
+  GROUP BY 1, 2, 3
+) x
+WHERE d.user_id = x.user_id AND d.category_id = x.category_id AND d.day = x.day;
+
+-- Per user/category baselines, rebuilt nightly
+CREATE TABLE IF NOT EXISTS category_baselines (
+  user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+  category_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
+  n INTEGER NOT NULL,
+  typical DECIMAL(12, 2) NOT NULL,
+  threshold DECIMAL(12, 2) NOT NULL,
+  computed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (user_id, category_id)
+);
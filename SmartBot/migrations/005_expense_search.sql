@@ -0,0 +1,7 @@
+-- Typo-tolerant /search over expense descriptions
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+-- user_id first (btree_gin) so a search only touches the user's own entries
+CREATE INDEX IF NOT EXISTS expenses_user_desc_trgm_idx
+  ON expenses USING gin (user_id, description gin_trgm_ops);
@@ -0,0 +1,8 @@
+-- One row per processed WebApp write; the key makes replays no-ops
+CREATE TABLE IF NOT EXISTS webapp_requests (
+  user_id BIGINT NOT NULL,
+  idem_key VARCHAR(64) NOT NULL,
+  response TEXT,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (user_id, idem_key)
+);
@@ -0,0 +1,19 @@
+-- Per-user base currency (NULL = DEFAULT_CURRENCY from the environment)
+ALTER TABLE users
+  ADD COLUMN IF NOT EXISTS base_currency CHAR(3);
+
+-- Original currency of each expense and its amount in the user's base
+-- currency at insert time. Existing rows: NULL currency = default currency.
+ALTER TABLE expenses
+  ADD COLUMN IF NOT EXISTS currency CHAR(3),
+  ADD COLUMN IF NOT EXISTS base_amount DECIMAL(12, 2);
+
+UPDATE expenses SET base_amount = amount WHERE base_amount IS NULL;
+
+-- Units of currency per 1 USD, by date (load with: python fx.py rates.csv)
+CREATE TABLE IF NOT EXISTS fx_rates (
+  currency CHAR(3) NOT NULL,
+  rate_date DATE NOT NULL,
+  per_usd NUMERIC(18, 8) NOT NULL,
+  PRIMARY KEY (currency, rate_date)
+);
@@ -0,0 +1,32 @@
+-- Recurring expense rules. Occurrence k falls on anchor + k * step
+-- (calendar arithmetic, so a rule anchored on the 31st stays month-end);
+-- next_due = anchor + n_done * step is what the job scans.
+CREATE TABLE IF NOT EXISTS recurring_rules (
+  id SERIAL PRIMARY KEY,
+  user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+  category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL,
+  amount DECIMAL(10, 2) NOT NULL,
+  currency CHAR(3),
+  description TEXT,
+  frequency VARCHAR(32) NOT NULL,
+  step INTERVAL NOT NULL,
+  anchor DATE NOT NULL,
+  n_done INTEGER NOT NULL DEFAULT 0,
+  next_due DATE NOT NULL,
+  active BOOLEAN NOT NULL DEFAULT TRUE,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Only due, active rules are ever scanned.
+CREATE INDEX IF NOT EXISTS recurring_rules_due_idx
+  ON recurring_rules (next_due) WHERE active;
+
+-- Materialized occurrences point back at their rule; the unique index
+-- makes re-running a catch-up a no-op.
+ALTER TABLE expenses
+  ADD COLUMN IF NOT EXISTS recurring_rule_id INTEGER REFERENCES recurring_rules(id) ON DELETE SET NULL,
+  ADD COLUMN IF NOT EXISTS recurring_due DATE;
+
+CREATE UNIQUE INDEX IF NOT EXISTS expenses_recurring_uniq
+  ON expenses (recurring_rule_id, recurring_due)
+  WHERE recurring_rule_id IS NOT NULL;
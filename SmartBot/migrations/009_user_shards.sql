@@ -0,0 +1,11 @@
+-- Shard directory (read from shard 0): users pinned off their hash shard
+-- by shards.py, and users whose move is in progress (writes paused).
+CREATE TABLE IF NOT EXISTS user_shards (
+  user_id BIGINT PRIMARY KEY,
+  shard INTEGER NOT NULL,
+  moving BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+-- On shard k > 0, setup_database() also moves the serial sequences of
+-- categories, expenses, budgets and recurring_rules up to k * 100000000
+-- so ids stay unique when users move between shards.
@@ -0,0 +1,6 @@
+-- Opt-in spending digest: 'daily' or 'weekly' (NULL = off).
+ALTER TABLE users ADD COLUMN IF NOT EXISTS digest VARCHAR(8);
+
+-- The digest job pages through opted-in users by user_id.
+CREATE INDEX IF NOT EXISTS users_digest_idx
+  ON users (user_id) WHERE digest IS NOT NULL;
@@ -0,0 +1,3 @@
+-- Per-user data version for the Report WebApp cache (report.py): bumped
+-- in the same statement as every write to expenses, daily_spend or budgets.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,8 @@
+-- Undo buffer for /bulk edits (bulk.py): the previous values of the rows
+-- touched by the user's latest bulk operation, column-wise JSON, zlib.
+CREATE TABLE IF NOT EXISTS bulk_undo (
+  user_id BIGINT PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
+  action VARCHAR(16) NOT NULL,
+  data BYTEA NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
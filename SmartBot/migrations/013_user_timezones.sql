@@ -0,0 +1,21 @@
+-- Per-user time zones (timezones.py). Existing users keep the zone their
+-- days were computed in so far, the server session's; new users get
+-- DEFAULT_TIMEZONE from the bot.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS timezone VARCHAR(64);
+UPDATE users SET timezone = current_setting('TimeZone') WHERE timezone IS NULL;
+ALTER TABLE users ALTER COLUMN timezone SET DEFAULT 'UTC';
+ALTER TABLE users ALTER COLUMN timezone SET NOT NULL;
+
+-- Each expense's day and month in its user's zone, fixed on insert.
+-- Backfilled with date::date, the day daily_spend already uses, so
+-- daily_spend needs no rebuild (run before the bot writes again).
+ALTER TABLE expenses ADD COLUMN IF NOT EXISTS day DATE;
+ALTER TABLE expenses ADD COLUMN IF NOT EXISTS period_month DATE;
+UPDATE expenses
+SET day = date::date, period_month = date_trunc('month', date)::date
+WHERE day IS NULL;
+ALTER TABLE expenses ALTER COLUMN day SET NOT NULL;
+ALTER TABLE expenses ALTER COLUMN period_month SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS expenses_user_period_idx
+  ON expenses(user_id, period_month);
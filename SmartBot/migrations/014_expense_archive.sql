@@ -0,0 +1,9 @@
+-- Months of expenses moved out to archive files (archive.py). Their
+-- daily_spend rows stay and are no longer rebuilt from expenses.
+CREATE TABLE IF NOT EXISTS expense_archive (
+  user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+  period_month DATE NOT NULL,
+  n INTEGER NOT NULL,
+  archived_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (user_id, period_month)
+);
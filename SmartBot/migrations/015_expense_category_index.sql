@@ -0,0 +1,4 @@
+-- /search matches category names through this index instead of an OR that
+-- kept the trigram index on descriptions from being used.
+CREATE INDEX IF NOT EXISTS expenses_user_category_idx
+  ON expenses (user_id, category_id);
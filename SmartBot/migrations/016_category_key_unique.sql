@@ -0,0 +1,49 @@
+-- One category per name as the bot matches names (case and extra
+-- whitespace ignored, database.category_key). Near-duplicates are merged
+-- into the user's oldest one first, as /category merge does. The bot's
+-- setup does the same when the index is missing; it also re-points
+-- archived expenses (archive.py), which this script leaves alone.
+CREATE TEMP TABLE category_dups AS
+SELECT user_id, id AS source,
+       first_value(id) OVER (
+           PARTITION BY user_id, lower(regexp_replace(btrim(name), '\s+', ' ', 'g'))
+           ORDER BY id
+       ) AS target
+FROM categories;
+DELETE FROM category_dups WHERE source = target;
+
+UPDATE expenses e SET category_id = d.target
+FROM category_dups d WHERE e.category_id = d.source;
+
+UPDATE recurring_rules r SET category_id = d.target
+FROM category_dups d WHERE r.category_id = d.source;
+
+INSERT INTO budgets (user_id, category_id, amount, period_month)
+SELECT b.user_id, d.target, SUM(b.amount), b.period_month
+FROM budgets b JOIN category_dups d ON b.category_id = d.source
+GROUP BY b.user_id, d.target, b.period_month
+ON CONFLICT (user_id, category_id, period_month)
+DO UPDATE SET amount = budgets.amount + EXCLUDED.amount;
+DELETE FROM budgets b USING category_dups d WHERE b.category_id = d.source;
+
+INSERT INTO daily_spend (user_id, category_id, day, amount, n, log_sum, log_sumsq)
+SELECT s.user_id, d.target, s.day, SUM(s.amount), SUM(s.n), SUM(s.log_sum), SUM(s.log_sumsq)
+FROM daily_spend s JOIN category_dups d ON s.category_id = d.source
+GROUP BY s.user_id, d.target, s.day
+ON CONFLICT (user_id, category_id, day)
+DO UPDATE SET amount = daily_spend.amount + EXCLUDED.amount,
+              n = daily_spend.n + EXCLUDED.n,
+              log_sum = daily_spend.log_sum + EXCLUDED.log_sum,
+              log_sumsq = daily_spend.log_sumsq + EXCLUDED.log_sumsq;
+DELETE FROM daily_spend s USING category_dups d WHERE s.category_id = d.source;
+
+DELETE FROM budget_forecasts f USING category_dups d
+WHERE f.category_id = d.source OR f.category_id = d.target;
+DELETE FROM category_baselines b USING category_dups d WHERE b.category_id = d.source;
+DELETE FROM bulk_undo u USING category_dups d WHERE u.user_id = d.user_id;
+UPDATE users SET data_version = data_version + 1
+WHERE user_id IN (SELECT user_id FROM category_dups);
+DELETE FROM categories c USING category_dups d WHERE c.id = d.source;
+
+CREATE UNIQUE INDEX IF NOT EXISTS categories_user_key_uniq
+  ON categories (user_id, lower(regexp_replace(btrim(name), '\s+', ' ', 'g')));
@@ -0,0 +1,660 @@
+# pg_repository.py
+import io
+from contextlib import contextmanager
+
+import psycopg2.extras
+
+from database import (
+    DEFAULT_CATEGORIES,
+    get_db_connection,
+    get_read_connection,
+    get_or_create_category_id,
+    MERGE_CATEGORIES_SQL,
+    insert_expense,
+    insert_expenses,
+    delete_expenses,
+    rebuild_daily_spend,
+    setup_database,
+    warm_pool,
+    fan_out,
+    shard_count,
+)
+from repository import Repository, UserStore
+from bulk import EXPENSE_COLUMNS, selection_sql
+from digest import DIGEST_JOB
+from fx import (
+    DEFAULT_CURRENCY,
+    RATE_SQL,
+    REBASE_ARCHIVED_SPEND_SQL,
+    REBASE_BUDGETS_SQL,
+    REBASE_EXPENSES_SQL,
+    FxError,
+    rebase_currencies,
+)
+from jobs import rollover_budgets, _load_checkpoint, _save_checkpoint
+from recurring import materialize_due
+from timezones import DEFAULT_TIMEZONE
+import archive
+import idempotency
+import statements
+
+# One chunk of opted-in users with yesterday's, week-to-date and
+# month-to-date spend (daily_spend, base currency) and the month's total
+# budget, in one pass over each table.
+DIGEST_SQL = """
+WITH u AS (
+    SELECT user_id, COALESCE(base_currency, %(default)s) AS currency
+    FROM users
+    WHERE digest = ANY(%(modes)s) AND user_id > %(after)s
+    ORDER BY user_id
+    LIMIT %(limit)s
+), spend AS (
+    SELECT d.user_id,
+           SUM(d.amount) FILTER (WHERE d.day = %(day)s) AS day_total,
+           SUM(d.amount) FILTER (WHERE d.day >= %(week)s) AS week_total,
+           SUM(d.amount) FILTER (WHERE d.day >= %(month)s) AS month_total
+    FROM daily_spend d
+    JOIN u ON u.user_id = d.user_id
+    WHERE d.day >= LEAST(%(week)s::date, %(month)s::date) AND d.day <= %(day)s
+    GROUP BY d.user_id
+), budget AS (
+    SELECT b.user_id, SUM(b.amount) AS amount
+    FROM budgets b
+    JOIN u ON u.user_id = b.user_id
+    WHERE b.period_month = %(month)s
+    GROUP BY b.user_id
+)
+SELECT u.user_id, u.currency,
+       COALESCE(s.day_total, 0), COALESCE(s.week_total, 0), COALESCE(s.month_total, 0),
+       b.amount
+FROM u
+LEFT JOIN spend s ON s.user_id = u.user_id
+LEFT JOIN budget b ON b.user_id = u.user_id
+ORDER BY u.user_id
+"""
+
+# daily_spend delta of changed expenses: `rows` yields (user_id,
+# category_id, day, amount, sign), -1 taking a row's old values out and
+# +1 adding its new ones.
+SPEND_DELTA_SQL = """
+    INSERT INTO daily_spend (user_id, category_id, day, amount, n, log_sum, log_sumsq)
+    SELECT user_id, COALESCE(category_id, 0), day, SUM(sign * amount), SUM(sign),
+           SUM(sign * LN(GREATEST(amount, 0.01))),
+           SUM(sign * POWER(LN(GREATEST(amount, 0.01)), 2))
+    FROM ({rows}) x
+    GROUP BY 1, 2, 3
+    ON CONFLICT (user_id, category_id, day)
+    DO UPDATE SET amount = daily_spend.amount + EXCLUDED.amount,
+                  n = daily_spend.n + EXCLUDED.n,
+                  log_sum = daily_spend.log_sum + EXCLUDED.log_sum,
+                  log_sumsq = daily_spend.log_sumsq + EXCLUDED.log_sumsq
+"""
+
+# One bulk edit (bulk.py): lock up to limit + 1 selected rows, change them
+# only if there are at most `limit`, adjust daily_spend and return the
+# rows as they were.
+_BULK_SQL = """
+WITH sel AS (
+    SELECT e.user_id, e.day, {columns}
+    FROM expenses e
+    WHERE e.user_id = %(uid)s AND {where}
+    ORDER BY e.id
+    LIMIT %(limit)s + 1
+    FOR UPDATE
+), chg AS (
+    {change}
+    WHERE e.id = sel.id AND (SELECT COUNT(*) FROM sel) <= %(limit)s
+    RETURNING e.id, e.user_id, e.category_id, e.day, COALESCE(e.base_amount, e.amount) AS amount
+), agg AS (
+    {delta}
+), ver AS (
+    UPDATE users SET data_version = data_version + 1
+    WHERE user_id = %(uid)s AND EXISTS (SELECT 1 FROM chg)
+)
+SELECT {plain} FROM sel ORDER BY id
+"""
+_BULK_CHANGES = {
+    "delete": "DELETE FROM expenses e USING sel",
+    "move": "UPDATE expenses e SET category_id = %(value)s FROM sel",
+    "amount": """UPDATE expenses e
+    SET amount = %(value)s,
+        base_amount = CASE WHEN e.base_amount IS NULL OR e.amount = 0 THEN %(value)s
+                           ELSE ROUND(e.base_amount * %(value)s / e.amount, 2) END
+    FROM sel""",
+}
+# A delete only takes the old rows out; an update moves them.
+_BULK_DELETED = "SELECT user_id, category_id, day, amount, -1 AS sign FROM chg"
+_BULK_UPDATED = """
+        SELECT user_id, category_id, day, COALESCE(base_amount, amount) AS amount, -1 AS sign
+        FROM sel WHERE id IN (SELECT id FROM chg)
+        UNION ALL
+        SELECT user_id, category_id, day, amount, 1 FROM chg"""
+
+
+class PostgresUserStore(UserStore):
+    """UserStore over one psycopg2 cursor on the user's shard."""
+
+    def __init__(self, user_id: int, cur):
+        super().__init__(user_id)
+        self.cur = cur
+
+    def upsert_user(self, first_name):
+        self.cur.execute(
+            """
+            INSERT INTO users (user_id, first_name, timezone)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET first_name = EXCLUDED.first_name
+            """,
+            (self.user_id, first_name, DEFAULT_TIMEZONE),
+        )
+
+    def ensure_default_categories(self):
+        self.cur.executemany(
+            """
+            INSERT INTO categories (user_id, name)
+            VALUES (%s, %s)
+            ON CONFLICT DO NOTHING
+            """,
+            [(self.user_id, name) for name in DEFAULT_CATEGORIES],
+        )
+
+    def categories(self):
+        self.cur.execute(
+            "SELECT id, name FROM categories WHERE user_id = %s ORDER BY name", (self.user_id,)
+        )
+        return self.cur.fetchall()
+
+    def category_id(self, name):
+        return get_or_create_category_id(self.cur, self.user_id, name)
+
+    def rename_category(self, category_id, name):
+        self.cur.execute(
+            """
+            WITH c AS (
+                UPDATE categories SET name = %(name)s
+                WHERE id = %(cid)s AND user_id = %(uid)s
+                RETURNING id
+            )
+            UPDATE users SET data_version = data_version + 1
+            WHERE user_id = %(uid)s AND EXISTS (SELECT 1 FROM c)
+            """,
+            {"uid": self.user_id, "cid": category_id, "name": name},
+        )
+        return self.cur.rowcount > 0
+
+    def merge_categories(self, source_ids, target_id):
+        self.cur.execute(
+            MERGE_CATEGORIES_SQL, {"uid": self.user_id, "sources": list(source_ids), "target": target_id}
+        )
+        return self.cur.fetchone()
+
+    def base_currency(self):
+        self.cur.execute("SELECT base_currency FROM users WHERE user_id = %s", (self.user_id,))
+        row = self.cur.fetchone()
+        return row[0] if row else None
+
+    def timezone(self):
+        self.cur.execute("SELECT timezone FROM users WHERE user_id = %s", (self.user_id,))
+        row = self.cur.fetchone()
+        return row[0] if row else None
+
+    def set_timezone(self, name):
+        self.cur.execute("UPDATE users SET timezone = %s WHERE user_id = %s", (name, self.user_id))
+
+    def add_expense(self, category_id, amount, description, is_anomaly=False,
+                    currency=None, base_amount=None):
+        return insert_expense(
+            self.cur, self.user_id, category_id, amount, description,
+            is_anomaly=is_anomaly, currency=currency, base_amount=base_amount,
+        )
+
+    def add_expenses(self, rows):
+        return insert_expenses(self.cur, self.user_id, rows)
+
+    def delete_expenses(self, ids):
+        return delete_expenses(self.cur, self.user_id, ids)
+
+    def change_expenses(self, selector, action, value, limit):
+        where, params = selection_sql(selector, "%({})s")
+        self.cur.execute(
+            _BULK_SQL.format(
+                columns=", ".join("e." + c for c in EXPENSE_COLUMNS),
+                plain=", ".join(EXPENSE_COLUMNS),
+                where=where,
+                change=_BULK_CHANGES[action],
+                delta=SPEND_DELTA_SQL.format(
+                    rows=_BULK_DELETED if action == "delete" else _BULK_UPDATED
+                ),
+            ),
+            dict(params, uid=self.user_id, limit=limit, value=value),
+        )
+        return self.cur.fetchall()
+
+    def restore_expenses(self, rows):
+        if not rows:
+            return 0
+        return psycopg2.extras.execute_values(
+            self.cur,
+            """
+            WITH v AS (
+                SELECT * FROM (VALUES %s)
+                    AS v(user_id, id, category_id, amount, description, date, is_anomaly,
+                         currency, base_amount, recurring_rule_id, recurring_due)
+            ), ins AS (
+                INSERT INTO expenses (id, user_id, category_id, amount, description, date,
+                                      is_anomaly, currency, base_amount, recurring_rule_id,
+                                      recurring_due, day, period_month)
+                SELECT v.id, v.user_id, c.id, v.amount, v.description, v.date, v.is_anomaly,
+                       v.currency, v.base_amount, r.id, v.recurring_due, t.day,
+                       date_trunc('month', t.day)::date
+                FROM v
+                JOIN users u ON u.user_id = v.user_id
+                CROSS JOIN LATERAL (SELECT (v.date AT TIME ZONE u.timezone)::date AS day) t
+                LEFT JOIN categories c ON c.id = v.category_id AND c.user_id = v.user_id
+                LEFT JOIN recurring_rules r ON r.id = v.recurring_rule_id AND r.user_id = v.user_id
+                ON CONFLICT DO NOTHING
+                RETURNING user_id, category_id, day, COALESCE(base_amount, amount) AS amount
+            ), agg AS (
+                """ + SPEND_DELTA_SQL.format(rows="SELECT *, 1 AS sign FROM ins") + """
+            ), ver AS (
+                UPDATE users SET data_version = data_version + 1
+                WHERE user_id IN (SELECT user_id FROM ins)
+            )
+            SELECT COUNT(*) FROM ins
+            """,
+            [(self.user_id,) + tuple(row) for row in rows],
+            template="(%s::bigint, %s::integer, %s::integer, %s::numeric, %s::text, %s::timestamptz,"
+                     " %s::boolean, %s::char(3), %s::numeric, %s::integer, %s::date)",
+            page_size=len(rows),
+            fetch=True,
+        )[0][0]
+
+    def revert_expenses(self, rows):
+        if not rows:
+            return 0
+        return psycopg2.extras.execute_values(
+            self.cur,
+            """
+            WITH v AS (
+                SELECT * FROM (VALUES %s) AS v(user_id, id, category_id, amount, base_amount)
+            ), old AS (
+                SELECT e.id, e.user_id, e.category_id, e.day,
+                       COALESCE(e.base_amount, e.amount) AS amount
+                FROM expenses e
+                JOIN v ON v.id = e.id AND v.user_id = e.user_id
+                FOR UPDATE OF e
+            ), chg AS (
+                -- Driven by `old`, so every row is read before it changes.
+                UPDATE expenses e
+                SET category_id = c.id, amount = v.amount, base_amount = v.base_amount
+                FROM old
+                JOIN v ON v.id = old.id
+                LEFT JOIN categories c ON c.id = v.category_id AND c.user_id = v.user_id
+                WHERE e.id = old.id
+                RETURNING e.user_id, e.category_id, e.day, COALESCE(e.base_amount, e.amount) AS amount
+            ), agg AS (
+                """ + SPEND_DELTA_SQL.format(
+                rows="SELECT user_id, category_id, day, amount, -1 AS sign FROM old"
+                     " UNION ALL SELECT *, 1 FROM chg"
+            ) + """
+            ), ver AS (
+                UPDATE users SET data_version = data_version + 1
+                WHERE user_id IN (SELECT user_id FROM chg)
+            )
+            SELECT COUNT(*) FROM chg
+            """,
+            [(self.user_id,) + tuple(row) for row in rows],
+            template="(%s::bigint, %s::integer, %s::integer, %s::numeric, %s::numeric)",
+            page_size=len(rows),
+            fetch=True,
+        )[0][0]
+
+    def save_undo(self, action, data):
+        self.cur.execute(
+            """
+            INSERT INTO bulk_undo (user_id, action, data) VALUES (%s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE
+            SET action = EXCLUDED.action, data = EXCLUDED.data, created_at = CURRENT_TIMESTAMP
+            """,
+            (self.user_id, action, psycopg2.Binary(data)),
+        )
+
+    def take_undo(self):
+        self.cur.execute(
+            "DELETE FROM bulk_undo WHERE user_id = %s RETURNING action, data, created_at",
+            (self.user_id,),
+        )
+        return self.cur.fetchone()
+
+    def recent_expenses(self, limit):
+        statements.execute(self.cur, "recent_expenses", (self.user_id, limit))
+        return self.cur.fetchall()
+
+    def export_expenses(self, after_id, limit):
+        self.cur.execute(
+            """
+            SELECT e.id, e.date, e.day, c.name, e.amount, e.currency, e.description
+            FROM expenses e
+            LEFT JOIN categories c ON c.id = e.category_id
+            WHERE e.user_id = %s AND e.id > %s
+            ORDER BY e.id
+            LIMIT %s
+            """,
+            (self.user_id, after_id, limit),
+        )
+        return self.cur.fetchall()
+
+    def recent_descriptions(self, limit):
+        self.cur.execute(
+            """
+            SELECT e.category_id, c.name, e.description
+            FROM expenses e
+            JOIN categories c ON e.category_id = c.id
+            WHERE e.user_id = %s AND e.description <> ''
+            ORDER BY e.date DESC
+            LIMIT %s
+            """,
+            (self.user_id, limit),
+        )
+        return self.cur.fetchall()
+
+    def month_spend(self, period):
+        # daily_spend is already in the base currency: no per-row conversion.
+        # Its days are the expenses' stored days, so this month matches
+        # expenses.period_month = period.
+        self.cur.execute(
+            """
+            SELECT COALESCE(SUM(amount),0) FROM daily_spend
+            WHERE user_id = %s AND day >= %s AND day < %s::date + INTERVAL '1 month'
+            """,
+            (self.user_id, period, period),
+        )
+        total = self.cur.fetchone()[0] or 0
+        self.cur.execute(
+            """
+            SELECT c.name, COALESCE(SUM(d.amount),0)
+            FROM daily_spend d
+            JOIN categories c ON d.category_id = c.id
+            WHERE d.user_id = %s AND d.day >= %s AND d.day < %s::date + INTERVAL '1 month'
+            GROUP BY c.name
+            HAVING SUM(d.n) > 0
+            ORDER BY 2 DESC, 1
+            """,
+            (self.user_id, period, period),
+        )
+        return total, self.cur.fetchall()
+
+    def search(self, query, after, limit):
+        # pg_trgm word similarity. Description matches come from the trigram
+        # GIN index, category-name matches from (user_id, category_id); an OR
+        # of the two in one WHERE could use neither.
+        keyset = ""
+        params = {"uid": self.user_id, "q": query, "limit": limit}
+        if after:
+            keyset = "WHERE (r.score, r.id) < (%(score)s, %(id)s)"
+            params.update(score=after[0], id=after[1])
+        self.cur.execute(
+            f"""
+            SELECT r.id, r.amount, r.name, r.description, r.date, r.score
+            FROM (
+                SELECT e.id, e.amount, c.name, e.description, e.date,
+                       ROUND(GREATEST(
+                           word_similarity(%(q)s, COALESCE(e.description, '')),
+                           word_similarity(%(q)s, COALESCE(c.name, ''))
+                       )::numeric, 4) AS score
+                FROM (
+                    SELECT id FROM expenses
+                    WHERE user_id = %(uid)s AND description %%> %(q)s
+                    UNION
+                    SELECT x.id FROM categories k
+                    JOIN expenses x ON x.user_id = k.user_id AND x.category_id = k.id
+                    WHERE k.user_id = %(uid)s AND k.name %%> %(q)s
+                ) m
+                JOIN expenses e ON e.id = m.id
+                LEFT JOIN categories c ON e.category_id = c.id
+            ) r
+            {keyset}
+            ORDER BY r.score DESC, r.id DESC
+            LIMIT %(limit)s
+            """,
+            params,
+        )
+        return self.cur.fetchall()
+
+    def report_version(self):
+        self.cur.execute(
+            "SELECT data_version, base_currency FROM users WHERE user_id = %s", (self.user_id,)
+        )
+        return self.cur.fetchone() or (0, None)
+
+    def report_months(self, since):
+        # Monthly roll-up of daily_spend next to the budgets, one row per
+        # (category, month) that has either.
+        self.cur.execute(
+            """
+            SELECT c.name, to_char(x.month, 'YYYY-MM'), SUM(x.spent), SUM(x.budget)
+            FROM (
+                SELECT category_id, date_trunc('month', day)::date AS month,
+                       amount AS spent, 0 AS budget
+                FROM daily_spend
+                WHERE user_id = %(uid)s AND day >= %(since)s
+                UNION ALL
+                SELECT category_id, period_month, 0, amount
+                FROM budgets
+                WHERE user_id = %(uid)s AND period_month >= %(since)s
+            ) x
+            LEFT JOIN categories c ON c.id = x.category_id
+            GROUP BY c.name, x.month
+            ORDER BY c.name, x.month
+            """,
+            {"uid": self.user_id, "since": since},
+        )
+        return self.cur.fetchall()
+
+    def digest(self):
+        self.cur.execute("SELECT digest FROM users WHERE user_id = %s", (self.user_id,))
+        row = self.cur.fetchone()
+        return row[0] if row else None
+
+    def set_digest(self, mode):
+        self.cur.execute("UPDATE users SET digest = %s WHERE user_id = %s", (mode, self.user_id))
+
+    def set_budget(self, category_id, amount, period):
+        self.cur.execute(
+            """
+            WITH b AS (
+                INSERT INTO budgets (user_id, category_id, amount, period_month)
+                VALUES (%(uid)s, %(cid)s, %(amount)s, %(period)s)
+                ON CONFLICT (user_id, category_id, period_month)
+                DO UPDATE SET amount = EXCLUDED.amount
+            )
+            UPDATE users SET data_version = data_version + 1 WHERE user_id = %(uid)s
+            """,
+            {"uid": self.user_id, "cid": category_id, "amount": amount, "period": period},
+        )
+
+    def budget_items(self, period):
+        statements.execute(self.cur, "budget_items", (self.user_id, period))
+        return self.cur.fetchall()
+
+    def claim_request(self, key):
+        return idempotency.claim_request(self.cur, self.user_id, key)
+
+    def finish_request(self, key, reply):
+        idempotency.finish_request(self.cur, self.user_id, key, reply)
+
+    def add_rule(self, category_id, amount, currency, description, frequency, step, start):
+        self.cur.execute(
+            """
+            INSERT INTO recurring_rules (user_id, category_id, amount, currency, description,
+                                         frequency, step, anchor, next_due)
+            VALUES (%s, %s, %s, %s, %s, %s, %s::interval, %s, %s)
+            RETURNING id
+            """,
+            (self.user_id, category_id, amount, currency, description, frequency, step, start, start),
+        )
+        return self.cur.fetchone()[0]
+
+    def list_rules(self):
+        self.cur.execute(
+            """
+            SELECT r.id, r.amount, r.currency, c.name, r.description, r.frequency, r.next_due
+            FROM recurring_rules r
+            LEFT JOIN categories c ON r.category_id = c.id
+            WHERE r.user_id = %s AND r.active
+            ORDER BY r.next_due, r.id
+            """,
+            (self.user_id,),
+        )
+        return self.cur.fetchall()
+
+    def stop_rule(self, rule_id):
+        self.cur.execute(
+            "UPDATE recurring_rules SET active = FALSE WHERE id = %s AND user_id = %s AND active",
+            (rule_id, self.user_id),
+        )
+        return self.cur.rowcount > 0
+
+
+class PostgresRepository(Repository):
+    """The psycopg2 backend: shard/replica routing from database.py, jobs in SQL."""
+
+    name = "postgres"
+    analytics_jobs = True
+
+    def setup(self):
+        for user_id, merged, target_id in setup_database():
+            archive.recategorize(user_id, merged, target_id)
+
+    @contextmanager
+    def write(self, user_id):
+        with get_db_connection(user_id) as conn:
+            with conn.cursor() as cur:
+                yield PostgresUserStore(user_id, cur)
+
+    @contextmanager
+    def read(self, user_id):
+        with get_read_connection(user_id) as conn:
+            with conn.cursor() as cur:
+                yield PostgresUserStore(user_id, cur)
+
+    def warm_pool(self):
+        return warm_pool()
+
+    def recent_users(self, since, limit):
+        # Each shard's most recent users, merged (runs once per start).
+        rows = [r for part in fan_out(_recent_shard_users, since, limit) for r in part]
+        rows.sort(key=lambda r: r[1], reverse=True)
+        return [uid for uid, _ in rows[:limit]]
+
+    def digest_chunks(self, run_key, modes, window, chunk_size):
+        # Shards one after another: sending, not querying, is the bottleneck.
+        day, week_start, month_start = window
+        for shard in range(shard_count()):
+            last_user_id, done = _load_checkpoint(DIGEST_JOB, run_key, shard)
+            while not done:
+                with get_read_connection(shard=shard) as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            DIGEST_SQL,
+                            {
+                                "modes": list(modes), "after": last_user_id, "limit": chunk_size,
+                                "day": day, "week": week_start, "month": month_start,
+                                "default": DEFAULT_CURRENCY,
+                            },
+                        )
+                        rows = cur.fetchall()
+                done = len(rows) < chunk_size
+                if rows:
+                    last_user_id = rows[-1][0]
+                yield (shard, last_user_id, done), rows
+
+    def digest_checkpoint(self, run_key, marker):
+        shard, last_user_id, done = marker
+        with get_db_connection(shard=shard) as conn:
+            with conn.cursor() as cur:
+                _save_checkpoint(cur, DIGEST_JOB, run_key, last_user_id, done)
+
+    def fx_rate(self, currency, day):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT " + RATE_SQL.format(cur="%(cur)s", day="%(day)s::date"),
+                    {"cur": currency, "day": day},
+                )
+                return cur.fetchone()[0]
+
+    def currencies(self):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT DISTINCT currency FROM fx_rates")
+                return {r[0] for r in cur.fetchall()}
+
+    def load_rates(self, csv_text):
+        return fan_out(_load_shard_rates, csv_text)[0]
+
+    def set_base_currency(self, user_id, code, old):
+        """Bulk UPDATEs in SQL, then daily_spend is rebuilt from the converted amounts."""
+        params = {"uid": user_id, "base": code, "old": old, "default": DEFAULT_CURRENCY}
+        with get_db_connection(user_id) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT DISTINCT COALESCE(currency, %s) FROM expenses WHERE user_id = %s",
+                    (DEFAULT_CURRENCY, user_id),
+                )
+                needed = rebase_currencies([r[0] for r in cur.fetchall()], code, old)
+                cur.execute("SELECT DISTINCT currency FROM fx_rates WHERE currency = ANY(%s)", (list(needed),))
+                missing = needed - {r[0] for r in cur.fetchall()}
+                if not missing:
+                    cur.execute("UPDATE users SET base_currency = %s WHERE user_id = %s", (code, user_id))
+                    cur.execute(REBASE_EXPENSES_SQL, params)
+                    if old != code:
+                        cur.execute(REBASE_BUDGETS_SQL, params)
+                        cur.execute(REBASE_ARCHIVED_SPEND_SQL, params)
+                    rebuild_daily_spend(cur, user_id)
+        if missing:
+            raise FxError(f"No exchange rate for {', '.join(sorted(missing))}")
+
+    def prune_requests(self):
+        return idempotency.prune_requests()
+
+    def rollover_budgets(self, period=None):
+        return rollover_budgets(period)
+
+    def materialize_recurring(self, today=None, user_id=None):
+        return materialize_due(today, user_id=user_id)
+
+
+def _load_shard_rates(shard: int, text: str) -> int:
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE fx_stage (LIKE fx_rates) ON COMMIT DROP")
+            cur.copy_expert(
+                "COPY fx_stage (rate_date, currency, per_usd) FROM STDIN WITH (FORMAT csv)",
+                io.StringIO(text),
+            )
+            cur.execute(
+                """
+                INSERT INTO fx_rates (rate_date, currency, per_usd)
+                SELECT rate_date, UPPER(currency), per_usd FROM fx_stage
+                ON CONFLICT (currency, rate_date) DO UPDATE SET per_usd = EXCLUDED.per_usd
+                """
+            )
+            return cur.rowcount
+
+
+def _recent_shard_users(shard: int, since, limit: int) -> list:
+    with get_read_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT user_id, MAX(date) AS last_seen
+                FROM expenses
+                WHERE date >= %s
+                GROUP BY user_id
+                ORDER BY last_seen DESC
+                LIMIT %s
+                """,
+                (since, limit),
+            )
+            return cur.fetchall()
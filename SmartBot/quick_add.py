@@ -0,0 +1,112 @@
+# quick_add.py
+import re
+from decimal import Decimal, InvalidOperation
+
+from database import MAX_AMOUNT, category_key
+from repository import get_repository
+from anomaly import check_expense
+from categorizer import suggest_category, observe as observe_expense
+from fx import base_currency, convert, known_currencies
+
+# One expense per line: "<amount> [currency] [category] [description]", e.g.
+#   120 food lunch with Sam
+#   45.5 Medical Treatment pharmacy
+#   30 EUR transport airport train
+# The category is the longest run of leading words matching one of the
+# user's categories (database.category_key); without a match it is predicted
+# from the description and must be confident.
+MAX_LINES = 100
+QUICK_ADD_PATTERN = r"^\s*\d"
+_AMOUNT_RE = re.compile(r"^\d[\d,]*(\.\d{1,2})?$")
+
+
+class QuickAddError(ValueError):
+    """Raised with one message per rejected line; nothing is saved."""
+
+    def __init__(self, errors):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+def _parse_line(user_id: int, line: str, categories: dict, max_words: int, base: str, currencies):
+    words = line.split()
+    if not _AMOUNT_RE.match(words[0]):
+        raise ValueError(f"'{words[0]}' is not an amount")
+    try:
+        amount = Decimal(words[0].replace(",", ""))
+    except InvalidOperation:
+        raise ValueError(f"'{words[0]}' is not an amount")
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+    if amount > MAX_AMOUNT:
+        raise ValueError(f"amount must be at most {MAX_AMOUNT}")
+
+    rest = words[1:]
+    currency = base
+    if rest and rest[0].upper() in currencies and rest[0].lower() not in categories:
+        currency = rest.pop(0).upper()
+    base_amount = convert(amount, currency, base)
+    if base_amount > MAX_AMOUNT:
+        raise ValueError(f"amount must be at most {MAX_AMOUNT} {base}")
+
+    for n in range(min(len(rest), max_words), 0, -1):
+        match = categories.get(category_key(" ".join(rest[:n])))
+        if match:
+            return amount, currency, base_amount, match[0], match[1], " ".join(rest[n:])
+
+    description = " ".join(rest)
+    suggestion = suggest_category(user_id, description) if description else None
+    if suggestion and suggestion[1] and category_key(suggestion[0]) in categories:
+        category_id, name = categories[category_key(suggestion[0])]
+        return amount, currency, base_amount, category_id, name, description
+    raise ValueError("no known category (start with one, e.g. '120 Food lunch')")
+
+
+def parse_quick_add(user_id: int, text: str, categories: dict, base: str):
+    """
+    Parse every line of a quick-add message. `categories` maps
+    category_key(name) -> (id, name); amounts are also converted to the `base` currency.
+    Returns [(amount, currency, base_amount, category_id, category_name,
+    description)] or raises QuickAddError listing every bad line.
+    """
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    if len(lines) > MAX_LINES:
+        raise QuickAddError([f"At most {MAX_LINES} lines per message."])
+    max_words = max((len(name.split()) for name in categories), default=1)
+    currencies = known_currencies()
+
+    entries, errors = [], []
+    for i, line in enumerate(lines, start=1):
+        try:
+            entries.append(_parse_line(user_id, line, categories, max_words, base, currencies))
+        except ValueError as e:
+            errors.append(f"Line {i} ({line}): {e}")
+    if errors:
+        raise QuickAddError(errors)
+    return entries
+
+
+def save_quick_add(user_id: int, text: str):
+    """
+    Validate a whole quick-add message, then write it as one multi-row
+    insert in one transaction. Returns [(amount, currency, base_amount,
+    category_name, description, warning)] in message order.
+    """
+    # Parsing (which may load the categorizer) and the anomaly checks run
+    # before the write transaction is opened, not while it holds a connection.
+    base = base_currency(user_id)
+    repo = get_repository()
+    with repo.read(user_id) as store:
+        categories = {category_key(name): (cid, name) for cid, name in store.categories()}
+    entries = parse_quick_add(user_id, text, categories, base)
+    rows, saved = [], []
+    for amount, currency, base_amount, category_id, name, description in entries:
+        warning = check_expense(user_id, category_id, base_amount)
+        rows.append((category_id, amount, description, bool(warning), currency, base_amount))
+        saved.append((amount, currency, base_amount, name, description, warning))
+    with repo.write(user_id) as store:
+        store.add_expenses(rows)
+
+    for _, _, _, category_id, name, description in entries:
+        observe_expense(user_id, category_id, name, description)
+    return saved
@@ -0,0 +1,154 @@
+# recurring.py
+import os
+import re
+import asyncio
+import logging
+from datetime import date
+
+from database import get_db_connection, fan_out, moving_users, shard_for
+from fx import DEFAULT_CURRENCY, RATE_SQL
+from repository import get_repository
+
+# Rules are materialized by a JobQueue task: every due occurrence of up to
+# RECURRING_BATCH_SIZE rules is written in one INSERT ... SELECT, and
+# batches repeat until nothing is due. Only rules with next_due <= today
+# are read (partial index), so the cost follows due rules, not users.
+# A bot that was down catches up on the next run: all missed occurrences
+# are generated at once, and the unique (rule, due date) index on
+# expenses turns any overlap into a no-op.
+BATCH_SIZE = int(os.getenv("RECURRING_BATCH_SIZE", "1000"))
+RECURRING_JOB = "recurring_expenses"
+
+_FIXED = {
+    "daily": "1 day",
+    "weekly": "7 days",
+    "biweekly": "14 days",
+    "monthly": "1 month",
+    "quarterly": "3 months",
+    "yearly": "1 year",
+}
+_EVERY_RE = re.compile(r"^every\s+(\d{1,3})\s+(day|week|month|year)s?$", re.IGNORECASE)
+_UNIT_DAYS = {"day": 1, "week": 7}
+
+
+def parse_frequency(words):
+    """
+    Leading frequency of a rule: 'monthly', 'weekly', ... or 'every N
+    days|weeks|months|years'. Returns (label, interval, words_used) or None.
+    """
+    if not words:
+        return None
+    word = words[0].lower()
+    if word in _FIXED:
+        return word, _FIXED[word], 1
+    m = _EVERY_RE.match(" ".join(words[:3]))
+    if not m or int(m.group(1)) < 1:
+        return None
+    n, unit = int(m.group(1)), m.group(2).lower()
+    label = f"every {n} {unit}{'s' if n > 1 else ''}"
+    if unit in _UNIT_DAYS:
+        return label, f"{n * _UNIT_DAYS[unit]} days", 3
+    return label, f"{n} {unit}s", 3
+
+
+# One batch of due rules, locked so concurrent runs skip each other's rows.
+# occ has one row per missed occurrence (anchor + k * step up to today);
+# the series bound is days overdue, enough for the smallest (1 day) step.
+_MATERIALIZE_SQL = """
+WITH due AS (
+    SELECT r.id, r.user_id, r.category_id, r.amount, r.description, r.step, r.anchor,
+           r.n_done, r.next_due,
+           COALESCE(r.currency, %(default)s) AS currency,
+           COALESCE(u.base_currency, %(default)s) AS base
+    FROM recurring_rules r
+    JOIN users u ON u.user_id = r.user_id
+    WHERE r.active AND r.next_due <= %(today)s
+      AND (%(uid)s::bigint IS NULL OR r.user_id = %(uid)s)
+      AND r.user_id <> ALL(%(moving)s::bigint[])
+    ORDER BY r.next_due, r.id
+    LIMIT %(batch)s
+    FOR UPDATE OF r SKIP LOCKED
+), occ AS (
+    SELECT d.*, (d.anchor + (d.n_done + k) * d.step)::date AS due_date
+    FROM due d
+    CROSS JOIN LATERAL generate_series(0, %(today)s - d.next_due) AS k
+    WHERE (d.anchor + (d.n_done + k) * d.step)::date <= %(today)s
+), ins AS (
+    INSERT INTO expenses (user_id, category_id, amount, description, date, currency,
+                          base_amount, recurring_rule_id, recurring_due, day, period_month)
+    SELECT o.user_id, o.category_id, o.amount, o.description, o.due_date::timestamptz,
+           o.currency,
+           CASE WHEN o.currency = o.base THEN o.amount
+                ELSE ROUND(o.amount * {to_rate} / {from_rate}, 2)
+           END,
+           o.id, o.due_date, o.due_date, date_trunc('month', o.due_date)::date
+    FROM occ o
+    ON CONFLICT (recurring_rule_id, recurring_due) WHERE recurring_rule_id IS NOT NULL
+    DO NOTHING
+    RETURNING user_id, category_id, base_amount AS amount, day
+), agg AS (
+    INSERT INTO daily_spend (user_id, category_id, day, amount, n, log_sum, log_sumsq)
+    SELECT user_id, COALESCE(category_id, 0), day, SUM(amount), COUNT(*),
+           SUM(LN(GREATEST(amount, 0.01))), SUM(POWER(LN(GREATEST(amount, 0.01)), 2))
+    FROM ins
+    GROUP BY 1, 2, 3
+    ON CONFLICT (user_id, category_id, day)
+    DO UPDATE SET amount = daily_spend.amount + EXCLUDED.amount,
+                  n = daily_spend.n + EXCLUDED.n,
+                  log_sum = daily_spend.log_sum + EXCLUDED.log_sum,
+                  log_sumsq = daily_spend.log_sumsq + EXCLUDED.log_sumsq
+), adv AS (
+    UPDATE recurring_rules r
+    SET n_done = r.n_done + c.cnt,
+        next_due = (r.anchor + (r.n_done + c.cnt) * r.step)::date
+    FROM (SELECT id, COUNT(*) AS cnt FROM occ GROUP BY id) c
+    WHERE r.id = c.id
+), ver AS (
+    UPDATE users SET data_version = data_version + 1
+    WHERE user_id IN (SELECT user_id FROM ins)
+)
+SELECT (SELECT COUNT(*) FROM due), (SELECT COUNT(*) FROM ins)
+""".format(
+    to_rate=RATE_SQL.format(cur="o.base", day="o.due_date"),
+    from_rate=RATE_SQL.format(cur="o.currency", day="o.due_date"),
+)
+
+
+def materialize_due(today: date = None, batch_size: int = BATCH_SIZE, user_id: int = None):
+    """
+    Write every occurrence due on or before `today` as an expense, one
+    transaction per batch of rules (all users on every shard, or just
+    `user_id`). Returns (rules, expenses) processed.
+    """
+    today = today or date.today()
+    if user_id is not None:
+        return _materialize_shard(shard_for(user_id), today, batch_size, user_id)
+    done = fan_out(_materialize_shard, today, batch_size)
+    rules, created = sum(r for r, _ in done), sum(c for _, c in done)
+    logging.info("Recurring expenses: %s rules due, %s expenses created", rules, created)
+    return rules, created
+
+
+def _materialize_shard(shard: int, today: date, batch_size: int, user_id: int = None):
+    params = {"today": today, "batch": batch_size, "default": DEFAULT_CURRENCY, "uid": user_id}
+    rules = created = 0
+    while True:
+        # Users being moved between shards are left for the next run.
+        params["moving"] = list(moving_users())
+        with get_db_connection(user_id, shard=shard) as conn:
+            with conn.cursor() as cur:
+                cur.execute(_MATERIALIZE_SQL, params)
+                n_rules, n_expenses = cur.fetchone()
+        rules += n_rules
+        created += n_expenses
+        if n_rules < batch_size:
+            break
+    return rules, created
+
+
+async def recurring_job(context):
+    """JobQueue callback (startup + daily)."""
+    try:
+        await asyncio.to_thread(get_repository().materialize_recurring)
+    except Exception:
+        logging.exception("Recurring expenses job failed")
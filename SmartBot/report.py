@@ -0,0 +1,105 @@
+# report.py
+import os
+import json
+import base64
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from fx import DEFAULT_CURRENCY
+from breaker import DatabaseUnavailable
+from repository import get_repository
+from timezones import user_today
+
+# Data for the Report WebApp (webapp/report.html): REPORT_MONTHS months of
+# per-category spend and budgets, column-oriented so it fits in the URL:
+#   {"type": "report.init", "ui": "report", "cur": "EUR",
+#    "months": ["2025-11", ..., "2026-10"],
+#    "cats":   ["Food", "Rent", ...],
+#    "spent":  [[per month] per category],
+#    "budget": [[per month] per category]}
+# It is built from daily_spend and budgets (never raw expenses) and the
+# encoded blob is kept per user until their data_version moves, which
+# every write to expenses or budgets does. Opening the report again is
+# then one primary key lookup. Up to REPORT_CACHE_USERS blobs are kept;
+# while the database is unavailable the kept blob is served as it is.
+REPORT_MONTHS = int(os.getenv("REPORT_MONTHS", "12"))
+REPORT_CACHE_USERS = int(os.getenv("REPORT_CACHE_USERS", "10000"))
+UNCATEGORIZED = "Uncategorized"
+
+_cache = OrderedDict()  # user_id -> ((data_version, first month), encoded blob)
+_lock = threading.Lock()
+
+
+def report_months(today: date, n: int = REPORT_MONTHS) -> list:
+    """The last `n` month keys ('YYYY-MM'), oldest first, ending with today's month."""
+    index = today.year * 12 + today.month - 1
+    return [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in range(index - n + 1, index + 1)]
+
+
+def _num(value):
+    value = round(float(value or 0), 2)
+    return int(value) if value.is_integer() else value
+
+
+def build_report(currency: str, months: list, rows) -> dict:
+    """Columnar report from report_months() rows; categories with nothing in range are left out."""
+    position = {m: i for i, m in enumerate(months)}
+    spent, budget = {}, {}
+    for name, month, amount, limit in rows:
+        i = position.get(month)
+        if i is None:
+            continue
+        name = name or UNCATEGORIZED
+        if name not in spent:
+            spent[name], budget[name] = [0] * len(months), [0] * len(months)
+        spent[name][i] = _num(spent[name][i] + _num(amount))
+        budget[name][i] = _num(budget[name][i] + _num(limit))
+    cats = [name for name in spent if any(spent[name]) or any(budget[name])]
+    cats.sort(key=lambda name: -sum(spent[name]))
+    return {
+        "type": "report.init",
+        "ui": "report",
+        "cur": currency,
+        "months": months,
+        "cats": cats,
+        "spent": [spent[name] for name in cats],
+        "budget": [budget[name] for name in cats],
+    }
+
+
+def _encode(report: dict) -> str:
+    raw = json.dumps(report, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def report_payload(user_id: int, today: date = None) -> str:
+    """
+    Base64url report blob for the WebApp URL, rebuilt only when the user's
+    data changed.
+    """
+    try:
+        months = report_months(today or user_today(user_id))
+        with get_repository().read(user_id) as store:
+            version, currency = store.report_version()
+            key = (version, months[0])
+            with _lock:
+                hit = _cache.get(user_id)
+                if hit and hit[0] == key:
+                    _cache.move_to_end(user_id)
+                    return hit[1]
+            rows = store.report_months(date.fromisoformat(months[0] + "-01"))
+    except DatabaseUnavailable:
+        with _lock:
+            hit = _cache.get(user_id)
+        if hit is None:
+            raise
+        return hit[1]
+
+    blob = _encode(build_report(currency or DEFAULT_CURRENCY, months, rows))
+    with _lock:
+        _cache[user_id] = (key, blob)
+        _cache.move_to_end(user_id)
+        while len(_cache) > REPORT_CACHE_USERS:
+            _cache.popitem(last=False)
+    return blob
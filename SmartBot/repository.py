@@ -0,0 +1,303 @@
+# repository.py
+import os
+import threading
+from abc import ABC, abstractmethod
+
+# Storage backend for everything the handlers do: "postgres" (default;
+# DB_* settings, shards and replicas) or "sqlite" (one local file in WAL
+# mode, SQLITE_PATH) for small single-node deployments.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "smartbot.db")
+
+_repo = None
+_repo_lock = threading.Lock()
+
+
+class UserStore(ABC):
+    """
+    One user's data inside one unit of work: a transaction for
+    Repository.write(), a read-only snapshot for Repository.read().
+    Amounts come back as Decimal and timestamps as aware datetimes.
+    """
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+
+    # users / categories
+    @abstractmethod
+    def upsert_user(self, first_name: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def ensure_default_categories(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def categories(self) -> list:
+        """[(id, name)] ordered by name."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def category_id(self, name: str) -> int:
+        """Id of the named category (database.category_key), created if missing."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def rename_category(self, category_id: int, name: str) -> bool:
+        """False if the user has no such category."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def merge_categories(self, source_ids, target_id: int) -> tuple:
+        """
+        Move the sources' expenses, budgets (amounts of one month added up)
+        and recurring rules to the target and delete the sources; daily
+        spend follows. Returns (categories merged, expenses moved).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def base_currency(self):
+        """The user's base currency code, or None for the default."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def timezone(self):
+        """The user's IANA time zone name, or None if there is no such user."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_timezone(self, name: str):
+        raise NotImplementedError
+
+    # expenses
+    @abstractmethod
+    def add_expense(self, category_id, amount, description, is_anomaly=False,
+                    currency=None, base_amount=None) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_expenses(self, rows) -> list:
+        """rows: (category_id, amount, description, is_anomaly, currency, base_amount)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_expenses(self, ids) -> list:
+        """Delete by id; returns the ids that existed."""
+        raise NotImplementedError
+
+    # bulk edits (see bulk.py)
+    @abstractmethod
+    def change_expenses(self, selector: dict, action: str, value, limit: int) -> list:
+        """
+        Delete ('delete'), re-categorize ('move', value = category id) or
+        re-price ('amount', value = new amount) the selected expenses and
+        return their previous rows (bulk.EXPENSE_COLUMNS). If more than
+        `limit` are selected, nothing changes and limit + 1 rows come back.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def restore_expenses(self, rows) -> int:
+        """Re-insert deleted rows (bulk.EXPENSE_COLUMNS) under their old ids; returns how many."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def revert_expenses(self, rows) -> int:
+        """Put back (id, category_id, amount, base_amount); returns how many still existed."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_undo(self, action: str, data: bytes):
+        """Replace the user's undo record."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def take_undo(self):
+        """Remove and return the undo record as (action, data, created_at), or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def recent_expenses(self, limit: int) -> list:
+        """[(id, amount, category, description, date, currency)], newest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def export_expenses(self, after_id: int, limit: int) -> list:
+        """[(id, date, day, category, amount, currency, description)] with id > after_id, by id."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def recent_descriptions(self, limit: int) -> list:
+        """[(category_id, category, description)] with non-empty descriptions, newest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def month_spend(self, period) -> tuple:
+        """(total, [(category, amount)] largest first) in the base currency for month `period`."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def search(self, query: str, after, limit: int) -> list:
+        """
+        [(id, amount, category, description, date, score)] best match first;
+        `after` is the (score, id) keyset of the previous page or None.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def report_version(self) -> tuple:
+        """
+        (data_version, base currency or None). data_version goes up with
+        every write to the user's expenses or budgets.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def report_months(self, since) -> list:
+        """
+        [(category or None, 'YYYY-MM', spent, budget)] per category and
+        month from `since` on; spent in the base currency, budget 0 if unset.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def digest(self):
+        """The user's digest setting: 'daily', 'weekly' or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_digest(self, mode):
+        raise NotImplementedError
+
+    # budgets
+    @abstractmethod
+    def set_budget(self, category_id, amount, period):
+        raise NotImplementedError
+
+    @abstractmethod
+    def budget_items(self, period) -> list:
+        """[(category, amount, used, projected, overrun_date)] ordered by category."""
+        raise NotImplementedError
+
+    # WebApp idempotency (see idempotency.py)
+    @abstractmethod
+    def claim_request(self, key):
+        """None if `key` is claimed now, else the reply stored with it."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def finish_request(self, key, reply: str):
+        raise NotImplementedError
+
+    # recurring rules (see recurring.py)
+    @abstractmethod
+    def add_rule(self, category_id, amount, currency, description, frequency, step, start) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_rules(self) -> list:
+        """Active rules: [(id, amount, currency, category, description, frequency, next_due)]."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def stop_rule(self, rule_id: int) -> bool:
+        raise NotImplementedError
+
+
+class Repository(ABC):
+    """Storage backend: per-user units of work plus the non-user operations."""
+
+    name = None
+    # Nightly forecasts, anomaly baselines and expense archiving need the
+    # Postgres aggregates.
+    analytics_jobs = False
+
+    @abstractmethod
+    def setup(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def write(self, user_id: int):
+        """Context manager yielding a UserStore; committed on success."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def read(self, user_id: int):
+        """Context manager yielding a read-only UserStore."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def warm_pool(self) -> int:
+        """Open connections and prepare statements ahead of the first update."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def recent_users(self, since, limit: int) -> list:
+        """Ids of up to `limit` users with expenses since `since`, most recent first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def fx_rate(self, currency: str, day):
+        """Latest per-USD rate on or before `day`, or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def currencies(self) -> set:
+        """Codes with at least one rate."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_rates(self, csv_text: str) -> int:
+        """Upsert date,currency,per_usd CSV rows (no header)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_base_currency(self, user_id: int, code: str, old: str):
+        """Switch the base currency and re-convert stored amounts and this month's budgets."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def prune_requests(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def rollover_budgets(self, period=None) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def materialize_recurring(self, today=None, user_id=None) -> tuple:
+        """Write due recurring occurrences; returns (rules, expenses)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def digest_chunks(self, run_key, modes, window, chunk_size: int):
+        """
+        Yield (marker, rows) for users whose digest is in `modes` and not yet
+        sent in run `run_key`, chunk_size users at a time, where rows are
+        (user_id, currency, day, week, month, month_budget) and `window` is
+        (day, week_start, month_start). Pass each marker to
+        digest_checkpoint() once its chunk has been sent.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def digest_checkpoint(self, run_key, marker):
+        raise NotImplementedError
+
+
+def get_repository() -> Repository:
+    """The configured backend (created on first use)."""
+    global _repo
+    if _repo is None:
+        with _repo_lock:
+            if _repo is None:
+                if STORAGE_BACKEND == "sqlite":
+                    from sqlite_repository import SQLiteRepository
+                    _repo = SQLiteRepository(SQLITE_PATH)
+                elif STORAGE_BACKEND == "postgres":
+                    from pg_repository import PostgresRepository
+                    _repo = PostgresRepository()
+                else:
+                    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+    return _repo
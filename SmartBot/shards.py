@@ -0,0 +1,180 @@
+# shards.py
+import io
+import sys
+import time
+import logging
+
+import database
+from database import (
+    SHARD_MAP_TTL,
+    get_db_connection,
+    fan_out,
+    home_shard,
+    shard_count,
+    shard_for,
+)
+
+# Per-user tables in foreign-key order. Everything a user owns lives on
+# one shard, so moving a user is a copy of these rows and a directory flip.
+USER_TABLES = (
+    "users",
+    "categories",
+    "recurring_rules",
+    "expenses",
+    "expense_archive",
+    "budgets",
+    "daily_spend",
+    "budget_forecasts",
+    "category_baselines",
+    "webapp_requests",
+    "bulk_undo",
+)
+
+
+def _columns(cur, table: str):
+    cur.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position
+        """,
+        (table,),
+    )
+    return ", ".join(r[0] for r in cur.fetchall())
+
+
+def _set_directory(user_id: int, shard: int, moving: bool):
+    with get_db_connection(shard=0) as conn:
+        with conn.cursor() as cur:
+            if shard == home_shard(user_id) and not moving:
+                cur.execute("DELETE FROM user_shards WHERE user_id = %s", (user_id,))
+            else:
+                cur.execute(
+                    """
+                    INSERT INTO user_shards (user_id, shard, moving) VALUES (%s, %s, %s)
+                    ON CONFLICT (user_id) DO UPDATE SET shard = EXCLUDED.shard, moving = EXCLUDED.moving
+                    """,
+                    (user_id, shard, moving),
+                )
+    database._shard_map = (float("-inf"), {}, frozenset())
+
+
+def _delete_user(cur, user_id: int):
+    cur.execute("DELETE FROM webapp_requests WHERE user_id = %s", (user_id,))
+    cur.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
+
+
+def _copy_user(user_id: int, source: int, target: int) -> dict:
+    """
+    Stream the user's rows from one consistent snapshot on `source` into
+    `target` with COPY, replacing leftovers of an earlier attempt, and check
+    row counts and the expense total before committing.
+    """
+    uid = int(user_id)
+    with get_db_connection(shard=target) as conn:
+        with conn.cursor() as cur:
+            columns = {t: _columns(cur, t) for t in USER_TABLES}
+
+    buffers, counts = {}, {}
+    with get_db_connection(shard=source) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            for table in USER_TABLES:
+                buf = io.StringIO()
+                cur.copy_expert(
+                    f"COPY (SELECT {columns[table]} FROM {table} WHERE user_id = {uid}) TO STDOUT", buf
+                )
+                buf.seek(0)
+                buffers[table] = buf
+                counts[table] = buf.getvalue().count("\n")
+            cur.execute("SELECT COALESCE(SUM(amount), 0) FROM expenses WHERE user_id = %s", (uid,))
+            total = cur.fetchone()[0]
+
+    with get_db_connection(shard=target) as conn:
+        with conn.cursor() as cur:
+            _delete_user(cur, uid)
+            for table in USER_TABLES:
+                cur.copy_expert(f"COPY {table} ({columns[table]}) FROM STDIN", buffers[table])
+                cur.execute(f"SELECT COUNT(*) FROM {table} WHERE user_id = %s", (uid,))
+                copied = cur.fetchone()[0]
+                if copied != counts[table]:
+                    raise RuntimeError(f"{table}: copied {copied} of {counts[table]} rows")
+            cur.execute("SELECT COALESCE(SUM(amount), 0) FROM expenses WHERE user_id = %s", (uid,))
+            if cur.fetchone()[0] != total:
+                raise RuntimeError("expense totals differ after copy")
+    return counts
+
+
+def move_user(user_id: int, target: int, settle: float = None) -> dict:
+    """
+    Move one user to shard `target` while the bot keeps running.
+
+    1. Mark the user as moving: their writes fail fast (reads still work)
+       once every process has refreshed its shard map (`settle` seconds).
+    2. Copy and verify their rows on the target in one transaction.
+    3. Point the directory at the target, wait for it to propagate, then
+       delete the rows from the source.
+    A failure before step 3 unfreezes the user on the source; rerunning
+    the move replaces whatever reached the target.
+    """
+    if not 0 <= target < shard_count():
+        raise ValueError(f"no shard {target}")
+    settle = SHARD_MAP_TTL + 1 if settle is None else settle
+    source = shard_for(user_id)
+    if source == target:
+        return {}
+
+    _set_directory(user_id, source, moving=True)
+    time.sleep(settle)
+    try:
+        counts = _copy_user(user_id, source, target)
+    except Exception:
+        _set_directory(user_id, source, moving=False)
+        raise
+
+    _set_directory(user_id, target, moving=False)
+    time.sleep(settle)
+    with get_db_connection(shard=source) as conn:
+        with conn.cursor() as cur:
+            _delete_user(cur, user_id)
+    logging.info("Moved user %s from shard %s to %s: %s", user_id, source, target, counts)
+    return counts
+
+
+def _shard_stats(shard: int):
+    with get_db_connection(shard=shard) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT (SELECT COUNT(*) FROM users),
+                       (SELECT COUNT(*) FROM expenses),
+                       (SELECT COALESCE(SUM(amount), 0) FROM daily_spend)
+                """
+            )
+            return cur.fetchone()
+
+
+def shard_stats():
+    """Per-shard (users, expenses, spend) rows, gathered from all shards in parallel."""
+    return fan_out(_shard_stats)
+
+
+USAGE = """usage:
+  python shards.py where <user_id>
+  python shards.py move <user_id> <shard>
+  python shards.py stats"""
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = sys.argv[1:]
+    if args[:1] == ["where"] and len(args) == 2:
+        uid = int(args[1])
+        print(f"user {uid}: shard {shard_for(uid)} (hash shard {home_shard(uid)})")
+    elif args[:1] == ["move"] and len(args) == 3:
+        moved = move_user(int(args[1]), int(args[2]))
+        print("already there" if not moved else ", ".join(f"{t}: {n}" for t, n in moved.items()))
+    elif args == ["stats"]:
+        for i, (users, expenses, spend) in enumerate(shard_stats()):
+            print(f"shard {i}: {users} users, {expenses} expenses, {spend:.2f} spent")
+    else:
+        sys.exit(USAGE)
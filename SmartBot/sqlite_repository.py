@@ -0,0 +1,1032 @@
+# sqlite_repository.py
+import csv
+import io
+import re
+import sqlite3
+import logging
+import threading
+from calendar import monthrange
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+from database import DEFAULT_CATEGORIES, category_key, current_period, tidy_category_name
+from timezones import DEFAULT_TIMEZONE, EARLIEST_TIMEZONE, local_day
+from repository import Repository, UserStore
+from bulk import EXPENSE_COLUMNS, selection_sql
+from digest import DIGEST_JOB
+from jobs import ROLLOVER_JOB, rollover_periods
+from fx import DEFAULT_CURRENCY, PIVOT, FxError, rebase_currencies
+from recurring import BATCH_SIZE
+from idempotency import RETENTION_DAYS
+
+# Same word_similarity threshold as pg_trgm's %> operator.
+SEARCH_THRESHOLD = 0.6
+
+_CENT = Decimal("0.01")
+_WORD_RE = re.compile(r"[^\W_]+")
+_STEP_RE = re.compile(r"^(\d+) (day|month|year)s?$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    first_name TEXT,
+    base_currency TEXT,
+    digest TEXT,
+    data_version INTEGER NOT NULL DEFAULT 0,
+    timezone TEXT NOT NULL DEFAULT 'UTC'
+);
+
+CREATE INDEX IF NOT EXISTS users_digest_idx ON users (user_id) WHERE digest IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    UNIQUE (user_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS recurring_rules (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+    category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL,
+    amount DECIMAL NOT NULL,
+    currency TEXT,
+    description TEXT,
+    frequency TEXT NOT NULL,
+    step TEXT NOT NULL,
+    anchor DATE NOT NULL,
+    n_done INTEGER NOT NULL DEFAULT 0,
+    next_due DATE NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS recurring_rules_due_idx
+ON recurring_rules (next_due) WHERE active;
+
+CREATE TABLE IF NOT EXISTS expenses (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+    category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL,
+    amount DECIMAL NOT NULL,
+    description TEXT,
+    date TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    is_anomaly INTEGER NOT NULL DEFAULT 0,
+    currency TEXT,
+    base_amount DECIMAL,
+    recurring_rule_id INTEGER REFERENCES recurring_rules(id) ON DELETE SET NULL,
+    recurring_due DATE,
+    day DATE NOT NULL,
+    period_month DATE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS expenses_user_date_idx ON expenses (user_id, date);
+CREATE INDEX IF NOT EXISTS expenses_user_period_idx ON expenses (user_id, period_month);
+CREATE INDEX IF NOT EXISTS expenses_user_category_idx ON expenses (user_id, category_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS expenses_recurring_uniq
+ON expenses (recurring_rule_id, recurring_due)
+WHERE recurring_rule_id IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS budgets (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+    category_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
+    amount DECIMAL NOT NULL,
+    period_month DATE NOT NULL,
+    UNIQUE (user_id, category_id, period_month)
+);
+
+CREATE INDEX IF NOT EXISTS budgets_month_user_idx ON budgets (period_month, user_id);
+
+CREATE TABLE IF NOT EXISTS fx_rates (
+    currency TEXT NOT NULL,
+    rate_date DATE NOT NULL,
+    per_usd NUMERIC NOT NULL,
+    PRIMARY KEY (currency, rate_date)
+);
+
+CREATE TABLE IF NOT EXISTS job_checkpoints (
+    job_name TEXT NOT NULL,
+    run_key DATE NOT NULL,
+    last_user_id INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (job_name, run_key)
+);
+
+CREATE TABLE IF NOT EXISTS bulk_undo (
+    user_id INTEGER PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
+    action TEXT NOT NULL,
+    data BLOB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS webapp_requests (
+    user_id INTEGER NOT NULL,
+    idem_key TEXT NOT NULL,
+    response TEXT,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idem_key)
+);
+"""
+
+ADDED_COLUMNS = {
+    "users": {
+        "digest": "TEXT",
+        "data_version": "INTEGER NOT NULL DEFAULT 0",
+        "timezone": "TEXT NOT NULL DEFAULT 'UTC'",
+    },
+    "expenses": {"day": "DATE", "period_month": "DATE"},
+}
+
+
+def _money(value) -> Decimal:
+    return Decimal(str(value or 0)).quantize(_CENT, rounding=ROUND_HALF_UP)
+
+
+def _to_timestamp(value: datetime) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _from_timestamp(raw: bytes) -> datetime:
+    return datetime.fromisoformat(raw.decode()).replace(tzinfo=timezone.utc)
+
+
+# Amounts go in as text and come back as cents-quantized Decimals; expense
+# timestamps are stored as UTC text (CURRENT_TIMESTAMP format) so they sort
+# and compare against ISO dates.
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, _to_timestamp)
+sqlite3.register_converter("DECIMAL", lambda raw: _money(raw.decode()))
+sqlite3.register_converter("DATE", lambda raw: date.fromisoformat(raw.decode()))
+sqlite3.register_converter("TIMESTAMPTZ", _from_timestamp)
+
+
+def _trigrams(text: str) -> list:
+    """pg_trgm trigram sets of each word of `text`."""
+    grams = []
+    for word in _WORD_RE.findall(text.lower()):
+        padded = f"  {word} "
+        grams.append({padded[i:i + 3] for i in range(len(padded) - 2)})
+    return grams
+
+
+def word_similarity(query, text) -> float:
+    """
+    pg_trgm's word_similarity(): best overlap between the query's trigrams
+    and those of any run of consecutive words in `text`.
+    """
+    target = set().union(*_trigrams(query or ""))
+    words = _trigrams(text or "")
+    if not target or not words:
+        return 0.0
+    best = 0.0
+    for start in range(len(words)):
+        extent = set()
+        for grams in words[start:]:
+            extent |= grams
+            best = max(best, len(target & extent) / len(target | extent))
+            if not target - extent:
+                break
+    return best
+
+
+def _touch(conn, user_id: int):
+    """Bump the user's data_version (the Report WebApp cache key, see report.py)."""
+    conn.execute("UPDATE users SET data_version = data_version + 1 WHERE user_id = ?", (user_id,))
+
+
+def _timezone(conn, user_id: int) -> str:
+    row = conn.execute("SELECT timezone FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else DEFAULT_TIMEZONE
+
+
+def _add_step(anchor: date, step: str, k: int) -> date:
+    """anchor + k * step, clamped to month end like Postgres interval arithmetic."""
+    n, unit = _STEP_RE.match(step).groups()
+    n = int(n) * k
+    if unit == "day":
+        return anchor + timedelta(days=n)
+    months = anchor.month - 1 + (n * 12 if unit == "year" else n)
+    year, month = anchor.year + months // 12, months % 12 + 1
+    return date(year, month, min(anchor.day, monthrange(year, month)[1]))
+
+
+def _fx_rate(conn, currency: str, day):
+    """Latest per-USD rate on or before `day`, else the earliest one, as RATE_SQL."""
+    row = conn.execute(
+        """
+        SELECT per_usd FROM fx_rates
+        WHERE currency = ?
+        ORDER BY rate_date <= ? DESC,
+                 CASE WHEN rate_date <= ? THEN rate_date END DESC,
+                 rate_date
+        LIMIT 1
+        """,
+        (currency, day, day),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _per_usd(conn, currency: str, day) -> Decimal:
+    if currency == PIVOT:
+        return Decimal(1)
+    rate = _fx_rate(conn, currency, day)
+    if rate is None:
+        raise FxError(f"No exchange rate for {currency}")
+    return Decimal(str(rate))
+
+
+def _rebase(conn, amount, currency: str, base: str, day) -> Decimal:
+    if currency == base:
+        return amount
+    return _money(amount * _per_usd(conn, base, day) / _per_usd(conn, currency, day))
+
+
+def _rebase_user(conn, user_id: int, code: str, old: str):
+    period = current_period(_timezone(conn, user_id))
+    conn.execute("UPDATE users SET base_currency = ? WHERE user_id = ?", (code, user_id))
+    _touch(conn, user_id)
+    expenses = conn.execute(
+        "SELECT id, amount, currency, date FROM expenses WHERE user_id = ?", (user_id,)
+    ).fetchall()
+    conn.executemany(
+        "UPDATE expenses SET base_amount = ? WHERE id = ?",
+        [
+            (_rebase(conn, amount, currency or DEFAULT_CURRENCY, code, day.date()), exp_id)
+            for exp_id, amount, currency, day in expenses
+        ],
+    )
+    if old != code:
+        budgets = conn.execute(
+            "SELECT id, amount FROM budgets WHERE user_id = ? AND period_month >= ?",
+            (user_id, period),
+        ).fetchall()
+        today = date.today()
+        conn.executemany(
+            "UPDATE budgets SET amount = ? WHERE id = ?",
+            [(_rebase(conn, amount, old, code, today), budget_id) for budget_id, amount in budgets],
+        )
+
+
+class SQLiteUserStore(UserStore):
+    """UserStore over the calling thread's SQLite connection."""
+
+    def __init__(self, user_id: int, conn):
+        super().__init__(user_id)
+        self.conn = conn
+
+    def upsert_user(self, first_name):
+        self.conn.execute(
+            """
+            INSERT INTO users (user_id, first_name, timezone) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET first_name = excluded.first_name
+            """,
+            (self.user_id, first_name, DEFAULT_TIMEZONE),
+        )
+
+    def ensure_default_categories(self):
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO categories (user_id, name) VALUES (?, ?)",
+            [(self.user_id, name) for name in DEFAULT_CATEGORIES],
+        )
+
+    def categories(self):
+        return self.conn.execute(
+            "SELECT id, name FROM categories WHERE user_id = ? ORDER BY name", (self.user_id,)
+        ).fetchall()
+
+    def category_id(self, name):
+        # Matched in Python: SQLite's lower() only folds ASCII.
+        name = tidy_category_name(name)
+        key = name.lower()
+        matches = [
+            (cid, stored) for cid, stored in self.conn.execute(
+                "SELECT id, name FROM categories WHERE user_id = ? ORDER BY id", (self.user_id,)
+            )
+            if category_key(stored) == key
+        ]
+        if matches:
+            return next((cid for cid, stored in matches if stored == name), matches[0][0])
+        return self.conn.execute(
+            "INSERT INTO categories (user_id, name) VALUES (?, ?) RETURNING id", (self.user_id, name)
+        ).fetchone()[0]
+
+    def rename_category(self, category_id, name):
+        renamed = self.conn.execute(
+            "UPDATE categories SET name = ? WHERE id = ? AND user_id = ?",
+            (name, category_id, self.user_id),
+        ).rowcount > 0
+        if renamed:
+            _touch(self.conn, self.user_id)
+        return renamed
+
+    def merge_categories(self, source_ids, target_id):
+        # Same steps as pg_repository._MERGE_SQL; there is no daily_spend,
+        # forecast or baseline table here.
+        uid = self.user_id
+        owned = {cid for (cid,) in self.conn.execute(
+            "SELECT id FROM categories WHERE user_id = ?", (uid,)
+        )}
+        sources = [cid for cid in set(source_ids) if cid in owned and cid != target_id]
+        if target_id not in owned or not sources:
+            return 0, 0
+        marks = ", ".join("?" * len(sources))
+        moved = self.conn.execute(
+            f"UPDATE expenses SET category_id = ? WHERE user_id = ? AND category_id IN ({marks})",
+            (target_id, uid, *sources),
+        ).rowcount
+        self.conn.execute(
+            f"UPDATE recurring_rules SET category_id = ? WHERE user_id = ? AND category_id IN ({marks})",
+            (target_id, uid, *sources),
+        )
+        totals = {}
+        for period, amount in self.conn.execute(
+            f"""
+            SELECT period_month, amount FROM budgets
+            WHERE user_id = ? AND category_id IN ({marks}, ?)
+            """,
+            (uid, *sources, target_id),
+        ):
+            totals[period] = totals.get(period, Decimal(0)) + _money(amount)
+        self.conn.execute(
+            f"DELETE FROM budgets WHERE user_id = ? AND category_id IN ({marks})", (uid, *sources)
+        )
+        self.conn.executemany(
+            """
+            INSERT INTO budgets (user_id, category_id, amount, period_month)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, category_id, period_month)
+            DO UPDATE SET amount = excluded.amount
+            """,
+            [(uid, target_id, amount, period) for period, amount in totals.items()],
+        )
+        self.conn.execute(f"DELETE FROM categories WHERE id IN ({marks})", sources)
+        self.conn.execute("DELETE FROM bulk_undo WHERE user_id = ?", (uid,))
+        _touch(self.conn, uid)
+        return len(sources), moved
+
+    def base_currency(self):
+        row = self.conn.execute(
+            "SELECT base_currency FROM users WHERE user_id = ?", (self.user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def timezone(self):
+        row = self.conn.execute(
+            "SELECT timezone FROM users WHERE user_id = ?", (self.user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_timezone(self, name):
+        self.conn.execute("UPDATE users SET timezone = ? WHERE user_id = ?", (name, self.user_id))
+
+    def add_expense(self, category_id, amount, description, is_anomaly=False,
+                    currency=None, base_amount=None):
+        _touch(self.conn, self.user_id)
+        now = datetime.now(timezone.utc)
+        day = local_day(now, _timezone(self.conn, self.user_id))
+        return self.conn.execute(
+            """
+            INSERT INTO expenses (user_id, category_id, amount, description, is_anomaly,
+                                  currency, base_amount, date, day, period_month)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING id
+            """,
+            (
+                self.user_id, category_id, _money(amount), description, bool(is_anomaly),
+                currency, _money(amount if base_amount is None else base_amount),
+                now, day, day.replace(day=1),
+            ),
+        ).fetchone()[0]
+
+    def add_expenses(self, rows):
+        return [self.add_expense(*row) for row in rows]
+
+    def delete_expenses(self, ids):
+        ids = list(ids)
+        if not ids:
+            return []
+        _touch(self.conn, self.user_id)
+        marks = ", ".join("?" * len(ids))
+        return [
+            r[0]
+            for r in self.conn.execute(
+                f"DELETE FROM expenses WHERE user_id = ? AND id IN ({marks}) RETURNING id",
+                [self.user_id] + ids,
+            ).fetchall()
+        ]
+
+    def change_expenses(self, selector, action, value, limit):
+        # Rows are picked and changed in one BEGIN IMMEDIATE transaction;
+        # there is no daily_spend to adjust on this backend.
+        where, params = selection_sql(selector, ":{}", like="LIKE")
+        old = self.conn.execute(
+            f"""
+            SELECT {", ".join("e." + c for c in EXPENSE_COLUMNS)}
+            FROM expenses e
+            WHERE e.user_id = :uid AND {where}
+            ORDER BY e.id
+            LIMIT :limit
+            """,
+            dict(params, uid=self.user_id, limit=limit + 1),
+        ).fetchall()
+        if not old or len(old) > limit:
+            return old
+        _touch(self.conn, self.user_id)
+        if action == "delete":
+            self.conn.executemany("DELETE FROM expenses WHERE id = ?", [(r[0],) for r in old])
+        elif action == "move":
+            self.conn.executemany(
+                "UPDATE expenses SET category_id = ? WHERE id = ?", [(value, r[0]) for r in old]
+            )
+        else:
+            amount, base = EXPENSE_COLUMNS.index("amount"), EXPENSE_COLUMNS.index("base_amount")
+            self.conn.executemany(
+                "UPDATE expenses SET amount = ?, base_amount = ? WHERE id = ?",
+                [
+                    (_money(value),
+                     _money(value if r[base] is None or not r[amount] else r[base] * value / r[amount]),
+                     r[0])
+                    for r in old
+                ],
+            )
+        return old
+
+    def restore_expenses(self, rows):
+        _touch(self.conn, self.user_id)
+        tz = _timezone(self.conn, self.user_id)
+        cur = self.conn.executemany(
+            """
+            INSERT OR IGNORE INTO expenses (id, user_id, category_id, amount, description, date,
+                                            is_anomaly, currency, base_amount, recurring_rule_id,
+                                            recurring_due, day, period_month)
+            VALUES (?, ?, (SELECT id FROM categories WHERE id = ? AND user_id = ?), ?, ?, ?, ?, ?, ?,
+                    (SELECT id FROM recurring_rules WHERE id = ? AND user_id = ?), ?, ?, ?)
+            """,
+            [
+                (exp_id, self.user_id, category_id, self.user_id, amount, description, when,
+                 is_anomaly, currency, base_amount, rule_id, self.user_id, due,
+                 local_day(when, tz), local_day(when, tz).replace(day=1))
+                for (exp_id, category_id, amount, description, when, is_anomaly, currency,
+                     base_amount, rule_id, due) in rows
+            ],
+        )
+        return cur.rowcount
+
+    def revert_expenses(self, rows):
+        _touch(self.conn, self.user_id)
+        cur = self.conn.executemany(
+            """
+            UPDATE expenses
+            SET category_id = (SELECT id FROM categories WHERE id = ? AND user_id = ?),
+                amount = ?, base_amount = ?
+            WHERE id = ? AND user_id = ?
+            """,
+            [
+                (category_id, self.user_id, amount, base_amount, exp_id, self.user_id)
+                for exp_id, category_id, amount, base_amount in rows
+            ],
+        )
+        return cur.rowcount
+
+    def save_undo(self, action, data):
+        self.conn.execute(
+            """
+            INSERT INTO bulk_undo (user_id, action, data) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE
+            SET action = excluded.action, data = excluded.data, created_at = CURRENT_TIMESTAMP
+            """,
+            (self.user_id, action, data),
+        )
+
+    def take_undo(self):
+        return self.conn.execute(
+            "DELETE FROM bulk_undo WHERE user_id = ? RETURNING action, data, created_at",
+            (self.user_id,),
+        ).fetchone()
+
+    def recent_expenses(self, limit):
+        return self.conn.execute(
+            """
+            SELECT e.id, e.amount, c.name, e.description, e.date, e.currency
+            FROM expenses e
+            LEFT JOIN categories c ON e.category_id = c.id
+            WHERE e.user_id = ?
+            ORDER BY e.date DESC, e.id DESC
+            LIMIT ?
+            """,
+            (self.user_id, limit),
+        ).fetchall()
+
+    def export_expenses(self, after_id, limit):
+        return self.conn.execute(
+            """
+            SELECT e.id, e.date, e.day, c.name, e.amount, e.currency, e.description
+            FROM expenses e
+            LEFT JOIN categories c ON c.id = e.category_id
+            WHERE e.user_id = ? AND e.id > ?
+            ORDER BY e.id
+            LIMIT ?
+            """,
+            (self.user_id, after_id, limit),
+        ).fetchall()
+
+    def recent_descriptions(self, limit):
+        return self.conn.execute(
+            """
+            SELECT e.category_id, c.name, e.description
+            FROM expenses e
+            JOIN categories c ON e.category_id = c.id
+            WHERE e.user_id = ? AND e.description <> ''
+            ORDER BY e.date DESC, e.id DESC
+            LIMIT ?
+            """,
+            (self.user_id, limit),
+        ).fetchall()
+
+    def month_spend(self, period):
+        # No daily_spend here: sum base amounts straight from the month's expenses.
+        total = self.conn.execute(
+            "SELECT SUM(COALESCE(base_amount, amount)) FROM expenses WHERE user_id = ? AND period_month = ?",
+            (self.user_id, period),
+        ).fetchone()[0]
+        rows = self.conn.execute(
+            """
+            SELECT c.name, SUM(COALESCE(e.base_amount, e.amount)) AS spent
+            FROM expenses e
+            JOIN categories c ON e.category_id = c.id
+            WHERE e.user_id = ? AND e.period_month = ?
+            GROUP BY c.name
+            ORDER BY spent DESC, c.name
+            """,
+            (self.user_id, period),
+        ).fetchall()
+        return _money(total), [(name, _money(spent)) for name, spent in rows]
+
+    def search(self, query, after, limit):
+        # Same scoring and keyset as the Postgres query, without an index:
+        # word_similarity() is evaluated per row of this user's expenses.
+        where = "r.score >= :min"
+        params = {"uid": self.user_id, "q": query, "limit": limit, "min": SEARCH_THRESHOLD}
+        if after:
+            where += " AND (r.score, r.id) < (:score, :id)"
+            params.update(score=float(after[0]), id=after[1])
+        rows = self.conn.execute(
+            f"""
+            SELECT r.id, r.amount, r.name, r.description, r.date, r.score
+            FROM (
+                SELECT e.id, e.amount, c.name, e.description, e.date,
+                       ROUND(MAX(word_similarity(:q, COALESCE(e.description, '')),
+                                 word_similarity(:q, COALESCE(c.name, ''))), 4) AS score
+                FROM expenses e
+                LEFT JOIN categories c ON e.category_id = c.id
+                WHERE e.user_id = :uid
+            ) r
+            WHERE {where}
+            ORDER BY r.score DESC, r.id DESC
+            LIMIT :limit
+            """,
+            params,
+        ).fetchall()
+        return [row[:5] + (Decimal(str(row[5])),) for row in rows]
+
+    def report_version(self):
+        row = self.conn.execute(
+            "SELECT data_version, base_currency FROM users WHERE user_id = ?", (self.user_id,)
+        ).fetchone()
+        return row or (0, None)
+
+    def report_months(self, since):
+        rows = self.conn.execute(
+            """
+            SELECT c.name, x.month, SUM(x.spent), SUM(x.budget)
+            FROM (
+                SELECT category_id, substr(period_month, 1, 7) AS month,
+                       COALESCE(base_amount, amount) AS spent, 0 AS budget
+                FROM expenses
+                WHERE user_id = :uid AND period_month >= :since
+                UNION ALL
+                SELECT category_id, substr(period_month, 1, 7), 0, amount
+                FROM budgets
+                WHERE user_id = :uid AND period_month >= :since
+            ) x
+            LEFT JOIN categories c ON c.id = x.category_id
+            GROUP BY c.name, x.month
+            ORDER BY c.name, x.month
+            """,
+            {"uid": self.user_id, "since": since},
+        ).fetchall()
+        return [(name, month, _money(spent), _money(budget)) for name, month, spent, budget in rows]
+
+    def digest(self):
+        row = self.conn.execute("SELECT digest FROM users WHERE user_id = ?", (self.user_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_digest(self, mode):
+        self.conn.execute("UPDATE users SET digest = ? WHERE user_id = ?", (mode, self.user_id))
+
+    def set_budget(self, category_id, amount, period):
+        _touch(self.conn, self.user_id)
+        self.conn.execute(
+            """
+            INSERT INTO budgets (user_id, category_id, amount, period_month)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, category_id, period_month)
+            DO UPDATE SET amount = excluded.amount
+            """,
+            (self.user_id, category_id, _money(amount), period),
+        )
+
+    def budget_items(self, period):
+        # No forecast job on this backend: projected/overrun_date stay NULL.
+        rows = self.conn.execute(
+            """
+            SELECT c.name, b.amount,
+                   (SELECT SUM(COALESCE(e.base_amount, e.amount))
+                    FROM expenses e
+                    WHERE e.user_id = b.user_id
+                      AND e.period_month = b.period_month
+                      AND e.category_id = b.category_id) AS used
+            FROM budgets b
+            JOIN categories c ON b.category_id = c.id
+            WHERE b.user_id = ? AND b.period_month = ?
+            ORDER BY c.name
+            """,
+            (self.user_id, period),
+        ).fetchall()
+        return [(name, amount, _money(used), None, None) for name, amount, used in rows]
+
+    def claim_request(self, key):
+        if not key:
+            return None
+        claimed = self.conn.execute(
+            """
+            INSERT INTO webapp_requests (user_id, idem_key) VALUES (?, ?)
+            ON CONFLICT (user_id, idem_key) DO NOTHING
+            RETURNING idem_key
+            """,
+            (self.user_id, key),
+        ).fetchone()
+        if claimed:
+            return None
+        row = self.conn.execute(
+            "SELECT response FROM webapp_requests WHERE user_id = ? AND idem_key = ?",
+            (self.user_id, key),
+        ).fetchone()
+        return (row[0] if row else None) or ""
+
+    def finish_request(self, key, reply):
+        if not key:
+            return
+        self.conn.execute(
+            "UPDATE webapp_requests SET response = ? WHERE user_id = ? AND idem_key = ?",
+            (reply, self.user_id, key),
+        )
+
+    def add_rule(self, category_id, amount, currency, description, frequency, step, start):
+        return self.conn.execute(
+            """
+            INSERT INTO recurring_rules (user_id, category_id, amount, currency, description,
+                                         frequency, step, anchor, next_due)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING id
+            """,
+            (self.user_id, category_id, _money(amount), currency, description, frequency, step,
+             start, start),
+        ).fetchone()[0]
+
+    def list_rules(self):
+        return self.conn.execute(
+            """
+            SELECT r.id, r.amount, r.currency, c.name, r.description, r.frequency, r.next_due
+            FROM recurring_rules r
+            LEFT JOIN categories c ON r.category_id = c.id
+            WHERE r.user_id = ? AND r.active
+            ORDER BY r.next_due, r.id
+            """,
+            (self.user_id,),
+        ).fetchall()
+
+    def stop_rule(self, rule_id):
+        cur = self.conn.execute(
+            "UPDATE recurring_rules SET active = 0 WHERE id = ? AND user_id = ? AND active",
+            (rule_id, self.user_id),
+        )
+        return cur.rowcount > 0
+
+
+class SQLiteRepository(Repository):
+    """
+    One local SQLite file in WAL mode: readers never block the single
+    writer, and writes take the lock up front (BEGIN IMMEDIATE) so two
+    handlers can't deadlock upgrading a read. Each thread keeps its own
+    connection.
+    """
+
+    name = "sqlite"
+    analytics_jobs = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=30,
+                isolation_level=None,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+            )
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            conn.create_function("word_similarity", 2, word_similarity, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self, begin: str):
+        conn = self._connect()
+        conn.execute(begin)
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception as error:
+            if not isinstance(error, ValueError):
+                logging.exception("Database error occurred.")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    def setup(self):
+        try:
+            conn = self._connect()
+            # Columns added after a table first shipped (Postgres gets them
+            # from migrations/); must exist before SCHEMA indexes them.
+            added = set()
+            for table, columns in ADDED_COLUMNS.items():
+                existing = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+                for column, decl in columns.items():
+                    if existing and column not in existing:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+                        added.add(f"{table}.{column}")
+            if "expenses.day" in added:
+                # Timestamps are UTC, as is every existing user's zone.
+                conn.execute(
+                    "UPDATE expenses SET day = date(date), period_month = strftime('%Y-%m-01', date)"
+                )
+            conn.executescript(SCHEMA)
+            logging.info("Database setup successful: Tables checked/created (%s).", self.path)
+        except Exception:
+            logging.exception("FATAL: Could not set up database.")
+
+    @contextmanager
+    def write(self, user_id):
+        with self._transaction("BEGIN IMMEDIATE") as conn:
+            yield SQLiteUserStore(user_id, conn)
+
+    @contextmanager
+    def read(self, user_id):
+        with self._transaction("BEGIN") as conn:
+            yield SQLiteUserStore(user_id, conn)
+
+    def warm_pool(self):
+        # Connections are per thread and sqlite3 caches compiled statements
+        # itself; opening this thread's connection is all there is to do.
+        self._connect()
+        return 1
+
+    def recent_users(self, since, limit):
+        with self._transaction("BEGIN") as conn:
+            rows = conn.execute(
+                """
+                SELECT user_id, MAX(date) AS last_seen
+                FROM expenses
+                WHERE date >= ?
+                GROUP BY user_id
+                ORDER BY last_seen DESC
+                LIMIT ?
+                """,
+                (since, limit),
+            ).fetchall()
+        return [uid for uid, _ in rows]
+
+    def digest_chunks(self, run_key, modes, window, chunk_size):
+        day, week_start, month_start = window
+        modes = list(modes)
+        marks = ", ".join("?" * len(modes))
+        with self._transaction("BEGIN IMMEDIATE") as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO job_checkpoints (job_name, run_key) VALUES (?, ?)",
+                (DIGEST_JOB, run_key),
+            )
+            last_user_id, done = conn.execute(
+                "SELECT last_user_id, done FROM job_checkpoints WHERE job_name = ? AND run_key = ?",
+                (DIGEST_JOB, run_key),
+            ).fetchone()
+        while not done:
+            with self._transaction("BEGIN") as conn:
+                rows = conn.execute(
+                    f"""
+                    WITH u AS (
+                        SELECT user_id, COALESCE(base_currency, ?) AS currency
+                        FROM users
+                        WHERE digest IN ({marks}) AND user_id > ?
+                        ORDER BY user_id
+                        LIMIT ?
+                    ), spend AS (
+                        SELECT e.user_id,
+                               SUM(CASE WHEN e.day = ? THEN COALESCE(e.base_amount, e.amount) END) AS d,
+                               SUM(CASE WHEN e.day >= ? THEN COALESCE(e.base_amount, e.amount) END) AS w,
+                               SUM(CASE WHEN e.day >= ? THEN COALESCE(e.base_amount, e.amount) END) AS m
+                        FROM expenses e
+                        JOIN u ON u.user_id = e.user_id
+                        WHERE e.day >= ? AND e.day <= ?
+                        GROUP BY e.user_id
+                    ), budget AS (
+                        SELECT b.user_id, SUM(b.amount) AS amount
+                        FROM budgets b
+                        JOIN u ON u.user_id = b.user_id
+                        WHERE b.period_month = ?
+                        GROUP BY b.user_id
+                    )
+                    SELECT u.user_id, u.currency, s.d, s.w, s.m, b.amount
+                    FROM u
+                    LEFT JOIN spend s ON s.user_id = u.user_id
+                    LEFT JOIN budget b ON b.user_id = u.user_id
+                    ORDER BY u.user_id
+                    """,
+                    [DEFAULT_CURRENCY, *modes, last_user_id, chunk_size,
+                     day, week_start, month_start, min(week_start, month_start), day, month_start],
+                ).fetchall()
+            done = len(rows) < chunk_size
+            if rows:
+                last_user_id = rows[-1][0]
+            yield (0, last_user_id, done), [
+                (uid, currency, _money(d), _money(w), _money(m), None if budget is None else _money(budget))
+                for uid, currency, d, w, m, budget in rows
+            ]
+
+    def digest_checkpoint(self, run_key, marker):
+        _, last_user_id, done = marker
+        with self._transaction("BEGIN IMMEDIATE") as conn:
+            conn.execute(
+                """
+                UPDATE job_checkpoints
+                SET last_user_id = ?, done = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE job_name = ? AND run_key = ?
+                """,
+                (last_user_id, done, DIGEST_JOB, run_key),
+            )
+
+    def fx_rate(self, currency, day):
+        with self._transaction("BEGIN") as conn:
+            return _fx_rate(conn, currency, day)
+
+    def currencies(self):
+        with self._transaction("BEGIN") as conn:
+            return {r[0] for r in conn.execute("SELECT DISTINCT currency FROM fx_rates")}
+
+    def load_rates(self, csv_text):
+        rows = [
+            (date.fromisoformat(day.strip()), code.strip().upper(), Decimal(rate.strip()))
+            for day, code, rate in csv.reader(io.StringIO(csv_text))
+        ]
+        with self._transaction("BEGIN IMMEDIATE") as conn:
+            conn.executemany(
+                """
+                INSERT INTO fx_rates (rate_date, currency, per_usd) VALUES (?, ?, ?)
+                ON CONFLICT (currency, rate_date) DO UPDATE SET per_usd = excluded.per_usd
+                """,
+                rows,
+            )
+        return len(rows)
+
+    def set_base_currency(self, user_id, code, old):
+        """Re-converts row by row (a single-node database is small enough for that)."""
+        with self._transaction("BEGIN IMMEDIATE") as conn:
+            needed = rebase_currencies(
+                [r[0] for r in conn.execute(
+                    "SELECT DISTINCT COALESCE(currency, ?) FROM expenses WHERE user_id = ?",
+                    (DEFAULT_CURRENCY, user_id),
+                )],
+                code, old,
+            )
+            missing = needed - {r[0] for r in conn.execute("SELECT DISTINCT currency FROM fx_rates")}
+            if not missing:
+                _rebase_user(conn, user_id, code, old)
+        if missing:
+            raise FxError(f"No exchange rate for {', '.join(sorted(missing))}")
+
+    def prune_requests(self):
+        with self._transaction("BEGIN IMMEDIATE") as conn:
+            cur = conn.execute(
+                "DELETE FROM webapp_requests WHERE created_at < datetime('now', ?)",
+                (f"-{RETENTION_DAYS} days",),
+            )
+            return cur.rowcount
+
+    def rollover_budgets(self, period=None):
+        """
+        One statement per month; budgets already set for a month win, so
+        re-runs are harmless. Months missed since the last finished run
+        are filled in first (jobs.rollover_periods).
+        """
+        period = period or current_period(EARLIEST_TIMEZONE)
+        created = 0
+        with self._transaction("BEGIN IMMEDIATE") as conn:
+            last_done = conn.execute(
+                "SELECT MAX(run_key) FROM job_checkpoints WHERE job_name = ? AND done AND run_key < ?",
+                (ROLLOVER_JOB, period),
+            ).fetchone()[0]
+            for month in rollover_periods(period, last_done and date.fromisoformat(last_done)):
+                cur = conn.execute(
+                    """
+                    INSERT INTO budgets (user_id, category_id, amount, period_month)
+                    SELECT user_id, category_id, amount, ? FROM budgets WHERE period_month = ?
+                    ON CONFLICT (user_id, category_id, period_month) DO NOTHING
+                    """,
+                    (month, _add_step(month, "1 month", -1)),
+                )
+                if cur.rowcount:
+                    created += cur.rowcount
+                    conn.execute(
+                        """
+                        UPDATE users SET data_version = data_version + 1
+                        WHERE user_id IN (SELECT user_id FROM budgets WHERE period_month = ?)
+                        """,
+                        (month,),
+                    )
+                conn.execute(
+                    """
+                    INSERT INTO job_checkpoints (job_name, run_key, done) VALUES (?, ?, 1)
+                    ON CONFLICT (job_name, run_key) DO UPDATE SET done = 1, updated_at = CURRENT_TIMESTAMP
+                    """,
+                    (ROLLOVER_JOB, month),
+                )
+        logging.info("Budget rollover to %s: %s budgets created", period, created)
+        return created
+
+    def materialize_recurring(self, today=None, user_id=None):
+        """
+        Same contract as recurring.materialize_due: every missed occurrence
+        is written, one transaction per batch, and the unique (rule, due
+        date) index makes overlapping runs no-ops.
+        """
+        today = today or date.today()
+        rules = created = 0
+        while True:
+            with self._transaction("BEGIN IMMEDIATE") as conn:
+                due = conn.execute(
+                    """
+                    SELECT r.id, r.user_id, r.category_id, r.amount, r.description, r.step,
+                           r.anchor, r.n_done,
+                           COALESCE(r.currency, :default),
+                           COALESCE(u.base_currency, :default)
+                    FROM recurring_rules r
+                    JOIN users u ON u.user_id = r.user_id
+                    WHERE r.active AND r.next_due <= :today
+                      AND (:uid IS NULL OR r.user_id = :uid)
+                    ORDER BY r.next_due, r.id
+                    LIMIT :batch
+                    """,
+                    {"default": DEFAULT_CURRENCY, "today": today, "uid": user_id, "batch": BATCH_SIZE},
+                ).fetchall()
+                for rule_id, uid, category_id, amount, desc, step, anchor, n_done, currency, base in due:
+                    _touch(conn, uid)
+                    k = n_done
+                    while (due_date := _add_step(anchor, step, k)) <= today:
+                        cur = conn.execute(
+                            """
+                            INSERT INTO expenses (user_id, category_id, amount, description, date,
+                                                  currency, base_amount, recurring_rule_id, recurring_due,
+                                                  day, period_month)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (recurring_rule_id, recurring_due)
+                            WHERE recurring_rule_id IS NOT NULL DO NOTHING
+                            """,
+                            (uid, category_id, amount, desc,
+                             datetime.combine(due_date, datetime.min.time()), currency,
+                             _rebase(conn, amount, currency, base, due_date), rule_id, due_date,
+                             due_date, due_date.replace(day=1)),
+                        )
+                        created += cur.rowcount
+                        k += 1
+                    conn.execute(
+                        "UPDATE recurring_rules SET n_done = ?, next_due = ? WHERE id = ?",
+                        (k, due_date, rule_id),
+                    )
+            rules += len(due)
+            if len(due) < BATCH_SIZE:
+                break
+        if user_id is None:
+            logging.info("Recurring expenses: %s rules due, %s expenses created", rules, created)
+        return rules, created
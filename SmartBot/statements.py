@@ -0,0 +1,117 @@
+# statements.py
+import psycopg2.extensions
+
+# The hot statements, PREPAREd once per connection and then run with
+# EXECUTE, so Postgres parses and plans them once instead of per call.
+# name -> (parameter types, SQL with $n placeholders).
+STATEMENTS = {
+    # Matched on database.category_key ($2), preferring the exact spelling
+    # ($3) among old near-duplicates.
+    "category_id": (
+        "bigint, text, text",
+        """
+        SELECT id FROM categories
+        WHERE user_id = $1 AND lower(regexp_replace(btrim(name), '\\s+', ' ', 'g')) = $2
+        ORDER BY name = $3 DESC, id
+        LIMIT 1
+        """,
+    ),
+    # One expense plus its daily_spend delta and the user's data_version
+    # bump (see database.insert_expense). Its day and month are today's in
+    # the user's time zone.
+    "insert_expense": (
+        "bigint, integer, numeric, text, boolean, char(3), numeric",
+        """
+        WITH u AS (
+            SELECT (CURRENT_TIMESTAMP AT TIME ZONE timezone)::date AS day
+            FROM users WHERE user_id = $1
+        ), ins AS (
+            INSERT INTO expenses (user_id, category_id, amount, description, is_anomaly,
+                                  currency, base_amount, day, period_month)
+            SELECT $1, $2, $3, $4, $5, $6, COALESCE($7, $3), day, date_trunc('month', day)::date
+            FROM u
+            RETURNING id, user_id, category_id, base_amount AS amount, day
+        ), agg AS (
+            INSERT INTO daily_spend (user_id, category_id, day, amount, n, log_sum, log_sumsq)
+            SELECT user_id, COALESCE(category_id, 0), day, amount, 1,
+                   LN(GREATEST(amount, 0.01)), POWER(LN(GREATEST(amount, 0.01)), 2)
+            FROM ins
+            ON CONFLICT (user_id, category_id, day)
+            DO UPDATE SET amount = daily_spend.amount + EXCLUDED.amount,
+                          n = daily_spend.n + EXCLUDED.n,
+                          log_sum = daily_spend.log_sum + EXCLUDED.log_sum,
+                          log_sumsq = daily_spend.log_sumsq + EXCLUDED.log_sumsq
+        ), ver AS (
+            UPDATE users SET data_version = data_version + 1 WHERE user_id = $1
+        )
+        SELECT id FROM ins
+        """,
+    ),
+    "recent_expenses": (
+        "bigint, integer",
+        """
+        SELECT e.id, e.amount, c.name, e.description, e.date, e.currency
+        FROM expenses e
+        LEFT JOIN categories c ON e.category_id = c.id
+        WHERE e.user_id = $1
+        ORDER BY e.date DESC, e.id DESC
+        LIMIT $2
+        """,
+    ),
+    # Budgets vs. spend for one month; projected/overrun_date come from the
+    # nightly forecast job (NULL until it ran).
+    "budget_items": (
+        "bigint, date",
+        """
+        SELECT c.name, b.amount,
+               COALESCE((
+                   SELECT SUM(d.amount)
+                   FROM daily_spend d
+                   WHERE d.user_id = b.user_id
+                     AND d.category_id = b.category_id
+                     AND d.day >= b.period_month
+                     AND d.day < (b.period_month + INTERVAL '1 month')
+               ), 0) AS used,
+               f.projected, f.overrun_date
+        FROM budgets b
+        JOIN categories c ON b.category_id = c.id
+        LEFT JOIN budget_forecasts f
+               ON f.user_id = b.user_id
+              AND f.category_id = b.category_id
+              AND f.period_month = b.period_month
+        WHERE b.user_id = $1 AND b.period_month = $2
+        ORDER BY c.name
+        """,
+    ),
+}
+
+
+class StatementConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers which STATEMENTS it has prepared."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def prepare(cur, name: str):
+    """PREPARE `name` on the cursor's connection unless it already is."""
+    conn = cur.connection
+    if name in conn.prepared:
+        return
+    types, sql = STATEMENTS[name]
+    # Prepared statements belong to the session: a later rollback keeps them.
+    cur.execute(f"PREPARE {name} ({types}) AS {sql}")
+    conn.prepared.add(name)
+
+
+def prepare_all(cur):
+    for name in STATEMENTS:
+        prepare(cur, name)
+
+
+def execute(cur, name: str, params=()):
+    """Run a registered statement by name; fetch results from `cur` as usual."""
+    prepare(cur, name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}", params)
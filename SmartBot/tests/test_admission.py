@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from telegram import Chat, Message, Update, User
+
+import admission
+from admission import AdmissionProcessor, classify
+
+
+def _update(user_id: int, text: str, update_id: int = 1) -> Update:
+    chat = Chat(user_id, "private")
+    user = User(user_id, "Test", False)
+    message = Message(update_id, datetime.now(timezone.utc), chat, from_user=user, text=text)
+    return Update(update_id, message=message)
+
+
+@pytest.fixture
+def busy(monkeypatch):
+    """Updates answered with BUSY_TEXT (the reply itself is not sent)."""
+    shed = []
+
+    async def reply_busy(update):
+        shed.append(update.update_id)
+
+    monkeypatch.setattr(admission, "_reply_busy", reply_busy)
+    return shed
+
+
+def test_classify():
+    assert classify(_update(1, "/report")) == "heavy"
+    assert classify(_update(1, "/search@SmartBot taxi")) == "read"
+    assert classify(_update(1, "Budget")) == "heavy"
+    assert classify(_update(1, "12 food lunch")) == "write"
+    assert classify(object()) == "write"
+
+
+def test_one_users_burst_is_shed_and_others_get_through(busy):
+    async def scenario():
+        processor = AdmissionProcessor({"write": (1, 8), "read": (1, 1), "heavy": (1, 1)}, user_queue=2)
+        release = asyncio.Event()
+        done = []
+
+        async def handler(update_id):
+            await release.wait()
+            done.append(update_id)
+
+        burst = [
+            asyncio.create_task(processor.do_process_update(_update(7, "1 food", i), handler(i)))
+            for i in range(1, 21)
+        ]
+        await asyncio.sleep(0)
+        # 1 running and 2 waiting behind it; the rest is shed at once.
+        assert busy == list(range(4, 21))
+        other = asyncio.create_task(processor.do_process_update(_update(8, "1 food", 100), handler(100)))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.wait_for(asyncio.gather(*burst, other), 1)
+        return done, processor
+
+    done, processor = asyncio.run(scenario())
+    assert sorted(done) == [1, 2, 3, 100]
+    assert processor.users == {}
+    assert all(lane.waiting == lane.running == 0 for lane in processor.lanes.values())
+
+
+def test_user_lock_waiters_fill_the_lane_queue(busy):
+    async def scenario():
+        processor = AdmissionProcessor({"write": (4, 1), "read": (1, 1), "heavy": (1, 1)}, user_queue=5)
+        release = asyncio.Event()
+
+        async def handler():
+            await release.wait()
+
+        tasks = [
+            asyncio.create_task(processor.do_process_update(_update(7, "1 food", i), handler()))
+            for i in (1, 2, 3)
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    # Update 2 waits on user 7's lock and fills the one-update write queue.
+    assert busy == [3]
@@ -0,0 +1,43 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+from bulk import BulkError, EXPENSE_COLUMNS, pack, parse_amount, parse_selection, unpack
+from database import MAX_AMOUNT, category_key
+
+CATEGORIES = {category_key("Food"): (7, "Food"), category_key("Eating out"): (8, "Eating out")}
+
+
+def test_ids_ranges_and_filters():
+    selector = parse_selection("12,15 25-20 cat=eating  OUT since=2026-10-01 until=2026-10-31 text=uber eats",
+                               CATEGORIES)
+    assert selector == {
+        "ids": [12, 15], "ranges": [(20, 25)], "category_id": 8,
+        "since": date(2026, 10, 1), "before": date(2026, 11, 1), "month": None, "text": "uber eats",
+    }
+    assert parse_selection("month=2026-09", CATEGORIES)["month"] == date(2026, 9, 1)
+
+
+@pytest.mark.parametrize("text", ["", "12 x", "cat=Rent", "since=yesterday", "text=", "month=2026-13"])
+def test_bad_selections(text):
+    with pytest.raises(BulkError):
+        parse_selection(text, CATEGORIES)
+
+
+def test_parse_amount():
+    assert parse_amount(" 1,234.5 ") == Decimal("1234.50")
+    for text in ("0", "-3", "1.234", "nan", f"{MAX_AMOUNT + 1}"):
+        with pytest.raises(BulkError):
+            parse_amount(text)
+
+
+def test_pack_round_trip():
+    when = datetime(2026, 10, 3, 12, 30, tzinfo=timezone.utc)
+    rows = [
+        (1, 7, Decimal("12.50"), "lunch", when, False, "EUR", Decimal("13.60"), None, None),
+        (2, None, Decimal("3"), None, when, True, None, None, 4, date(2026, 10, 1)),
+    ]
+    assert unpack("delete", pack("delete", rows)) == rows
+    index = [EXPENSE_COLUMNS.index(c) for c in ("id", "category_id", "amount", "base_amount")]
+    assert unpack("move", pack("move", rows)) == [tuple(row[i] for i in index) for row in rows]
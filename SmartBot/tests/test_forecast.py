@@ -0,0 +1,27 @@
+from datetime import date
+
+import numpy as np
+
+from forecast import NO_OVERRUN, project_month_end
+
+
+def test_run_rate_projection_and_overrun_day():
+    # 10 a day for the first 10 days of a 30-day month, no earlier history.
+    gid = np.zeros(10, dtype=np.int64)
+    offset = np.arange(-9, 1)
+    amount = np.full(10, 10.0)
+    today = date(2026, 4, 10)
+
+    projected, overrun = project_month_end(gid, offset, amount, np.array([250.0]), today)
+    assert projected.tolist() == [300.0] and overrun.tolist() == [15]
+    # No budget: no overrun; already over: the day it was crossed.
+    assert project_month_end(gid, offset, amount, np.array([0.0]), today)[1].tolist() == [NO_OVERRUN]
+    assert project_month_end(gid, offset, amount, np.array([50.0]), today)[1].tolist() == [-5]
+
+
+def test_groups_are_projected_separately():
+    gid = np.array([0, 1, 1])
+    offset = np.array([0, -1, 0])
+    amount = np.array([30.0, 5.0, 5.0])
+    projected, _ = project_month_end(gid, offset, amount, np.zeros(2), date(2026, 4, 30))
+    assert projected.tolist() == [30.0, 10.0]
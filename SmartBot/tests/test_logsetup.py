@@ -0,0 +1,26 @@
+import json
+import logging
+
+from logsetup import Redacted, SampleFilter, parse_sampling
+
+
+def _record(name: str, level: int) -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, "message", None, None)
+
+
+def test_redacted_masks_all_but_safe_keys():
+    shown = json.loads(str(Redacted({"type": "expense.add", "amount": 12, "description": "rent"})))
+    assert shown == {"type": "expense.add", "amount": "***", "description": "***"}
+    assert str(Redacted(["not", "a", "dict"])) == "<list>"
+
+
+def test_parse_sampling():
+    assert parse_sampling("webapp=0.05, httpx.client=2,bad,=1") == {"webapp": 0.05, "httpx.client": 1.0}
+
+
+def test_sample_filter():
+    sample = SampleFilter({"webapp": 0.0, "httpx": 1.0})
+    assert not sample.filter(_record("webapp.payload", logging.INFO))
+    assert sample.filter(_record("webapp", logging.WARNING))
+    assert sample.filter(_record("httpx", logging.DEBUG))
+    assert sample.filter(_record("webappx", logging.INFO))
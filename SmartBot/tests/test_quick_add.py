@@ -0,0 +1,55 @@
+from decimal import Decimal
+
+import pytest
+
+import quick_add
+from database import MAX_AMOUNT, category_key
+from quick_add import QuickAddError, parse_quick_add
+
+CATEGORIES = {category_key(name): (i, name) for i, name in enumerate(["Food", "Medical Treatment", "Transport"], 1)}
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    """EUR is worth 2 USD; the categorizer suggests Transport for anything with 'train'."""
+    monkeypatch.setattr(quick_add, "known_currencies", lambda: frozenset({"USD", "EUR"}))
+    monkeypatch.setattr(quick_add, "convert", lambda amount, frm, to: amount * 2 if frm != to else amount)
+    monkeypatch.setattr(
+        quick_add, "suggest_category",
+        lambda user_id, text: ("Transport", "train" in text) if "train" in text or "bus" in text else None,
+    )
+
+
+def test_lines_with_category_currency_and_description():
+    entries = parse_quick_add(1, "120 food lunch with Sam\n 45.5 Medical Treatment pharmacy \n\n30 EUR transport",
+                              CATEGORIES, "USD")
+    assert entries == [
+        (Decimal("120"), "USD", Decimal("120"), 1, "Food", "lunch with Sam"),
+        (Decimal("45.5"), "USD", Decimal("45.5"), 2, "Medical Treatment", "pharmacy"),
+        (Decimal("30"), "EUR", Decimal("60"), 3, "Transport", ""),
+    ]
+
+
+def test_category_predicted_only_when_confident():
+    assert parse_quick_add(1, "1,200 airport train", CATEGORIES, "USD") == [
+        (Decimal("1200"), "USD", Decimal("1200"), 3, "Transport", "airport train")
+    ]
+    with pytest.raises(QuickAddError) as e:
+        parse_quick_add(1, "3 bus", CATEGORIES, "USD")
+    assert "no known category" in e.value.errors[0]
+
+
+def test_every_bad_line_is_reported():
+    text = f"12 food\nabc food\n0 food\n{MAX_AMOUNT + 1} food\n12.345 food\n60000000 EUR food"
+    with pytest.raises(QuickAddError) as e:
+        parse_quick_add(1, text, CATEGORIES, "USD")
+    assert [error.split(":")[0] for error in e.value.errors] == [
+        "Line 2 (abc food)", "Line 3 (0 food)", f"Line 4 ({MAX_AMOUNT + 1} food)",
+        "Line 5 (12.345 food)", "Line 6 (60000000 EUR food)",
+    ]
+    assert "at most" in e.value.errors[2] and "at most" in e.value.errors[4]
+
+
+def test_line_limit():
+    with pytest.raises(QuickAddError):
+        parse_quick_add(1, "1 food\n" * (quick_add.MAX_LINES + 1), CATEGORIES, "USD")
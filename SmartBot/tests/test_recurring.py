@@ -0,0 +1,18 @@
+import pytest
+
+from recurring import parse_frequency
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("monthly 1200 Rent", ("monthly", "1 month", 1)),
+    ("Biweekly 15 cleaning", ("biweekly", "14 days", 1)),
+    ("every 2 weeks 15 EUR cleaning", ("every 2 weeks", "14 days", 3)),
+    ("every 1 month 9 phone", ("every 1 month", "1 months", 3)),
+    ("every 3 years 100 passport", ("every 3 years", "3 years", 3)),
+    ("every 0 days 1 x", None),
+    ("every other week 1 x", None),
+    ("1200 Rent", None),
+    ("", None),
+])
+def test_parse_frequency(text, expected):
+    assert parse_frequency(text.split()) == expected
@@ -0,0 +1,28 @@
+from datetime import date
+from decimal import Decimal
+
+from report import UNCATEGORIZED, build_report, report_months
+
+
+def test_report_months_cross_the_year():
+    assert report_months(date(2026, 2, 17), 4) == ["2025-11", "2025-12", "2026-01", "2026-02"]
+
+
+def test_build_report():
+    months = ["2026-09", "2026-10"]
+    rows = [
+        ("Food", "2026-09", Decimal("10.50"), Decimal("100")),
+        ("Food", "2026-10", Decimal("20"), None),
+        (None, "2026-10", Decimal("40.25"), None),
+        ("Rent", "2026-10", None, Decimal("0")),   # nothing spent or budgeted: left out
+        ("Taxi", "2025-01", Decimal("5"), None),   # outside the months
+    ]
+    assert build_report("EUR", months, rows) == {
+        "type": "report.init",
+        "ui": "report",
+        "cur": "EUR",
+        "months": months,
+        "cats": [UNCATEGORIZED, "Food"],
+        "spent": [[0, 40.25], [10.5, 20]],
+        "budget": [[0, 0], [100, 0]],
+    }
@@ -0,0 +1,309 @@
+# One suite for both storage backends: every test runs against SQLite (a
+# temporary file) and Postgres (the DB_* database; skipped when it is not
+# configured or not reachable). Postgres test users get random ids and are
+# deleted afterwards.
+import random
+import string
+from datetime import date
+from decimal import Decimal
+
+import psycopg2
+import pytest
+
+import bulk
+import database
+from database import category_key, current_period
+from fx import FxError
+from sqlite_repository import SQLiteRepository
+
+
+def _postgres_reachable() -> bool:
+    if not (database.DB_HOST and database.DB_NAME):
+        return False
+    try:
+        psycopg2.connect(
+            host=database.DB_HOST, port=database.DB_PORT, dbname=database.DB_NAME,
+            user=database.DB_USER, password=database.DB_PASSWORD, connect_timeout=2,
+        ).close()
+    except psycopg2.OperationalError:
+        return False
+    return True
+
+
+@pytest.fixture(scope="session")
+def postgres():
+    if not _postgres_reachable():
+        pytest.skip("Postgres (DB_*) not configured or not reachable")
+    from pg_repository import PostgresRepository
+    repo = PostgresRepository()
+    repo.setup()
+    return repo
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def repo(request, tmp_path):
+    if request.param == "sqlite":
+        repo = SQLiteRepository(str(tmp_path / "smartbot.db"))
+        repo.setup()
+        return repo
+    return request.getfixturevalue("postgres")
+
+
+@pytest.fixture
+def user(repo):
+    user_id = random.randrange(10 ** 12, 2 * 10 ** 12)
+    with repo.write(user_id) as store:
+        store.upsert_user("Test")
+        store.ensure_default_categories()
+    yield user_id
+    if repo.name == "postgres":
+        with database.get_db_connection(user_id) as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
+
+
+@pytest.fixture
+def currencies(repo):
+    """Two made-up currency codes; rates loaded for them are removed afterwards."""
+    codes = random.sample(["Z" + a + b for a in string.ascii_uppercase for b in string.ascii_uppercase], 2)
+    yield codes
+    if repo.name == "postgres":
+        with database.get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM fx_rates WHERE currency = ANY(%s)", (codes,))
+
+
+def _categories(repo, user_id) -> dict:
+    with repo.read(user_id) as store:
+        return {category_key(name): (cid, name) for cid, name in store.categories()}
+
+
+def _add(repo, user_id, *rows):
+    """rows: (category name, amount, description) -> ids."""
+    with repo.write(user_id) as store:
+        return store.add_expenses([
+            (store.category_id(name), Decimal(amount), description, False, None, None)
+            for name, amount, description in rows
+        ])
+
+
+def test_category_lookup_ignores_case_and_spaces(repo, user):
+    with repo.write(user) as store:
+        food = store.category_id("Food")
+        assert store.category_id("  fOOd ") == food
+        created = store.category_id("  Eating   out ")
+        assert store.category_id("eating out") == created
+    assert _categories(repo, user)["eating out"][1] == "Eating out"
+
+
+def test_add_and_recent(repo, user):
+    with repo.write(user) as store:
+        first = store.add_expense(store.category_id("Food"), Decimal("12.50"), "lunch")
+    second, third = _add(repo, user, ("Transport", "3", "bus"), ("Food", "7.25", None))
+    with repo.read(user) as store:
+        recent = store.recent_expenses(10)
+    assert [row[0] for row in recent] == [third, second, first]
+    assert recent[-1][1:4] == (Decimal("12.50"), "Food", "lunch")
+
+    with repo.write(user) as store:
+        assert store.delete_expenses([second, 10 ** 15]) == [second]
+    with repo.read(user) as store:
+        assert [row[0] for row in store.recent_expenses(10)] == [third, first]
+
+
+def test_search(repo, user):
+    if repo.name == "postgres":
+        with database.get_db_connection(user) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                if cur.fetchone() is None:
+                    pytest.skip("pg_trgm is not installed")
+    uber, _, taxi = _add(repo, user, ("Transport", "20", "uber to the airport"),
+                         ("Food", "5", "coffee"), ("Taxi", "9", None))
+    with repo.read(user) as store:
+        assert [row[0] for row in store.search("uber", None, 10)] == [uber]
+        # Category names match too.
+        assert taxi in [row[0] for row in store.search("taxi", None, 10)]
+
+
+def test_fx_rate_before_the_first_rate_is_the_earliest(repo, currencies):
+    code, unknown = currencies
+    repo.load_rates(f"2024-01-10,{code},2\n2024-02-10,{code},4\n")
+    assert Decimal(str(repo.fx_rate(code, date(2024, 2, 1)))) == 2
+    assert Decimal(str(repo.fx_rate(code, date(2024, 3, 1)))) == 4
+    assert Decimal(str(repo.fx_rate(code, date(2023, 6, 1)))) == 2
+    assert repo.fx_rate(unknown, date(2024, 3, 1)) is None
+
+
+def test_rebase_without_rates_changes_nothing(repo, user, currencies):
+    code, unknown = currencies
+    repo.load_rates(f"2024-02-10,{code},4\n")
+    with repo.write(user) as store:
+        store.add_expenses([(store.category_id("Food"), Decimal("10"), None, False, code, Decimal("2.50"))])
+    with pytest.raises(FxError):
+        repo.set_base_currency(user, unknown, "USD")
+    with repo.read(user) as store:
+        assert store.base_currency() is None
+        assert store.month_spend(current_period())[0] == Decimal("2.50")
+
+    repo.set_base_currency(user, code, "USD")
+    with repo.read(user) as store:
+        assert store.base_currency() == code
+        assert store.month_spend(current_period())[0] == Decimal("10.00")
+
+
+def test_month_spend_and_budget_items(repo, user):
+    period = current_period()
+    _add(repo, user, ("Food", "10", "a"), ("Food", "5.50", "b"), ("Rent", "500", None))
+    with repo.write(user) as store:
+        store.set_budget(store.category_id("Food"), Decimal("100"), period)
+        store.set_budget(store.category_id("Food"), Decimal("120"), period)
+    with repo.read(user) as store:
+        total, by_category = store.month_spend(period)
+        items = store.budget_items(period)
+    assert total == Decimal("515.50")
+    assert by_category == [("Rent", Decimal("500.00")), ("Food", Decimal("15.50"))]
+    assert [item[:3] for item in items] == [("Food", Decimal("120.00"), Decimal("15.50"))]
+
+
+def test_rollover(repo, user):
+    # A far-off month of its own, so the run (and Postgres' checkpoint) is this test's.
+    period = date(random.randrange(3000, 9000), random.randrange(2, 13), 1)
+    previous = period.replace(month=period.month - 1)
+    with repo.write(user) as store:
+        food, rent = store.category_id("Food"), store.category_id("Rent")
+        store.set_budget(food, Decimal("100"), previous)
+        store.set_budget(rent, Decimal("900"), previous)
+        store.set_budget(rent, Decimal("950"), period)
+    assert repo.rollover_budgets(period) == 1
+    with repo.read(user) as store:
+        items = store.budget_items(period)
+    assert [item[:2] for item in items] == [("Food", Decimal("100.00")), ("Rent", Decimal("950.00"))]
+
+
+def test_rollover_catches_up_missed_months(repo, user):
+    period = date(random.randrange(3000, 9000), random.randrange(4, 13), 1)
+    months = [period.replace(month=period.month - k) for k in (3, 2, 1, 0)]
+    with repo.write(user) as store:
+        food = store.category_id("Food")
+        store.set_budget(food, Decimal("100"), months[0])
+    # The run of the first month finishes, then two months are missed.
+    repo.rollover_budgets(months[0])
+    with repo.write(user) as store:
+        store.set_budget(store.category_id("Rent"), Decimal("900"), months[2])
+    assert repo.rollover_budgets(period) == 4
+    with repo.read(user) as store:
+        assert [[item[:2] for item in store.budget_items(month)] for month in months[1:]] == [
+            [("Food", Decimal("100.00"))],
+            [("Food", Decimal("100.00")), ("Rent", Decimal("900.00"))],
+            [("Food", Decimal("100.00")), ("Rent", Decimal("900.00"))],
+        ]
+
+
+def test_recurring(repo, user):
+    today = date.today()
+    index = today.year * 12 + today.month - 3
+    start = date(index // 12, index % 12 + 1, 1)
+    with repo.write(user) as store:
+        rule_id = store.add_rule(store.category_id("Rent"), Decimal("900"), None, "flat",
+                                 "monthly", "1 month", start)
+    assert repo.materialize_recurring(today, user_id=user)[1] == 3
+    assert repo.materialize_recurring(today, user_id=user)[1] == 0
+    with repo.read(user) as store:
+        recent = store.recent_expenses(10)
+        rules = store.list_rules()
+    assert len(recent) == 3 and all(row[2] == "Rent" for row in recent)
+    assert [(r[0], r[3]) for r in rules] == [(rule_id, "Rent")]
+    assert rules[0][6] > today
+
+    with repo.write(user) as store:
+        assert store.stop_rule(rule_id)
+    with repo.read(user) as store:
+        assert store.list_rules() == []
+
+
+def test_bulk_move_and_undo(repo, user):
+    ids = _add(repo, user, ("Food", "10", "uber eats"), ("Food", "20", "uber eats"),
+               ("Food", "30", "groceries"))
+    selector = bulk.parse_selection("text=uber", _categories(repo, user))
+    with repo.write(user) as store:
+        target = store.category_id("Transport")
+        old = store.change_expenses(selector, "move", target, 10)
+        store.save_undo("move", bulk.pack("move", old))
+    assert [row[0] for row in old] == ids[:2]
+    with repo.read(user) as store:
+        assert store.month_spend(current_period())[1] == [
+            ("Food", Decimal("30.00")), ("Transport", Decimal("30.00"))
+        ]
+
+    with repo.write(user) as store:
+        action, blob, _ = store.take_undo()
+        assert store.revert_expenses(bulk.unpack(action, blob)) == 2
+        assert store.take_undo() is None
+    with repo.read(user) as store:
+        assert store.month_spend(current_period())[1] == [("Food", Decimal("60.00"))]
+
+
+def test_bulk_limit_changes_nothing(repo, user):
+    _add(repo, user, ("Food", "1", "x"), ("Food", "2", "x"), ("Food", "3", "x"))
+    selector = bulk.parse_selection("text=x", _categories(repo, user))
+    with repo.write(user) as store:
+        assert len(store.change_expenses(selector, "delete", None, 2)) == 3
+    with repo.read(user) as store:
+        assert len(store.recent_expenses(10)) == 3
+
+
+def test_bulk_delete_and_restore(repo, user):
+    ids = _add(repo, user, ("Food", "10", "a"), ("Rent", "500", "b"))
+    selector = bulk.parse_selection(f"{ids[0]},{ids[1]}", _categories(repo, user))
+    with repo.write(user) as store:
+        old = store.change_expenses(selector, "delete", None, 10)
+        store.save_undo("delete", bulk.pack("delete", old))
+    with repo.read(user) as store:
+        assert store.recent_expenses(10) == []
+        assert store.month_spend(current_period())[0] == 0
+
+    with repo.write(user) as store:
+        action, blob, _ = store.take_undo()
+        assert store.restore_expenses(bulk.unpack(action, blob)) == 2
+    with repo.read(user) as store:
+        assert sorted(row[0] for row in store.recent_expenses(10)) == ids
+        assert store.month_spend(current_period())[0] == Decimal("510.00")
+
+
+def test_merge_categories(repo, user):
+    period = current_period()
+    _add(repo, user, ("Food", "10", "a"), ("Groceries", "20", "b"), ("Groceries", "5", "c"))
+    with repo.write(user) as store:
+        food, groceries = store.category_id("Food"), store.category_id("Groceries")
+        store.set_budget(food, Decimal("100"), period)
+        store.set_budget(groceries, Decimal("50.25"), period)
+        store.add_rule(groceries, Decimal("5"), None, "box", "weekly", "7 days", date.today())
+        assert store.merge_categories([groceries], food) == (1, 2)
+        assert store.merge_categories([groceries], food) == (0, 0)
+    with repo.read(user) as store:
+        assert "Groceries" not in dict(store.categories()).values()
+        assert store.month_spend(period)[1] == [("Food", Decimal("35.00"))]
+        assert [item[:3] for item in store.budget_items(period)] == [
+            ("Food", Decimal("150.25"), Decimal("35.00"))
+        ]
+        assert [rule[3] for rule in store.list_rules()] == ["Food"]
+
+
+def test_rename_category(repo, user):
+    _add(repo, user, ("Food", "10", "a"))
+    with repo.write(user) as store:
+        assert store.rename_category(store.category_id("Food"), "Eating out")
+        assert not store.rename_category(10 ** 9, "Nope")
+    with repo.read(user) as store:
+        assert store.recent_expenses(1)[0][2] == "Eating out"
+
+
+def test_postgres_connections_are_reused(postgres):
+    backends = set()
+    for _ in range(3):
+        with database.get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_backend_pid()")
+                backends.add(cur.fetchone()[0])
+    assert len(backends) == 1
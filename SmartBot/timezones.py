@@ -0,0 +1,70 @@
+# timezones.py
+import os
+from datetime import date, datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo, available_timezones
+
+from repository import get_repository
+
+# Every user has an IANA time zone (users.timezone, set with /timezone; new
+# users get DEFAULT_TIMEZONE). It decides which day, and so which month, an
+# expense belongs to: expenses.day and expenses.period_month are fixed when
+# the expense is saved, in the zone the user had then, and month filters
+# compare period_month (indexed with user_id) instead of a date range.
+# daily_spend is keyed by the same stored day.
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "UTC")
+# UTC+14 (the Etc/ signs are inverted): the first zone to reach any date.
+EARLIEST_TIMEZONE = "Etc/GMT-14"
+
+_timezones = {}  # user_id -> name
+
+
+@lru_cache(maxsize=None)
+def zone(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
+
+@lru_cache(maxsize=1)
+def _names() -> dict:
+    return {name.lower(): name for name in available_timezones()}
+
+
+def normalize_timezone(name) -> str:
+    """The IANA name for `name` in any case ('europe/berlin' -> 'Europe/Berlin'), or None."""
+    return _names().get((name or "").strip().lower())
+
+
+def local_day(moment: datetime, name: str) -> date:
+    """Calendar day of an aware datetime in zone `name`."""
+    return moment.astimezone(zone(name)).date()
+
+
+def today_in(name: str) -> date:
+    return datetime.now(zone(name)).date()
+
+
+def user_timezone(user_id: int) -> str:
+    name = _timezones.get(user_id)
+    if name is None:
+        with get_repository().read(user_id) as store:
+            name = store.timezone() or DEFAULT_TIMEZONE
+        if len(_timezones) > 100000:
+            _timezones.clear()
+        _timezones[user_id] = name
+    return name
+
+
+def set_user_timezone(user_id: int, name: str):
+    """Switch the user's zone; expenses already saved keep their day."""
+    with get_repository().write(user_id) as store:
+        store.set_timezone(name)
+    _timezones[user_id] = name
+
+
+def user_today(user_id: int) -> date:
+    return today_in(user_timezone(user_id))
+
+
+def user_period(user_id: int) -> date:
+    """First day of the user's current month, in their zone."""
+    return user_today(user_id).replace(day=1)
@@ -0,0 +1,73 @@
+# warmup.py
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import categorizer
+import fx
+from anomaly import load_baselines
+from repository import get_repository
+
+# Before polling starts, main() opens and prepares connections and fills
+# the in-memory caches for the users most likely to write first: those
+# with expenses in the last WARMUP_DAYS, up to WARMUP_USERS of them.
+WARMUP_USERS = int(os.getenv("WARMUP_USERS", "500"))
+WARMUP_DAYS = int(os.getenv("WARMUP_DAYS", "7"))
+WARMUP_WORKERS = int(os.getenv("WARMUP_WORKERS", "8"))
+
+
+def _warm_rates() -> int:
+    """Today's rate of every known currency into fx's memo."""
+    today = date.today()
+    warmed = 0
+    for code in fx.known_currencies():
+        try:
+            fx.convert(1, code, fx.PIVOT, today)
+            warmed += 1
+        except fx.FxError:
+            pass
+    return warmed
+
+
+def warm_up(users: int = WARMUP_USERS) -> dict:
+    """
+    Run every warm-up step and return {step: seconds}. A failing step is
+    logged and skipped: a cold cache is slower, not broken.
+    """
+    repo = get_repository()
+    recent = []
+
+    def recent_users():
+        recent.extend(repo.recent_users(date.today() - timedelta(days=WARMUP_DAYS), users))
+        return len(recent)
+
+    def base_currencies():
+        with ThreadPoolExecutor(max_workers=WARMUP_WORKERS) as ex:
+            return len(list(ex.map(fx.base_currency, recent)))
+
+    def models():
+        return categorizer.preload(recent, WARMUP_WORKERS)
+
+    steps = [
+        ("pool", repo.warm_pool),
+        ("fx rates", _warm_rates),
+        ("recent users", recent_users),
+        ("base currencies", base_currencies),
+        ("categorizer models", models),
+    ]
+    if repo.analytics_jobs:
+        steps.append(("anomaly baselines", load_baselines))
+
+    timings = {}
+    for name, step in steps:
+        t0 = time.perf_counter()
+        try:
+            result = step()
+        except Exception:
+            logging.exception("Warm-up step %r failed", name)
+            continue
+        timings[name] = time.perf_counter() - t0
+        logging.info("Warm-up %s: %s in %.2fs", name, result, timings[name])
+    return timings
@@ -1,12 +1,18 @@
 // webapp/src/BudgetApp.jsx
-import React, { useEffect, useMemo, useState } from 'react'
+import React, { useEffect, useMemo, useRef, useState } from 'react'
 
 const tg = window?.Telegram?.WebApp
 
+// One key per opened WebApp: the bot answers repeats of it from cache.
+function newIdemKey() {
+  return crypto?.randomUUID?.() ?? `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`
+}
+
 export default function BudgetApp() {
-  const [rows, setRows] = useState([]) // [{id, name, setBudget, used, inHand}]
+  const [rows, setRows] = useState([]) // [{id, name, setBudget, used, inHand, projected, overrunDate}]
   const [dirty, setDirty] = useState(false)
   const [loading, setLoading] = useState(true)
+  const idemRef = useRef(newIdemKey())
 
  useEffect(() => {
   tg?.ready?.();
@@ -33,6 +39,8 @@ export default function BudgetApp() {
             name: r.name,
             setBudget: Number(r.setBudget || 0),
             used: Number(r.used || 0),
+            projected: r.projected ?? null,
+            overrunDate: r.overrunDate ?? null,
           }));
           setRows(mapped.map(r => ({ ...r, inHand: Number(r.setBudget) - Number(r.used) })));
           setLoading(false);
@@ -73,7 +81,8 @@ useEffect(() => {
   const totals = useMemo(() => {
     const setSum = rows.reduce((a, r) => a + Number(r.setBudget || 0), 0)
     const usedSum = rows.reduce((a, r) => a + Number(r.used || 0), 0)
-    return { setSum, usedSum, inHand: setSum - usedSum }
+    const projected = rows.reduce((a, r) => a + Number(r.projected ?? r.used ?? 0), 0)
+    return { setSum, usedSum, inHand: setSum - usedSum, projected }
   }, [rows])
 
   const onSetBudgetChange = (i, val) => {
@@ -93,6 +102,7 @@ const onSave = () => {
   try {
     const payload = {
       type: 'budget.save',
+      idem: idemRef.current,
       items: rows.map(({ id, name, setBudget }) => ({
         id,
         name,
@@ -123,27 +133,33 @@ const onSave = () => {
       {loading ? <div>Loading…</div> : (
         <div className="space-y-3">
           <div className="border rounded">
-            <div className="grid grid-cols-4 font-semibold p-2 bg-gray-100">
+            <div className="grid grid-cols-5 font-semibold p-2 bg-gray-100">
               <div>Category</div>
               <div>Set Budget</div>
               <div>Used</div>
               <div>In Hand</div>
+              <div>Projected</div>
             </div>
             {rows.map((r, i) => (
-              <div key={r.id} className="grid grid-cols-4 p-2 border-t items-center">
+              <div key={r.id} className="grid grid-cols-5 p-2 border-t items-center">
                 <div>{r.name}</div>
                 <div>
                   <input type="number" min={0} value={r.setBudget} onChange={e => onSetBudgetChange(i, e.target.value)} className="w-full border rounded p-1" />
                 </div>
                 <div>{Number(r.used).toFixed(2)}</div>
                 <div>{Number(r.inHand).toFixed(2)}</div>
+                <div>
+                  {r.projected == null ? '—' : Number(r.projected).toFixed(2)}
+                  {r.overrunDate && <div className="text-red-600">over by {r.overrunDate}</div>}
+                </div>
               </div>
             ))}
-            <div className="grid grid-cols-4 p-2 border-t font-semibold">
+            <div className="grid grid-cols-5 p-2 border-t font-semibold">
               <div>Total</div>
               <div>{totals.setSum.toFixed(2)}</div>
               <div>{totals.usedSum.toFixed(2)}</div>
               <div>{totals.inHand.toFixed(2)}</div>
+              <div>{totals.projected.toFixed(2)}</div>
             </div>
           </div>
 
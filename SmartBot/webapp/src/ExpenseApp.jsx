@@ -1,8 +1,13 @@
 // src/ExpenseApp.jsx
-import React, { useMemo, useState, useEffect } from 'react';
+import React, { useMemo, useState, useEffect, useRef } from 'react';
 
 const tg = window.Telegram?.WebApp;
 
+// One key per opened WebApp: the bot answers repeats of it from cache.
+function newIdemKey() {
+  return crypto?.randomUUID?.() ?? `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
 function b64urlDecode(s) {
   if (!s) return '';
   s = s.replace(/-/g, '+').replace(/_/g, '/');
@@ -17,6 +22,9 @@ export default function ExpenseApp() {
   const [category, setCategory] = useState('');
   const [cats, setCats] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [searchText, setSearchText] = useState('');
+  const [currency, setCurrency] = useState(''); // empty = your base currency
+  const idemRef = useRef(newIdemKey());
 
   useEffect(() => {
     tg?.ready?.();
@@ -40,24 +48,27 @@ export default function ExpenseApp() {
   }, []);
 
   useEffect(() => {
-    const valid = Number(amount) > 0 && category;
+    // Without a category the bot guesses one from the description.
+    const valid = Number(amount) > 0 && category !== '__ADD_NEW__' && (category || desc.trim());
     if (valid) tg?.MainButton?.show?.(); else tg?.MainButton?.hide?.();
-  }, [amount, category]);
+  }, [amount, category, desc]);
 
   useEffect(() => {
     if (!tg) return;
     const onMainButton = () => onSave();
     tg.onEvent?.('mainButtonClicked', onMainButton);
     return () => tg.offEvent?.('mainButtonClicked', onMainButton);
-  }, [amount, desc, category]);
+  }, [amount, desc, category, currency]);
 
  const onSave = () => {
   try {
     const payload = {
       type: 'expense.add',            // 👈👈 এটা ঠিক এইটাই হবে
+      idem: idemRef.current,
       amount: Number(amount),
       description: desc || '',
       category,
+      currency: currency.trim().toUpperCase(),
     };
     tg?.showAlert?.('Saving your expense…');
     tg?.sendData?.(JSON.stringify(payload));
@@ -69,7 +80,14 @@ export default function ExpenseApp() {
 
 
   const onViewLast10 = () => {
-    tg?.sendData?.(JSON.stringify({ type: 'expense.view' }));
+    tg?.sendData?.(JSON.stringify({ type: 'expense.view', idem: idemRef.current }));
+    tg?.close?.();
+  };
+
+  const onSearch = () => {
+    const query = searchText.trim();
+    if (!query) return;
+    tg?.sendData?.(JSON.stringify({ type: 'expense.search', query, idem: idemRef.current }));
     tg?.close?.();
   };
 
@@ -94,6 +112,14 @@ export default function ExpenseApp() {
           onChange={e => setAmount(e.target.value)}
           style={{ padding: 8, width: 180 }}
         />
+        <input
+          type="text"
+          placeholder="CUR"
+          maxLength={3}
+          value={currency}
+          onChange={e => setCurrency(e.target.value)}
+          style={{ padding: 8, width: 60, marginLeft: 8, textTransform: 'uppercase' }}
+        />
       </div>
 
       <div style={{ marginTop: 12 }}>
@@ -114,7 +140,7 @@ export default function ExpenseApp() {
           onChange={e => setCategory(e.target.value)}
           style={{ padding: 8, width: 200 }}
         >
-          <option value="">-- select --</option>
+          <option value="">-- auto (from description) --</option>
           {cats.map((c) => (
             <option key={c} value={c}>{c}</option>
           ))}
@@ -132,6 +158,17 @@ export default function ExpenseApp() {
         <button onClick={onViewLast10}>View last 10</button>
       </div>
 
+      <div style={{ marginTop: 16, display: 'flex', gap: 8 }}>
+        <input
+          type="search"
+          placeholder="search description or category"
+          value={searchText}
+          onChange={e => setSearchText(e.target.value)}
+          style={{ padding: 8, width: 240 }}
+        />
+        <button onClick={onSearch} disabled={!searchText.trim()}>Search</button>
+      </div>
+
       <p style={{ marginTop: 12, opacity: 0.7 }}>
         Only categories that have a monthly budget appear here.
       </p>
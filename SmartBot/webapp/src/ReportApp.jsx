@@ -0,0 +1,144 @@
+// src/ReportApp.jsx
+import React, { useEffect, useMemo, useState } from 'react'
+
+const tg = window?.Telegram?.WebApp
+
+const COLORS = ['#4e79a7', '#f28e2b', '#59a14f', '#e15759', '#76b7b2', '#edc948', '#b07aa1', '#ff9da7', '#9c755f', '#bab0ac']
+
+// UTF-8 safe Base64URL decode (category names may be non-ASCII)
+function b64urlToUtf8(s) {
+  if (!s) return ''
+  s = s.replace(/-/g, '+').replace(/_/g, '/')
+  const pad = s.length % 4
+  if (pad) s += '='.repeat(4 - pad)
+  const bin = atob(s)
+  const bytes = new Uint8Array(bin.length)
+  for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i)
+  return new TextDecoder('utf-8').decode(bytes)
+}
+
+// Payload (built by report.py): months[], cats[], spent[cat][month], budget[cat][month]
+function readReport() {
+  try {
+    const p = new URLSearchParams(window.location.search).get('payload')
+    const d = p ? JSON.parse(b64urlToUtf8(p)) : null
+    if (d?.type === 'report.init' && Array.isArray(d.months) && Array.isArray(d.cats)) return d
+  } catch (e) { /* bad payload: show the hint below */ }
+  return null
+}
+
+function monthLabel(key, long = false) {
+  const [y, m] = key.split('-').map(Number)
+  return new Date(y, m - 1, 1).toLocaleString(undefined, long ? { month: 'long', year: 'numeric' } : { month: 'short' })
+}
+
+const money = n => Number(n || 0).toFixed(2)
+
+function MonthlyChart({ report, totals, selected, onSelect }) {
+  const W = 360, H = 170, top = 10, base = H - 18
+  const max = Math.max(1, ...totals)
+  const bw = W / report.months.length
+  return (
+    <svg viewBox={`0 0 ${W} ${H}`} width="100%" role="img" aria-label="Spend per month">
+      {report.months.map((m, i) => {
+        let y = base
+        return (
+          <g key={m} onClick={() => onSelect(i)} style={{ cursor: 'pointer' }} opacity={i === selected ? 1 : 0.5}>
+            <rect x={i * bw} y={top} width={bw} height={base - top} fill="transparent" />
+            {report.cats.map((c, ci) => {
+              const h = (report.spent[ci][i] || 0) / max * (base - top)
+              y -= h
+              return <rect key={c} x={i * bw + 3} y={y} width={bw - 6} height={h} fill={COLORS[ci % COLORS.length]} />
+            })}
+            <text x={i * bw + bw / 2} y={H - 4} fontSize="10" textAnchor="middle">{monthLabel(m)}</text>
+          </g>
+        )
+      })}
+    </svg>
+  )
+}
+
+function BudgetBars({ report, month }) {
+  const rows = report.cats
+    .map((name, ci) => ({ name, ci, used: report.spent[ci][month] || 0, budget: report.budget[ci][month] || 0 }))
+    .filter(r => r.used || r.budget)
+  if (!rows.length) return <div style={{ opacity: 0.7 }}>Nothing spent or budgeted this month.</div>
+  const max = Math.max(1, ...rows.map(r => Math.max(r.used, r.budget)))
+  return (
+    <div>
+      {rows.map(r => {
+        const over = r.budget > 0 && r.used > r.budget
+        return (
+          <div key={r.name} style={{ marginBottom: 8 }}>
+            <div style={{ display: 'flex', justifyContent: 'space-between', fontSize: 13 }}>
+              <span>{r.name}</span>
+              <span style={{ color: over ? '#d33' : undefined }}>
+                {money(r.used)}{r.budget ? ` / ${money(r.budget)}` : ''}
+              </span>
+            </div>
+            <div style={{ position: 'relative', height: 10, background: '#eee', borderRadius: 5 }}>
+              <div style={{
+                position: 'absolute', left: 0, top: 0, bottom: 0, borderRadius: 5,
+                width: `${r.used / max * 100}%`, background: over ? '#e15759' : COLORS[r.ci % COLORS.length],
+              }} />
+              {r.budget > 0 && (
+                <div style={{ position: 'absolute', top: -2, bottom: -2, width: 2, background: '#333', left: `${r.budget / max * 100}%` }} />
+              )}
+            </div>
+          </div>
+        )
+      })}
+    </div>
+  )
+}
+
+export default function ReportApp() {
+  const report = useMemo(readReport, [])
+  const [month, setMonth] = useState(report ? report.months.length - 1 : 0)
+
+  useEffect(() => {
+    tg?.ready?.()
+    tg?.MainButton?.hide?.()
+  }, [])
+
+  const totals = useMemo(
+    () => report ? report.months.map((_, i) => report.spent.reduce((a, col) => a + (col[i] || 0), 0)) : [],
+    [report],
+  )
+
+  if (!report) {
+    return <div style={{ padding: 16 }}>No report data. Open the report from the bot (/report).</div>
+  }
+
+  const budgetTotal = report.budget.reduce((a, col) => a + (col[month] || 0), 0)
+  const average = totals.reduce((a, t) => a + t, 0) / (totals.length || 1)
+
+  return (
+    <div style={{ padding: 16, fontFamily: 'system-ui, Arial' }}>
+      <h2>Spending Report</h2>
+      <div style={{ opacity: 0.7, marginBottom: 8 }}>
+        Last {report.months.length} months, {report.cur} · monthly average {money(average)}
+      </div>
+
+      <MonthlyChart report={report} totals={totals} selected={month} onSelect={setMonth} />
+
+      <div style={{ display: 'flex', flexWrap: 'wrap', gap: 8, fontSize: 12, margin: '8px 0 16px' }}>
+        {report.cats.map((c, ci) => (
+          <span key={c}>
+            <span style={{ display: 'inline-block', width: 10, height: 10, marginRight: 4, background: COLORS[ci % COLORS.length] }} />
+            {c}
+          </span>
+        ))}
+      </div>
+
+      <h3 style={{ marginBottom: 4 }}>{monthLabel(report.months[month], true)}</h3>
+      <div style={{ marginBottom: 12 }}>
+        Spent {money(totals[month])} {report.cur}
+        {budgetTotal > 0 && ` of ${money(budgetTotal)} budgeted`}
+      </div>
+      <BudgetBars report={report} month={month} />
+
+      <p style={{ marginTop: 12, opacity: 0.7 }}>Tap a month to see its budget vs. used.</p>
+    </div>
+  )
+}
@@ -0,0 +1,6 @@
+import React from 'react'
+import ReactDOM from 'react-dom/client'
+import ReportApp from './ReportApp.jsx'
+ReactDOM.createRoot(document.getElementById('root')).render(
+  <React.StrictMode><ReportApp /></React.StrictMode>
+)
@@ -5,6 +5,7 @@ export default {
       input: {
         main:    resolve(__dirname, 'index.html'),
         expense: resolve(__dirname, 'expense.html'),
+        report:  resolve(__dirname, 'report.html'),
       },
     },
   },